@@ -1,7 +1,15 @@
-import time
-import numpy as np
-import instruments
+import os
+if os.environ.get('SIMULATED_INSTRUMENTS'):  # run without hardware, see simulated_instruments.py
+    import simulated_instruments as instruments
+else:
+    import instruments
+
+import shutil
 import matplotlib.pyplot as plt
+from convert_run import write_txt
+from data_store import ColumnStore, RunFile, RunReader, set_aside_run
+from experiment import Experiment, ExperimentRunner, HeadlessRig, switching_steps
+from settle import Settle
 
 from tkinter import filedialog as dialog
 
@@ -14,221 +22,129 @@ probe_current = 200e-6
 n_points = 1000
 n_loops = 2
 
-sb = instruments.SwitchBox()
-dmm = instruments.K2000()
-pg = instruments.K2461()
-scope = instruments.DS1104()
+# The standard pulse one way, measure, pulse the other way, measure protocol (see experiment.py), downloading the
+# shunt resistor (channel 1), Rxx (2) and Rxy (3) signals after each pulse. Channel 4 is the trigger. All three are
+# kept in volts as read, the runner's pulse current is turned back into the volts across the 50 ohm shunt.
+experiment = Experiment(switching_steps(n_loops),
+                        {'pulse1': pulse1_assignments, 'pulse2': pulse2_assignments, 'measure': measure_assignments},
+                        pulse={'magnitude': pulse_voltage, 'width': pulse_width, 'volts': True},
+                        measure={'current': probe_current, 'n': n_points})
+
+rig = HeadlessRig()
+rig.scope_enabled = True
+rig.scope_channels = (1, 2, 3)
+# Minimum waits and timeouts around each pulse. Each wait ends as soon as the instruments report they are ready.
+rig.pre_pulse_settle = Settle('Pre pulse', minimum=50e-3, timeout=200e-3)
+rig.post_pulse_settle = Settle('Post pulse', minimum=50e-3, timeout=200e-3)
+rig.measure_settle = Settle('Measure', minimum=100e-3, timeout=500e-3)
 error_sound = instruments.error_sound
 alert_sound = instruments.alert_sound
 
-sb.connect()
-dmm.connect()
-pg.connect()
-scope.connect()
-
-scope.set_trig_chan(4)
-scope.prepare_for_4channel_pulse()
-dmm.prepare_measure_one()
-t_pos = np.array([])
-t_scope_pos = np.array([])
-Rxy_pos = np.array([])
-Rxx_pos = np.array([])
-Rxy_scope_pos = np.array([])
-Rxx_scope_pos = np.array([])
-I_scope_pos = np.array([])
-t_neg = np.array([])
-t_scope_neg = np.array([])
-Rxy_neg = np.array([])
-Rxx_neg = np.array([])
-Rxy_scope_neg = np.array([])
-Rxx_scope_neg = np.array([])
-I_scope_neg = np.array([])
+rig.sb.connect()
+rig.dmm.connect()
+rig.pg.connect()
+rig.scope.connect()
+
+rig.scope.set_trig_chan(4)
+rig.scope.prepare_for_4channel_pulse()
+rig.scope_reader.invalidate()  # vertical scales have changed
+
+columns = {'pos': ('time', 'rxx', 'rxy'), 'neg': ('time', 'rxx', 'rxy'),
+           'pos_scope': ('time', 'shunt_signal', 'rxx_signal', 'rxy_signal'),
+           'neg_scope': ('time', 'shunt_signal', 'rxx_signal', 'rxy_signal')}
+for old_name in set_aside_run('temp_run.npz'):  # an earlier run that was never saved or died
+    print(f'Run file from an earlier run kept as {old_name}')
+run = RunFile('temp_run.npz', experiment.to_dict())
+stores = {}
+for dataset, names in columns.items():
+    run.declare(dataset, names)
+    stores[dataset] = ColumnStore(names)
 
 myfig = plt.figure("all plots")
 rxx_ax = plt.subplot(221)
 rxx_ax.clear()
-rxx_pos_line, = rxx_ax.plot(t_pos, Rxx_pos, 'k.')
-rxx_neg_line, = rxx_ax.plot(t_neg, Rxx_neg, 'r.')
 # rxx_ax.set_xlabel('Time (s)')
 rxx_ax.set_ylabel('R_xx (Ohms)')
 rxx_ax.ticklabel_format(useOffset=False)
 
 rxy_ax = plt.subplot(222)
 rxy_ax.clear()
-rxy_pos_line, = rxy_ax.plot(t_pos, Rxy_pos, 'k.')
-rxy_neg_line, = rxy_ax.plot(t_neg, Rxy_neg, 'r.')
 rxy_ax.set_xlabel('Time (s)')
 rxy_ax.set_ylabel('R_xy (Ohms)')
 rxy_ax.ticklabel_format(useOffset=False)
-plt.show(block=False)
 
 scope_ax1 = plt.subplot(324)
 scope_ax1.clear()
-scope_pos_line1, = scope_ax1.plot(t_scope_pos, I_scope_pos, 'k.')
-scope_neg_line1, = scope_ax1.plot(t_scope_neg, I_scope_neg, 'r.')
 # scope_ax1.set_xlabel('Time (s)')
 scope_ax1.set_ylabel('50ohm Signal (V)')
 scope_ax1.ticklabel_format(useOffset=False)
 
 scope_ax2 = plt.subplot(325)
 scope_ax2.clear()
-scope_pos_line2, = scope_ax2.plot(t_scope_pos, Rxx_scope_pos, 'k.')
-scope_neg_line2, = scope_ax2.plot(t_scope_neg, Rxx_scope_neg, 'r.')
 # scope_ax2.set_xlabel('Time (s)')
 scope_ax2.set_ylabel('Rxx Signal (V)')
 scope_ax2.ticklabel_format(useOffset=False)
-plt.show(block=False)
 
 scope_ax3 = plt.subplot(326)
 scope_ax3.clear()
-scope_pos_line3, = scope_ax3.plot(t_scope_pos, Rxy_scope_pos, 'k.')
-scope_neg_line3, = scope_ax3.plot(t_scope_neg, Rxy_scope_neg, 'r.')
 scope_ax3.set_xlabel('Time (s)')
 scope_ax3.set_ylabel('Rxy Signal (V)')
 scope_ax3.ticklabel_format(useOffset=False)
+
+# The column of each dataset every line shows, pos in black and neg in red.
+lines = {}
+for polarity, style in (('pos', 'k.'), ('neg', 'r.')):
+    lines[polarity, 'rxx'], = rxx_ax.plot([], [], style)
+    lines[polarity, 'rxy'], = rxy_ax.plot([], [], style)
+    lines[f'{polarity}_scope', 'shunt_signal'], = scope_ax1.plot([], [], style)
+    lines[f'{polarity}_scope', 'rxx_signal'], = scope_ax2.plot([], [], style)
+    lines[f'{polarity}_scope', 'rxy_signal'], = scope_ax3.plot([], [], style)
 plt.show(block=False)
 
 mng = plt.get_current_fig_manager()
 mng.frame.Maximize(True)
 plt.pause(0.001)
 
-start_time = time.time()
-for loop_count in range(n_loops):
-    print('Loop count:', loop_count + 1, 'Pulse: 1')
-    sb.switch(pulse1_assignments)
-    scope.single_trig()
-    pg.prepare_pulsing_voltage(pulse_voltage, pulse_width)
-    pg.set_ext_trig()
-    time.sleep(200e-3)
-    pulse_t = time.time()
-    pg.send_pulse()
-    time.sleep(200e-3)
-    sb.switch(measure_assignments)
-    pg.enable_4_wire_probe(probe_current)
-    time.sleep(500e-3)
-    t = np.zeros(n_points)
-    vxx = np.zeros(n_points)
-    vxy = np.zeros(n_points)
-    curr = np.zeros(n_points)
-    for meas_count in range(n_points):
-        t[meas_count] = time.time()
-        pg.trigger_before_fetch()
-        dmm.trigger()
-        vxx[meas_count], curr[meas_count] = pg.fetch_one()
-        vxy[meas_count] = dmm.fetch_one()
-    pg.disable_probe_current()
-    t_pos = np.append(t_pos, t - start_time)
-    Rxx_pos = np.append(Rxx_pos, vxx / curr)
-    Rxy_pos = np.append(Rxy_pos, vxy / curr)
-    scope_data = scope.get_data(30001, 60000, 1)
-    I_scope_pos = np.append(I_scope_pos, scope_data)
-    scope_data = scope.get_data(30001, 60000, 2)
-    Rxx_scope_pos = np.append(Rxx_scope_pos, scope_data)
-    scope_data = scope.get_data(30001, 60000, 3)
-    Rxy_scope_pos = np.append(Rxy_scope_pos, scope_data)
-    time_step = float(scope.get_time_inc())
-    scope_time = np.array(range(0, len(scope_data))) * time_step + pulse_t - start_time
-    t_scope_pos = np.append(t_scope_pos, scope_time)
-
-    rxx_pos_line.set_data(t_pos, Rxx_pos)
-    rxy_pos_line.set_data(t_pos, Rxy_pos)
-    scope_pos_line1.set_data(t_scope_pos, I_scope_pos)
-    scope_pos_line2.set_data(t_scope_pos, Rxx_scope_pos)
-    scope_pos_line3.set_data(t_scope_pos, Rxy_scope_pos)
-    rxx_ax.relim()
-    rxx_ax.autoscale_view()
-    rxy_ax.relim()
-    rxy_ax.autoscale_view()
-    scope_ax1.relim()
-    scope_ax1.autoscale_view()
-    scope_ax2.relim()
-    scope_ax2.autoscale_view()
-    scope_ax3.relim()
-    scope_ax3.autoscale_view()
 
+def on_data(dataset, *data):
+    if dataset.endswith('_scope'):
+        t, current, *signals = data
+        data = (t, current * rig.reference_resistance, *signals)
+    run.append(dataset, *data)
+    store = stores[dataset]
+    store.append(*data)
+    for (line_dataset, column), line in lines.items():
+        if line_dataset == dataset:
+            line.set_data(store['time'], store[column])
+    for ax in (rxx_ax, rxy_ax, scope_ax1, scope_ax2, scope_ax3):
+        ax.relim()
+        ax.autoscale_view()
     myfig.canvas.draw()
     plt.pause(0.01)
 
-    print('Loop count:', loop_count + 1, 'Pulse: 2')
-    sb.switch(pulse2_assignments)
-    scope.single_trig()
-    pg.prepare_pulsing_voltage(pulse_voltage, pulse_width)
-    pg.set_ext_trig()
-    time.sleep(200e-3)
-    pulse_t = time.time()
-    pg.send_pulse()
-    time.sleep(200e-3)
-    sb.switch(measure_assignments)
-    pg.enable_4_wire_probe(probe_current)
-    time.sleep(500e-3)
-    t = np.zeros(n_points)
-    vxx = np.zeros(n_points)
-    vxy = np.zeros(n_points)
-    curr = np.zeros(n_points)
-    for meas_count in range(n_points):
-        t[meas_count] = time.time()
-        pg.trigger_before_fetch()
-        dmm.trigger()
-        vxx[meas_count], curr[meas_count] = pg.fetch_one()
-        vxy[meas_count] = dmm.fetch_one()
-    pg.disable_probe_current()
-    t_neg = np.append(t_neg, t - start_time)
-    Rxx_neg = np.append(Rxx_neg, vxx / curr)
-    Rxy_neg = np.append(Rxy_neg, vxy / curr)
-    scope_data = scope.get_data(30001, 60000, 1)
-    I_scope_neg = np.append(I_scope_neg, scope_data)
-    scope_data = scope.get_data(30001, 60000, 2)
-    Rxx_scope_neg = np.append(Rxx_scope_neg, scope_data)
-    scope_data = scope.get_data(30001, 60000, 3)
-    Rxy_scope_neg = np.append(Rxy_scope_neg, scope_data)
-    time_step = float(scope.get_time_inc())
-    scope_time = np.array(range(0, len(scope_data))) * time_step + pulse_t - start_time
-    t_scope_neg = np.append(t_scope_neg, scope_time)
-
-    rxx_neg_line.set_data(t_neg, Rxx_neg)
-    rxy_neg_line.set_data(t_neg, Rxy_neg)
-    scope_neg_line1.set_data(t_scope_neg, I_scope_neg)
-    scope_neg_line2.set_data(t_scope_neg, Rxx_scope_neg)
-    scope_neg_line3.set_data(t_scope_neg, Rxy_scope_neg)
-    rxx_ax.relim()
-    rxx_ax.autoscale_view()
-    rxy_ax.relim()
-    rxy_ax.autoscale_view()
-    scope_ax1.relim()
-    scope_ax1.autoscale_view()
-    scope_ax2.relim()
-    scope_ax2.autoscale_view()
-    scope_ax3.relim()
-    scope_ax3.autoscale_view()
 
-    myfig.canvas.draw()
-    plt.pause(0.01)
+runner = ExperimentRunner(rig, experiment, on_data=on_data)
+runner.run()
+run.close()
 
-sb.reset_all()
+rig.sb.reset_all()
 alert_sound()
-data = np.column_stack(
-    (t_pos,
-     Rxx_pos,
-     Rxy_pos,
-     t_neg,
-     Rxx_neg,
-     Rxy_neg,
-     t_scope_pos,
-     I_scope_pos,
-     Rxx_scope_pos,
-     Rxy_scope_pos,
-     t_scope_neg,
-     I_scope_neg,
-     Rxx_scope_neg,
-     Rxy_scope_neg,
-     ))
-name = dialog.asksaveasfilename(title='Save')
-if name:  # if a name was entered, don't save otherwise
+runner.report()
+for settle in (rig.pre_pulse_settle, rig.post_pulse_settle, rig.measure_settle):
+    settle.report()
+name = dialog.asksaveasfilename(title='Save', filetypes=(('text files', '*.txt'), ('run files', '*.npz')))
+if not name:  # if a name was entered, don't save otherwise
+    print('Data not saved, it is still in temp_run.npz')
+elif name.endswith('.npz'):
+    shutil.move('temp_run.npz', name)
+    print(f'Data saved as {name}')
+else:
     if name[-4:] != '.txt':  # add .txt if not already there
         name = f'{name}.txt'
-    np.savetxt(name, data, newline='\r\n', delimiter='\t')  # save
+    # One file as this script has always saved: pos, neg, pos scope and neg scope side by side (14 columns), the
+    # shorter ones padded with nan
+    run = RunReader('temp_run.npz')
+    write_txt(name, [run.data(dataset) for dataset in ('pos', 'neg', 'pos_scope', 'neg_scope')], newline='\r\n')
     print(f'Data saved as {name}')
-else:
-    print('Data not saved')
 
-plt.show()
\ No newline at end of file
+plt.show()
@@ -1,13 +1,26 @@
 import sys
+import threading
 import time
-from tqdm import tqdm
-import instruments
+import os
+import shutil
+if os.environ.get('SIMULATED_INSTRUMENTS'):  # run without hardware, see simulated_instruments.py
+    import simulated_instruments as instruments
+else:
+    import instruments
 import matplotlib
 import matplotlib.pyplot as plt
 import numpy as np
 import pyvisa
 import serial
 from PyQt5 import QtCore, QtWidgets, uic
+from convert_run import convert
+from data_store import ColumnStore, RunFile, RunReader, set_aside_run
+from experiment import Experiment, ExperimentRunner, Rig, switching_steps
+from instrument_trace import TraceLog, trace
+from live_plot import LivePlotter
+from scope_acquisition import ScopeReader
+from switchbox_tools import StatefulSwitchBox, plan_order, print_plan
+from tec_tools import StabilityWaiter, TecSampler
 
 # Todo: replace tkinter boxes with qt
 
@@ -17,7 +30,7 @@ error_sound = instruments.error_sound
 alert_sound = instruments.alert_sound
 
 
-class DataCollector(QtCore.QObject):
+class DataCollector(QtCore.QObject, Rig):
     finished = QtCore.pyqtSignal()
     pos_data_ready = QtCore.pyqtSignal(np.ndarray, np.ndarray, np.ndarray)
     pos_scope_data_ready = QtCore.pyqtSignal(np.ndarray, np.ndarray)
@@ -27,21 +40,31 @@ class DataCollector(QtCore.QObject):
     neg_tec_data_ready = QtCore.pyqtSignal(np.ndarray, np.ndarray)
     finished_res_measurement = QtCore.pyqtSignal(np.ndarray, np.ndarray)
     stable = QtCore.pyqtSignal()
+    not_stable = QtCore.pyqtSignal(str)  # why the temperature control did not get stable
+    temperature_progress = QtCore.pyqtSignal(float, float, float)  # temperature, dT/dt (K/s), seconds until stable
 
     mutex = QtCore.QMutex()
     mutex.lock()
     is_stopped = False
     mutex.unlock()
 
-    sb = instruments.SwitchBox()
-    bb = instruments.BalanceBox()
-    dmm = instruments.K2000()
-    pg = instruments.K2461()
-    scope = instruments.DS1104()
-    tec = instruments.TEC1089SV()
-
-    scope_enabled = False
-    tec_enabled = False
+    # Set INSTRUMENT_TRACE to a file name to log every instrument call (see instrument_trace.py).
+    trace_log = TraceLog.from_environment()
+    # Only switches if the assignment is not already made (see switchbox_tools.py).
+    sb = StatefulSwitchBox(trace(instruments.SwitchBox(), 'sb', trace_log))
+    bb = trace(instruments.BalanceBox(), 'bb', trace_log)
+    dmm = trace(instruments.K2000(), 'dmm', trace_log)
+    pg = trace(instruments.K2461(), 'pg', trace_log)
+    scope = trace(instruments.DS1104(), 'scope', trace_log)
+    scope_reader = ScopeReader(scope)
+    tec = trace(instruments.TEC1089SV(), 'tec', trace_log)
+    # Logs the tec temperature in the background during a run, see measure_block.
+    tec_sampler = TecSampler(tec, interval=0.25)
+    stability_timeout = 3600  # s to wait for the temperature to settle before giving up
+    temperature_wait_cancelled = threading.Event()  # set from the gui thread to stop waiting for stability
+
+    # The flags (scope_enabled, buffered_enabled, concurrent_fetch...), settles and measurement methods come from
+    # experiment.Rig.
     # default 8 arms
     # pulse1_assignments = {"I+": "B", "I-": "F"}  # configuration for a pulse from B to F
     # pulse2_assignments = {"I+": "D", "I-": "H"}  # configuration for a pulse from D to H
@@ -93,7 +116,8 @@ class DataCollector(QtCore.QObject):
     @QtCore.pyqtSlot(str, str, str, str, str, str, str, str, str, tuple)
     def start_measurement(self, mode, sb_port, bb_port, dmm_port, pulse_mag, pulse_width, meas_curr, meas_n, loop_n,
                           checkboxes):
-        bb_enabled, scope_enabled = checkboxes
+        bb_enabled, scope_enabled, buffered_enabled = checkboxes
+        self.buffered_enabled = buffered_enabled
         self.mutex.lock()
         self.is_stopped = False
         self.mutex.unlock()
@@ -112,8 +136,19 @@ class DataCollector(QtCore.QObject):
         if error_flag:
             return
 
-        self.pulse_and_measure(pulse_volts, pulse_mag, pulse_width, meas_curr,
-                               meas_n, loop_n)
+        if self.tec_enabled:
+            self.tec_sampler.start()
+        try:
+            self.pulse_and_measure(pulse_volts, pulse_mag, pulse_width, meas_curr,
+                                   meas_n, loop_n)
+        finally:  # otherwise the sampler thread keeps polling the tec after an error
+            self.tec_sampler.stop()
+        self.runner.report()
+        for settle in (self.pre_pulse_settle, self.post_pulse_settle, self.measure_settle):
+            settle.report()
+        self.sb.report()
+        if self.trace_log is not None:
+            self.trace_log.flush()
 
         self.sb.close()
         if bb_enabled:
@@ -155,9 +190,12 @@ class DataCollector(QtCore.QObject):
         two_wires = np.zeros(len(self.two_wire_assignments))
         four_wires = np.zeros(len(self.four_wire_assignments))
 
-        for i in range(len(self.two_wire_assignments)):
-            self.sb.switch(self.two_wire_assignments[i])
-            time.sleep(0.3)
+        # Each list is measured in the order that changes the fewest relays, results stay in the listed order.
+        two_wire_order = plan_order(self.two_wire_assignments, self.sb.assignment)
+        print_plan(self.two_wire_assignments, two_wire_order, self.sb.assignment, switch_time=0.3)
+        for i in two_wire_order:
+            if self.sb.switch(self.two_wire_assignments[i]):
+                time.sleep(0.3)
             self.pg.enable_2_wire_probe(meas_curr)
             time.sleep(0.2)
             c, v = self.pg.read_one()
@@ -165,9 +203,11 @@ class DataCollector(QtCore.QObject):
             self.pg.disable_probe_current()
         print('Two Wires: ', two_wires)
 
-        for i in range(len(self.four_wire_assignments)):
-            self.sb.switch(self.four_wire_assignments[i])
-            time.sleep(0.3)
+        four_wire_order = plan_order(self.four_wire_assignments, self.sb.assignment)
+        print_plan(self.four_wire_assignments, four_wire_order, self.sb.assignment, switch_time=0.3)
+        for i in four_wire_order:
+            if self.sb.switch(self.four_wire_assignments[i]):
+                time.sleep(0.3)
             self.pg.enable_4_wire_probe(meas_curr)
             time.sleep(0.2)
             c, v = self.pg.read_one()
@@ -200,15 +240,20 @@ class DataCollector(QtCore.QObject):
                 self.tec.set_target_temperature(target)
                 self.tec.enable_control()
             except pyvisa.pyvisaIOError:
-                print(f'Could not connect to TEC on port {port} or could not set temperature to {target}')
-                self.stable.emit()
+                self.tec_enabled = False
+                self.not_stable.emit(f'Could not connect to TEC on port {port} or could not set temperature to '
+                                     f'{target}')
                 return
 
-            a = self.tec.get_temp_stability_state()
-            while a != "stable":
-                time.sleep(1)
-                a = self.tec.get_temp_stability_state()
-            self.stable.emit()
+            self.temperature_wait_cancelled.clear()
+            stability = StabilityWaiter(self.tec, target, interval=1, timeout=self.stability_timeout,
+                                        progress=self.temperature_progress.emit)
+            if stability.wait(stop=self.temperature_wait_cancelled.is_set):
+                self.stable.emit()
+            elif self.temperature_wait_cancelled.is_set():
+                self.not_stable.emit('Stopped waiting for the temperature to settle')
+            else:
+                self.not_stable.emit(f'Temperature not stable at {target} °C after {self.stability_timeout} s')
         # if system == 2:
         #     try:
         #         self.hts.connect(port)
@@ -230,103 +275,25 @@ class DataCollector(QtCore.QObject):
 
     def pulse_and_measure(self, volts, pulse_mag, pulse_width, meas_curr, meas_n, loop_n):
         # see footnote on 6-110 in k2461 manual
-
-        self.dmm.prepare_measure_one()
-
-        start_time = time.time()
-        for loop_count in range(loop_n):
-            self.mutex.lock()
-            if self.is_stopped:
-                return
-            self.mutex.unlock()
-            self.sb.switch(self.pulse1_assignments)
-            if self.scope_enabled:
-                self.scope.single_trig()
-            if volts:
-                self.pg.prepare_pulsing_voltage(pulse_mag, pulse_width)
-            else:
-                self.pg.prepare_pulsing_current(pulse_mag, pulse_width)
-            self.pg.set_ext_trig()
-            time.sleep(500e-3)
-            pulse_t = time.time()
-
-            self.pg.send_pulse()
-
-            time.sleep(500e-3)
-            self.sb.switch(self.measure_assignments)
-            self.pg.enable_4_wire_probe(meas_curr)
-            time.sleep(500e-3)
-            t = np.zeros(meas_n)
-            vxx = np.zeros(meas_n)
-            vxy = np.zeros(meas_n)
-            curr = np.zeros(meas_n)
-            if self.tec_enabled:
-                tec_data = np.zeros(meas_n)
-            for meas_count in tqdm(range(meas_n), desc=f"Loop {loop_count + 1}/{loop_n}, Pulse 1"):
-                t[meas_count] = time.time()
-                self.pg.trigger_before_fetch()
-                self.dmm.trigger()
-                vxx[meas_count], curr[meas_count] = self.pg.fetch_one()
-                vxy[meas_count] = self.dmm.fetch_one()
-                if self.tec_enabled:
-                    tec_data[meas_count] = self.tec.get_object_temperature()
-            self.pg.disable_probe_current()
-            self.pos_data_ready.emit(t - start_time, vxx / curr, vxy / curr)
-            if self.scope_enabled:
-                scope_data = self.scope.get_data(30001, 60000)
-                time_step = float(self.scope.get_time_inc())
-                scope_time = np.array(range(0, len(scope_data))) * time_step + pulse_t - start_time
-                self.pos_scope_data_ready.emit(scope_time, scope_data / self.reference_resistance)
-            if self.tec_enabled:
-                self.pos_tec_data_ready.emit(t-start_time, tec_data)
-
-            self.mutex.lock()
-            if self.is_stopped:
-                return
-            self.mutex.unlock()
-
-            self.sb.switch(self.pulse2_assignments)
-            if self.scope_enabled:
-                self.scope.single_trig()
-            if volts:
-                self.pg.prepare_pulsing_voltage(pulse_mag, pulse_width)
-            else:
-                self.pg.prepare_pulsing_current(pulse_mag, pulse_width)
-            self.pg.set_ext_trig()
-            time.sleep(500e-3)
-            pulse_t = time.time()
-
-            self.pg.send_pulse()
-
-            time.sleep(500e-3)
-            self.sb.switch(self.measure_assignments)
-            self.pg.enable_4_wire_probe(meas_curr)
-            time.sleep(500e-3)
-
-            t = np.zeros(meas_n)
-            vxx = np.zeros(meas_n)
-            vxy = np.zeros(meas_n)
-            curr = np.zeros(meas_n)
-            if self.tec_enabled:
-                tec_data = np.zeros(meas_n)
-            for meas_count in tqdm(range(meas_n), desc=f"Loop {loop_count + 1}/{loop_n}, Pulse 2"):
-                t[meas_count] = time.time()
-                self.pg.trigger_before_fetch()
-                self.dmm.trigger()
-                vxx[meas_count], curr[meas_count] = self.pg.fetch_one()
-                vxy[meas_count] = self.dmm.fetch_one()
-                if self.tec_enabled:
-                    tec_data[meas_count] = self.tec.get_object_temperature()
-            self.pg.disable_probe_current()
-            self.neg_data_ready.emit(t - start_time, vxx / curr, vxy / curr)
-
-            if self.scope_enabled:
-                scope_data = self.scope.get_data(30001, 60000)
-                time_step = float(self.scope.get_time_inc())
-                scope_time = np.array(range(0, len(scope_data))) * time_step + pulse_t - start_time
-                self.neg_scope_data_ready.emit(scope_time, scope_data / self.reference_resistance)
-            if self.tec_enabled:
-                self.neg_tec_data_ready.emit(t-start_time, tec_data)
+        experiment = Experiment(switching_steps(loop_n),
+                                {'pulse1': self.pulse1_assignments, 'pulse2': self.pulse2_assignments,
+                                 'measure': self.measure_assignments},
+                                pulse={'magnitude': pulse_mag, 'width': pulse_width, 'volts': volts},
+                                measure={'current': meas_curr, 'n': meas_n})
+        self.runner = ExperimentRunner(self, experiment, on_data=self.emit_data, stop=self.stopped)
+        self.runner.run()
+
+    def emit_data(self, dataset, *columns):
+        signals = {'pos': self.pos_data_ready, 'pos_scope': self.pos_scope_data_ready,
+                   'pos_tec': self.pos_tec_data_ready, 'neg': self.neg_data_ready,
+                   'neg_scope': self.neg_scope_data_ready, 'neg_tec': self.neg_tec_data_ready}
+        signals[dataset].emit(*columns)
+
+    def stopped(self):
+        self.mutex.lock()
+        is_stopped = self.is_stopped
+        self.mutex.unlock()
+        return is_stopped
 
     def handle_inputs(self, mode, sb_port, bb_port, dmm_port, pulse_mag, pulse_width, meas_curr, meas_n, loop_n,
                       bb_enabled, scope_enabled):
@@ -424,6 +391,7 @@ class DataCollector(QtCore.QObject):
                 self.scope.connect()
                 self.scope.prepare_for_pulse(pulse_mag, self.reference_resistance, self.two_wire, pulse_width)
                 self.scope.set_trig_chan()
+                self.scope_reader.invalidate()  # vertical scales have changed
                 # self.scope.single_trig()
                 self.scope_enabled = True
                 time.sleep(12)
@@ -461,6 +429,8 @@ class MyGUI(QtWidgets.QMainWindow):
         self.connect_signals()  # this also creates a new thread.
         self.thread.start()  # start the thread created in "connect_signals()"
         self.temp_running = False
+        self.run_file_name = 'temp_run.npz'
+        self.plotter = LivePlotter(max_fps=10, parent=self)  # draws new data at most 10 times a second
 
     def connect_signals(self):
         # Connect gui elements to slots.
@@ -482,6 +452,8 @@ class MyGUI(QtWidgets.QMainWindow):
         self.data_collector.neg_tec_data_ready.connect(self.on_neg_tec_data_ready)
         self.data_collector.finished_res_measurement.connect(self.on_res_finished)
         self.data_collector.stable.connect(self.on_stable)
+        self.data_collector.not_stable.connect(self.on_not_stable)
+        self.data_collector.temperature_progress.connect(self.on_temperature_progress)
         self.temperature_cont_target_box.setDisabled(True)
         self.temperature_label.setDisabled(True)
         self.temperature_units_label.setDisabled(True)
@@ -492,26 +464,29 @@ class MyGUI(QtWidgets.QMainWindow):
     def on_start(self):
 
         self.scope_enabled = False
-        # Reset the data arrays to not append to previous measurements.
-        self.pos_time = np.array([])
-        self.neg_time = np.array([])
-        self.pos_rxx = np.array([])
-        self.neg_rxx = np.array([])
-        self.pos_rxy = np.array([])
-        self.neg_rxy = np.array([])
+        # Reset the data stores to not append to previous measurements.
+        self.pos_data = ColumnStore(('time', 'rxx', 'rxy'))
+        self.neg_data = ColumnStore(('time', 'rxx', 'rxy'))
+        # The whole run, segment by segment, with its parameters. This is the only copy on disk, every half-loop is
+        # appended to it as it arrives (use recover_autosave.py if the gui dies). Moved to the chosen name when saving.
+        # Whatever the last run left there (not saved, or the gui died) is kept under a new name first.
+        for old_name in set_aside_run(self.run_file_name):
+            print(f'Run file from an earlier run kept as {old_name}')
+        self.run_file = RunFile(self.run_file_name, self.run_params())
+        self.run_file.declare('pos', self.pos_data.names)
+        self.run_file.declare('neg', self.neg_data.names)
 
         if self.scope_checkbox.isChecked():
             self.scope_enabled = True
-            self.pos_scope_time = np.array([])
-            self.pos_scope_data = np.array([])
-            self.neg_scope_time = np.array([])
-            self.neg_scope_data = np.array([])
+            # Only the latest trace of each polarity is plotted so the traces just go to the run file.
+            self.run_file.declare('pos_scope', ('time', 'current'))
+            self.run_file.declare('neg_scope', ('time', 'current'))
 
         if self.temp_running:
-            self.pos_tec_time = np.array([])
-            self.pos_tec_data = np.array([])
-            self.neg_tec_time = np.array([])
-            self.neg_tec_data = np.array([])
+            self.pos_tec = ColumnStore(('time', 'temperature'))
+            self.neg_tec = ColumnStore(('time', 'temperature'))
+            self.run_file.declare('pos_tec', self.pos_tec.names)
+            self.run_file.declare('neg_tec', self.neg_tec.names)
 
         self.create_plots()  # make figure axes and so on
 
@@ -527,9 +502,23 @@ class MyGUI(QtWidgets.QMainWindow):
                                         QtCore.Q_ARG(str, self.measurement_count_box.text()),
                                         QtCore.Q_ARG(str, self.loop_count_box.text()),
                                         QtCore.Q_ARG(tuple, (self.bb_enable_checkbox.isChecked(),
-                                                             self.scope_checkbox.isChecked()))
+                                                             self.scope_checkbox.isChecked(),
+                                                             self.buffered_checkbox.isChecked()))
                                         )
 
+    def run_params(self):
+        # Everything needed to know later how the run was taken. The box contents are kept as typed.
+        collector = self.data_collector
+        return {'mode': self.pulse_type_combobox.currentText(), 'pulse_magnitude': self.pulse_magnitude_box.text(),
+                'pulse_width': self.pulse_width_box.text(), 'probe_current': self.probe_current_box.text(),
+                'measurement_count': self.measurement_count_box.text(), 'loop_count': self.loop_count_box.text(),
+                'balance_box': self.bb_enable_checkbox.isChecked(), 'scope': self.scope_checkbox.isChecked(),
+                'buffered': self.buffered_checkbox.isChecked(), 'tec': self.temp_running,
+                'pulse1_assignments': collector.pulse1_assignments, 'pulse2_assignments': collector.pulse2_assignments,
+                'measure_assignments': collector.measure_assignments,
+                'reference_resistance': collector.reference_resistance, 'two_wire': collector.two_wire,
+                'start_time': time.time()}
+
     def on_res_measurement(self):
         QtCore.QMetaObject.invokeMethod(self.data_collector, 'resistance_measurement', QtCore.Qt.QueuedConnection,
                                         QtCore.Q_ARG(str, self.pulse_type_combobox.currentText()),
@@ -551,22 +540,25 @@ class MyGUI(QtWidgets.QMainWindow):
         #     plt.close(self.rxy_fig)
         # except:
         #     print("no plots to close")
+        self.plotter.clear()
         self.graph_fig = plt.figure("Resistance Plots")
         self.rxx_ax = plt.subplot(211)
         self.rxx_ax.clear()
-        self.rxx_pos_line, = self.rxx_ax.plot(self.pos_time, self.pos_rxx, 'k.')
-        self.rxx_neg_line, = self.rxx_ax.plot(self.neg_time, self.neg_rxx, 'r.')
+        self.rxx_pos_line, = self.rxx_ax.plot(self.pos_data['time'], self.pos_data['rxx'], 'k.')
+        self.rxx_neg_line, = self.rxx_ax.plot(self.neg_data['time'], self.neg_data['rxx'], 'r.')
         # self.rxx_ax.set_xlabel('Time (s)')
         self.rxx_ax.set_ylabel('R_xx (Ohms)')
         self.rxx_ax.ticklabel_format(useOffset=False)
 
         self.rxy_ax = plt.subplot(212)
         self.rxy_ax.clear()
-        self.rxy_pos_line, = self.rxy_ax.plot(self.pos_time, self.pos_rxy, 'k.')
-        self.rxy_neg_line, = self.rxy_ax.plot(self.neg_time, self.neg_rxy, 'r.')
+        self.rxy_pos_line, = self.rxy_ax.plot(self.pos_data['time'], self.pos_data['rxy'], 'k.')
+        self.rxy_neg_line, = self.rxy_ax.plot(self.neg_data['time'], self.neg_data['rxy'], 'r.')
         self.rxy_ax.set_xlabel('Time (s)')
         self.rxy_ax.set_ylabel('R_xy (Ohms)')
         self.rxy_ax.ticklabel_format(useOffset=False)
+        for line in (self.rxx_pos_line, self.rxx_neg_line, self.rxy_pos_line, self.rxy_neg_line):
+            self.plotter.add_line(line)
         plt.show(block=False)
         self.refresh_switching_graphs()
 
@@ -574,22 +566,27 @@ class MyGUI(QtWidgets.QMainWindow):
             self.scope_fig = plt.figure("scope plots")
             self.scope_ax = plt.axes()
             self.scope_ax.clear()
-            self.pos_scope_line, = self.scope_ax.plot(self.pos_scope_time, self.pos_scope_data / 1e3, 'k.')
-            self.neg_scope_line, = self.scope_ax.plot(self.neg_scope_time, self.neg_scope_data / 1e3, 'r.')
+            # Lines rather than markers so the 30000 point traces are decimated to the width of the axes when drawn.
+            self.pos_scope_line, = self.scope_ax.plot([], [], 'k-')
+            self.neg_scope_line, = self.scope_ax.plot([], [], 'r-')
             self.scope_ax.set_xlabel('Time (s)')
             self.scope_ax.set_ylabel('Pulse Current (mA)')
             self.scope_ax.ticklabel_format(useOffset=False)
+            self.plotter.add_line(self.pos_scope_line)
+            self.plotter.add_line(self.neg_scope_line)
             self.refresh_scope_graphs()
             plt.show(block=False)
         if self.temp_running:
             self.tec_fig = plt.figure("tec plots")
             self.tec_ax = plt.axes()
             self.tec_ax.clear()
-            self.pos_tec_line, = self.tec_ax.plot(self.pos_tec_time, self.pos_tec_data, 'k.')
-            self.neg_tec_line, = self.tec_ax.plot(self.neg_tec_time, self.neg_tec_data, 'r.')
+            self.pos_tec_line, = self.tec_ax.plot(self.pos_tec['time'], self.pos_tec['temperature'], 'k.')
+            self.neg_tec_line, = self.tec_ax.plot(self.neg_tec['time'], self.neg_tec['temperature'], 'r.')
             self.tec_ax.set_xlabel('Time (s)')
             self.tec_ax.set_ylabel('Temperature (°C)')
             self.tec_ax.ticklabel_format(useOffset=False)
+            self.plotter.add_line(self.pos_tec_line)
+            self.plotter.add_line(self.neg_tec_line)
             self.refresh_tec_graphs()
             plt.show(block=False)
 
@@ -623,11 +620,10 @@ class MyGUI(QtWidgets.QMainWindow):
 
     def on_loop_over(self):
         print("Finished Loop")
+        self.run_file.close()  # builds temp_run.npz from the parts appended during the run
         # when finished is emitted, this will save the data (I hope).
         try:
             # alert_sound()
-            data = np.column_stack(
-                (self.pos_time, self.pos_rxx, self.pos_rxy, self.neg_time, self.neg_rxx, self.neg_rxy))
             prompt_window = QtWidgets.QWidget()
 
             if QtWidgets.QMessageBox.question(prompt_window, 'Save Data?',
@@ -635,88 +631,57 @@ class MyGUI(QtWidgets.QMainWindow):
                                               QtWidgets.QMessageBox.No) == QtWidgets.QMessageBox.Yes:
                 save_window = QtWidgets.QWidget()
                 name, _ = QtWidgets.QFileDialog.getSaveFileName(save_window, "Save Data", "",
-                                                                "Text Files (*.txt);; Data Files (*.dat);; All Files (*)")
+                                                                "Run Files (*.npz);; Text Files (*.txt);; "
+                                                                "Data Files (*.dat);; All Files (*)")
                 if name:  # if a name was entered, don't save otherwise
                     name = name.replace('_scope', '')
                     name = name.replace('_tec', '')
-                    np.savetxt(name, data, newline='\n', delimiter='\t')  # save
-                    print(f'Data saved as {name}')
-
-                    if self.scope_enabled:
-                        scope_name = name.split('.')[0] + '_scope.' + name.split('.')[1]
-                        scope_data = np.column_stack(
-                            (self.pos_scope_time, self.pos_scope_data, self.neg_scope_time, self.neg_scope_data))
-                        np.savetxt(scope_name, scope_data, newline='\n', delimiter='\t')  # save scope data
-                        print(f'Scope data saved as {scope_name}')
-                    if self.temp_running:
-                        tec_name = name.split('.')[0] + '_tec.' + name.split('.')[1]
-                        tec_data = np.column_stack(
-                            (self.pos_tec_time, self.pos_tec_data, self.neg_tec_time, self.neg_tec_data))
-                        np.savetxt(tec_name, tec_data, newline='\n', delimiter='\t')  # save tec data
-                        print(f'tec data saved as {tec_name}')
+                    if os.path.splitext(name)[1] in ('.txt', '.dat'):
+                        # Old layout, pos and neg side by side (padded with nan if they differ in length).
+                        for out_name in convert(RunReader(self.run_file_name), name):
+                            print(f'Data saved as {out_name}')
+                    else:
+                        name = os.path.splitext(name)[0] + '.npz'
+                        shutil.move(self.run_file_name, name)  # os.replace can't move across drives
+                        print(f'Data saved as {name}')
                 else:
                     print('No Filename: Data not saved')
             else:
                 print('Data not saved')
-        except ValueError:
-            print("Could not stack. Please manually combine and save pos_temp_data and neg_temp_data "
-                  "(and scope data if used).")
         except:
-            print("Data not saved, something went wrong! Please check the temp data files")
+            print(f"Data not saved, something went wrong! Please check {self.run_file_name}")
 
     def on_pos_data_ready(self, t, rxx, rxy):
         # After pos pulse, plot and store the data then save a backup
-        self.pos_time = np.append(self.pos_time, t)
-        self.pos_rxx = np.append(self.pos_rxx, rxx)
-        self.pos_rxy = np.append(self.pos_rxy, rxy)
-        self.rxx_pos_line.set_data(self.pos_time, self.pos_rxx)
-        self.rxy_pos_line.set_data(self.pos_time, self.pos_rxy)
-        self.refresh_switching_graphs()
-        data = np.column_stack((self.pos_time, self.pos_rxx, self.pos_rxy))
-        np.savetxt('pos_temp_data.txt', data, newline='\n', delimiter='\t')
+        self.pos_data.append(t, rxx, rxy)
+        self.plotter.set_data(self.rxx_pos_line, self.pos_data['time'], self.pos_data['rxx'])
+        self.plotter.set_data(self.rxy_pos_line, self.pos_data['time'], self.pos_data['rxy'])
+        self.run_file.append('pos', t, rxx, rxy)
 
     def on_pos_scope_data_ready(self, t, current):
-        self.pos_scope_time = np.append(self.pos_scope_time, t)
-        self.pos_scope_data = np.append(self.pos_scope_data, current)
-        self.pos_scope_line.set_data(t, current*1e3)
-        self.refresh_scope_graphs()
-        scope_data = np.column_stack((self.pos_scope_time, self.pos_scope_data))
-        np.savetxt('pos_temp_scope_data.txt', scope_data, newline='\n', delimiter='\t')
+        self.plotter.set_data(self.pos_scope_line, t, current*1e3)
+        self.run_file.append('pos_scope', t, current)
 
     def on_pos_tec_data_ready(self, t, temp):
-        self.pos_tec_time = np.append(self.pos_tec_time, t)
-        self.pos_tec_data = np.append(self.pos_tec_data, temp)
-        self.pos_tec_line.set_data(self.pos_tec_time, self.pos_tec_data)
-        self.refresh_tec_graphs()
-        tec_data = np.column_stack((self.pos_tec_time, self.pos_tec_data))
-        np.savetxt('pos_temp_tec_data.txt', tec_data, newline='\n', delimiter='\t')
+        self.pos_tec.append(t, temp)
+        self.plotter.set_data(self.pos_tec_line, self.pos_tec['time'], self.pos_tec['temperature'])
+        self.run_file.append('pos_tec', t, temp)
 
     def on_neg_data_ready(self, t, rxx, rxy):
         # After neg pulse, plot and store the data then save a backup
-        self.neg_time = np.append(self.neg_time, t)
-        self.neg_rxx = np.append(self.neg_rxx, rxx)
-        self.neg_rxy = np.append(self.neg_rxy, rxy)
-        self.rxx_neg_line.set_data(self.neg_time, self.neg_rxx)
-        self.rxy_neg_line.set_data(self.neg_time, self.neg_rxy)
-        self.refresh_switching_graphs()
-        data = np.column_stack((self.neg_time, self.neg_rxx, self.neg_rxy))
-        np.savetxt('neg_temp_data.txt', data, newline='\n', delimiter='\t')
+        self.neg_data.append(t, rxx, rxy)
+        self.plotter.set_data(self.rxx_neg_line, self.neg_data['time'], self.neg_data['rxx'])
+        self.plotter.set_data(self.rxy_neg_line, self.neg_data['time'], self.neg_data['rxy'])
+        self.run_file.append('neg', t, rxx, rxy)
 
     def on_neg_scope_data_ready(self, t, current):
-        self.neg_scope_time = np.append(self.neg_scope_time, t)
-        self.neg_scope_data = np.append(self.neg_scope_data, current)
-        self.pos_scope_line.set_data(t, current*1e3)
-        self.refresh_scope_graphs()
-        scope_data = np.column_stack((self.neg_scope_time, self.neg_scope_data))
-        np.savetxt('neg_temp_scope_data.txt', scope_data, newline='\n', delimiter='\t')
+        self.plotter.set_data(self.neg_scope_line, t, current*1e3)
+        self.run_file.append('neg_scope', t, current)
 
     def on_neg_tec_data_ready(self, t, temp):
-        self.neg_tec_time = np.append(self.neg_tec_time, t)
-        self.neg_tec_data = np.append(self.neg_tec_data, temp)
-        self.neg_tec_line.set_data(self.neg_tec_time, self.neg_tec_data)
-        self.refresh_tec_graphs()
-        tec_data = np.column_stack((self.neg_tec_time, self.neg_tec_data))
-        np.savetxt('neg_temp_tec_data.txt', tec_data, newline='\n', delimiter='\t')
+        self.neg_tec.append(t, temp)
+        self.plotter.set_data(self.neg_tec_line, self.neg_tec['time'], self.neg_tec['temperature'])
+        self.run_file.append('neg_tec', t, temp)
 
     def on_res_finished(self, two_wires, four_wires):
         save_window = QtWidgets.QWidget()
@@ -767,6 +732,7 @@ class MyGUI(QtWidgets.QMainWindow):
                                             QtCore.Q_ARG(str, self.temperature_cont_target_box.text()))
         else:
             self.temperature_control_button.setText("Start Temperature Control")
+            self.data_collector.temperature_wait_cancelled.set()
             QtCore.QMetaObject.invokeMethod(self.data_collector, 'stop_TEC_temperature_control',
                                             QtCore.Qt.QueuedConnection)
             self.start_button.setDisabled(False)
@@ -774,6 +740,22 @@ class MyGUI(QtWidgets.QMainWindow):
     def on_stable(self):
         print('Temperature about stable. Verify on controller screen before proceeding.')
         self.start_button.setDisabled(False)
+        if self.temp_running:
+            self.temperature_control_button.setText("Stop Temperature Control")
+
+    def on_not_stable(self, message):
+        # Measuring stays disabled until temperature control is stopped (to measure without it) or started again.
+        print(message)
+        if self.temp_running:
+            error_sound()
+            self.temperature_control_button.setText("Stop Temperature Control (not stable)")
+
+    def on_temperature_progress(self, temperature, rate, eta):
+        if not self.temp_running:
+            return
+        eta_text = 'not converging' if np.isnan(eta) else f'stable in ~{eta:.0f} s'
+        self.temperature_control_button.setText(f"Stop Temperature Control ({temperature:.2f} °C, "
+                                                f"{rate * 60:+.2f} °C/min, {eta_text})")
 
     def refresh_switching_graphs(self):
         # Simply redraw the axes after changing data.
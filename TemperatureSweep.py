@@ -1,18 +1,23 @@
-import instruments
+import os
+if os.environ.get('SIMULATED_INSTRUMENTS'):  # run without hardware, see simulated_instruments.py
+    import simulated_instruments as instruments
+else:
+    import instruments
 import matplotlib.pyplot as plt
 import numpy as np
 import time
 from tkinter import filedialog as dialog
+from sweep_engine import RampSweep
+from tec_tools import StabilityWaiter, print_progress
 
 measure_assignments = {"I+": "A", "I-": "C", "V1+": "G", "V1-": "E"}
 probe_current = 200e-6
 start_t = 30
 end_t = 21
+ramp_rate = 0.02
 end_wait_time = 600
-time_values = np.array([])
-Rxx = np.array([])
-Rxy = np.array([])
-temp = np.array([])
+settle_timeout = 3600  # give up if the tec is still not stable this long after the sweep starts
+points_per_round = 10  # readings between each tec temperature reading
 
 error_sound = instruments.error_sound
 alert_sound = instruments.alert_sound
@@ -29,30 +34,25 @@ tec.connect(14)
 
 
 tec.disable_control()
-tec.set_ramp_rate(0.02)
+tec.set_ramp_rate(ramp_rate)
 # tec.set_target_temperature(start_t)
 # tec.enable_control()
-# while tec.get_temp_stability_state() is not "stable":
-#     time.sleep(0.5)
+# StabilityWaiter(tec, start_t, progress=print_progress).wait()
 # print('Temp stable')
 # sb.switch(measure_assignments)
-time.sleep(0.5)
-dmm.prepare_measure_one()
-pg.enable_4_wire_probe(probe_current)
-time.sleep(0.5)
 
 fig = plt.figure()
 plt.ion()
 rxx_ax = plt.subplot(311)
 rxx_ax.clear()
-rxx_line, = rxx_ax.plot(time_values, Rxx, 'k')
+rxx_line, = rxx_ax.plot([], [], 'k')
 # rxx_ax.set_xlabel('Time (s)')
 rxx_ax.set_ylabel('R_xx (Ohms)')
 rxx_ax.ticklabel_format(useOffset=False)
 
 rxy_ax = plt.subplot(312)
 rxy_ax.clear()
-rxy_line, = rxy_ax.plot(time_values, Rxy, 'k')
+rxy_line, = rxy_ax.plot([], [], 'k')
 # rxy_ax.set_xlabel('Time (s)')
 rxy_ax.set_ylabel('R_xy (Ohms)')
 rxy_ax.ticklabel_format(useOffset=False)
@@ -60,7 +60,7 @@ plt.show(block=False)
 
 temp_ax = plt.subplot(313)
 temp_ax.clear()
-temp_line, = temp_ax.plot(time_values, temp, 'k')
+temp_line, = temp_ax.plot([], [], 'k')
 temp_ax.set_xlabel('Time (s)')
 temp_ax.set_ylabel('Temperature (C)')
 temp_ax.ticklabel_format(useOffset=False)
@@ -70,70 +70,31 @@ tec.disable_control()
 print('sleeping')
 plt.pause(10)
 print('woke')
-tec.set_target_temperature(end_t)
-tec.enable_control()
-
-plt.pause(1)
 
+# Measures continuously while the tec ramps to end_t and then for end_wait_time seconds once it is stable. With the
+# switch box commented out there is only the one assignment, which is assumed to be wired up already.
+sweep = RampSweep(None, pg, dmm, tec, (measure_assignments,), probe_current, points_per_visit=points_per_round)
 start_time = time.time()
-while tec.get_temp_stability_state() is not "stable":
-    t = time.time() - start_time
-    pg.trigger_before_fetch()
-    dmm.trigger()
-    temp = np.append(temp, tec.get_object_temperature())
-    vxx, curr = pg.fetch_one()
-    vxy = dmm.fetch_one()
-
-    Rxx = np.append(Rxx, vxx / curr)
-    Rxy = np.append(Rxy, vxy / curr)
-    time_values = np.append(time_values, t)
-
-    rxx_line.set_data(time_values, Rxx)
-    rxy_line.set_data(time_values, Rxy)
-    temp_line.set_data(time_values, temp)
-    rxx_ax.relim()
-    rxx_ax.autoscale_view()
-    rxy_ax.relim()
-    rxy_ax.autoscale_view()
-    temp_ax.relim()
-    temp_ax.autoscale_view()
-    fig.canvas.draw()
-    plt.draw()
-    plt.pause(5)
-
-toc = time.time()
-tic = 0
-
-print(f"Target reached. Measuring for {end_wait_time} seconds")
-while tic < end_wait_time:
-    t = time.time() - start_time
-    pg.trigger_before_fetch()
-    dmm.trigger()
-    temp = np.append(temp, tec.get_object_temperature())
-    vxx, curr = pg.fetch_one()
-    vxy = dmm.fetch_one()
-
-    Rxx = np.append(Rxx, vxx / curr)
-    Rxy = np.append(Rxy, vxy / curr)
-    time_values = np.append(time_values, t)
-
-    rxx_line.set_data(time_values, Rxx)
-    rxy_line.set_data(time_values, Rxy)
-    temp_line.set_data(time_values, temp)
-    rxx_ax.relim()
-    rxx_ax.autoscale_view()
-    rxy_ax.relim()
-    rxy_ax.autoscale_view()
-    temp_ax.relim()
-    temp_ax.autoscale_view()
-    fig.canvas.draw()
-    plt.draw()
-    plt.pause(5)
-
-    tic = time.time()-toc
 
+
+def update_plots(sweep):
+    time_values, temp, Rxx, Rxy = sweep.channel(0)
+    rxx_line.set_data(time_values - start_time, Rxx)
+    rxy_line.set_data(time_values - start_time, Rxy)
+    temp_line.set_data(time_values - start_time, temp)
+    for ax in (rxx_ax, rxy_ax, temp_ax):
+        ax.relim()
+        ax.autoscale_view()
+    plt.pause(0.01)
+
+
+if not sweep.run(end_t, hold_time=end_wait_time, on_round=update_plots, timeout=settle_timeout):
+    error_sound()  # saved anyway, with what was measured before giving up
+print(f'{sweep.points_per_kelvin():.1f} points per kelvin')
+
+time_values, temp, Rxx, Rxy = sweep.channel(0)
 data = np.column_stack(
-    (time_values,
+    (time_values - start_time,
      Rxx,
      Rxy,
      temp,
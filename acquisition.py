@@ -0,0 +1,33 @@
+from concurrent.futures import ThreadPoolExecutor, wait
+
+
+class ParallelReader:
+    # Runs reads on instruments that sit on separate buses (e.g. the k2461 and k2000 on their own GPIB addresses and
+    # the TEC on serial) at the same time so a point takes as long as the slowest instrument rather than the sum of
+    # them. Each function passed to read() should only talk to one instrument, and no two functions in the same call
+    # should share an instrument.
+    #     reader = ParallelReader()
+    #     (vxx, curr), vxy = reader.read(pg.fetch_one, dmm.fetch_one)
+    def __init__(self, max_workers=4):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='instrument-read')
+
+    def read(self, *functions):
+        # Returns the results in the order the functions were given. All reads are waited for before an exception is
+        # raised so nothing is still talking to an instrument when the caller carries on.
+        futures = [self._pool.submit(function) for function in functions]
+        wait(futures)
+        return [future.result() for future in futures]
+
+    def close(self):
+        self._pool.shutdown()
+
+
+def in_sequence(*functions):
+    # Combines several calls to the same instrument into one function for ParallelReader.read, e.g. a trigger and the
+    # fetch that follows it.
+    def run():
+        result = None
+        for function in functions:
+            result = function()
+        return result
+    return run
@@ -0,0 +1,97 @@
+import os
+
+import numpy as np
+from scipy import signal
+
+from data_store import RunReader
+
+# Loading and processing for big switching runs without reading whole files into memory. Run files (see RunFile) are
+# memory mapped, old text files are parsed once and cached as .npy next to them. Derived quantities are worked out a
+# chunk at a time so a multi GB run never has to fit in memory at once:
+#     run = SwitchingRun('overnight.npz')
+#     pos, neg = run.loop(12)                      # just that loop is read from disk
+#     rxy = savgol(run.column('pos', 'rxy'), 31, 3)
+#     amplitude = run.switching_amplitude('rxy')   # pos - neg mean per loop
+
+chunk_size = 2 ** 20  # rows per chunk
+
+
+def load_table(name, delimiter='\t', skiprows=0):
+    # A tab separated text file as a read only (n, n_columns) array. The first call parses the text and saves it as
+    # <name>.npy, later calls memory map that (it is rebuilt if the text file changes).
+    cache = f'{name}.npy'
+    if not os.path.exists(cache) or os.path.getmtime(cache) < os.path.getmtime(name):
+        np.save(cache, np.loadtxt(name, delimiter=delimiter, skiprows=skiprows, ndmin=2))
+    return np.load(cache, mmap_mode='r')
+
+
+def chunked(function, *arrays, chunk=chunk_size):
+    # function(*arrays) for element by element functions, evaluated chunk rows at a time.
+    length = len(arrays[0])
+    result = np.empty(length)
+    for start in range(0, length, chunk):
+        result[start:start + chunk] = function(*(array[start:start + chunk] for array in arrays))
+    return result
+
+
+def savgol(y, window_length, polyorder, chunk=chunk_size):
+    # Same result as scipy.signal.savgol_filter(y, window_length, polyorder) but filtered chunk points at a time. Each
+    # chunk is filtered with half a window of its neighbours either side so the joins are exact.
+    length = len(y)
+    if length <= chunk + window_length:
+        return signal.savgol_filter(np.asarray(y, dtype=float), window_length, polyorder)
+    half = window_length // 2
+    result = np.empty(length)
+    for start in range(0, length, chunk):
+        stop = min(start + chunk, length)
+        low, high = max(start - half, 0), min(stop + half, length)
+        if high - low < window_length:  # a short last chunk, widen it so the edge fit matches the whole array's
+            low = max(high - window_length - half, 0)
+        filtered = signal.savgol_filter(np.asarray(y[low:high], dtype=float), window_length, polyorder)
+        result[start:stop] = filtered[start - low:stop - low]
+    return result
+
+
+def amr_percent(r, reference=None, chunk=chunk_size):
+    # 100 * (r - reference) / reference, with the mean of r as the reference by default.
+    reference = float(np.mean(r)) if reference is None else reference
+    return chunked(lambda x: 100 * (x - reference) / reference, r, chunk=chunk)
+
+
+class SwitchingRun:
+    # A Switching_GUI run file, one segment per half-loop in 'pos' and 'neg' (and a scope trace per pulse in
+    # 'pos_scope' and 'neg_scope' if the scope was used). Nothing is read until it is asked for.
+    def __init__(self, path):
+        self.reader = RunReader(path)
+        self.params = self.reader.params
+
+    def __len__(self):
+        return self.reader.n_segments('pos')
+
+    def loop(self, index):
+        # The pos and neg half-loops of one loop as (n, 3) arrays of time, rxx and rxy.
+        neg = self.reader.segment('neg', index) if index < self.reader.n_segments('neg') else np.empty((0, 3))
+        return self.reader.segment('pos', index), neg
+
+    def pulse(self, polarity, index):
+        # The scope trace (time, current) of pulse `index` of one polarity ('pos' or 'neg').
+        return self.reader.segment(f'{polarity}_scope', index)
+
+    def column(self, dataset, name):
+        # One column of a whole dataset. Segments are copied into one array so this reads the column from disk, but
+        # only that column.
+        index = self.reader.columns[dataset].index(name)
+        segments = [self.reader.segment(dataset, i)[:, index] for i in range(self.reader.n_segments(dataset))]
+        return np.concatenate(segments) if segments else np.empty(0)
+
+    def loop_means(self, dataset, name):
+        # The mean of a column over each half-loop, one segment in memory at a time.
+        index = self.reader.columns[dataset].index(name)
+        return np.array([np.mean(self.reader.segment(dataset, i)[:, index])
+                         for i in range(self.reader.n_segments(dataset))])
+
+    def switching_amplitude(self, name='rxy'):
+        # Mean after the pos pulse minus mean after the neg pulse for every complete loop.
+        pos, neg = self.loop_means('pos', name), self.loop_means('neg', name)
+        loops = min(len(pos), len(neg))
+        return pos[:loops] - neg[:loops]
@@ -0,0 +1,203 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+# Benchmarks the acquisition loops against the simulated instruments so changes to them can be compared between
+# versions without any hardware. For example
+#     python benchmark_switching.py --loops 5 --points 100 --output bench_results.json
+# runs DataCollector.pulse_and_measure (point by point, with concurrent reads, pipelined arming and buffered), the
+# TemperatureSweep.py ramp sweep (sweep_engine.RampSweep) and the K6221 custom sweep flow from
+# deltapulse_switching_customsweep.py, prints a summary and writes the numbers to a json file. Times are wall clock so
+# they include the modelled bus latencies (scale them with --latency-scale).
+
+os.environ['SIMULATED_INSTRUMENTS'] = '1'
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PyQt5 import QtWidgets  # noqa: E402  the gui module needs a QApplication before it picks its matplotlib backend
+
+app = QtWidgets.QApplication.instance() or QtWidgets.QApplication(sys.argv[:1])
+
+import simulated_instruments  # noqa: E402
+from data_store import ColumnStore  # noqa: E402
+from k6221_tools import TraceReader, pulse_armed, sweep_duration  # noqa: E402
+from settle import Settle  # noqa: E402
+from sweep_engine import RampSweep  # noqa: E402
+
+
+def git_version():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return ''
+
+
+def block_stats(blocks, n_samples, elapsed):
+    # blocks is a list of time arrays, one per half-loop. Dead time is the gap between the last point of one block
+    # and the first point of the next, i.e. everything spent switching, pulsing, settling and downloading.
+    gaps = [float(b[0] - a[-1]) for a, b in zip(blocks[:-1], blocks[1:])]
+    spans = [float(block[-1] - block[0]) for block in blocks]
+    return {'samples': n_samples,
+            'elapsed_s': elapsed,
+            'samples_per_s': n_samples / elapsed,
+            'in_block_samples_per_s': float(np.mean([(len(block) - 1) / span for block, span in zip(blocks, spans)
+                                                     if span > 0])),
+            'dead_time_per_pulse_s': float(np.mean(gaps)) if gaps else None}
+
+
+def bench_pulse_and_measure(loops, points, buffered, scope, concurrent=False, tec=False, pipelined=False):
+    import Switching_GUI
+
+    collector = Switching_GUI.DataCollector()
+    for instrument in (collector.sb, collector.dmm, collector.pg, collector.scope):
+        instrument.connect()
+    collector.buffered_enabled = buffered
+    collector.concurrent_fetch = concurrent
+    collector.pipelined_arming = pipelined
+    collector.tec_enabled = tec
+    if tec:
+        collector.tec.connect(1)
+        collector.tec_sampler.start()
+    collector.scope_enabled = scope
+    if scope:
+        collector.scope.prepare_for_pulse(5, collector.reference_resistance, collector.two_wire, 1e-3)
+        collector.scope_reader.invalidate()
+
+    # Stand in for the gui slots: store the data, timing how long that takes. The gui's plots are markers so they are
+    # drawn in full by the LivePlotter timer rather than decimated in the slots (see live_plot.decimated).
+    blocks = []
+    update_times = []
+    memory = []
+    pos_data = ColumnStore(('time', 'rxx', 'rxy'))
+    neg_data = ColumnStore(('time', 'rxx', 'rxy'))
+
+    def on_data(store):
+        def slot(t, rxx, rxy):
+            start = time.perf_counter()
+            store.append(t, rxx, rxy)
+            update_times.append(time.perf_counter() - start)
+            blocks.append(np.array(t))
+            memory.append(tracemalloc.get_traced_memory()[0])
+        return slot
+
+    collector.pos_data_ready.connect(on_data(pos_data))
+    collector.neg_data_ready.connect(on_data(neg_data))
+
+    tracemalloc.start()
+    start = time.time()
+    collector.pulse_and_measure(True, 5, 1e-3, 1e-4, points, loops)
+    elapsed = time.time() - start
+    tracemalloc.stop()
+    collector.tec_sampler.stop()
+    collector.tec_enabled = False
+
+    results = block_stats(blocks, len(pos_data) + len(neg_data), elapsed)
+    results['gui_update_mean_ms'] = float(np.mean(update_times) * 1e3)
+    results['gui_update_max_ms'] = float(np.max(update_times) * 1e3)
+    results['memory_growth_per_pulse_kb'] = float((memory[-1] - memory[0]) / max(len(memory) - 1, 1) / 1e3)
+    results['settle_mean_ms'] = {settle.name: float(np.mean(settle.history) * 1e3) for settle in
+                                 (collector.pre_pulse_settle, collector.post_pulse_settle, collector.measure_settle)
+                                 if settle.history}
+    for settle in (collector.pre_pulse_settle, collector.post_pulse_settle, collector.measure_settle):
+        settle.history = []
+    return results
+
+
+def bench_temperature_sweep(points, points_per_round=10):
+    # The sweep_engine.RampSweep that TemperatureSweep.py runs, with the same single assignment and points per round,
+    # ramping the simulated tec until `points` readings have been taken. Each round is one block, so the dead time is
+    # what the tec reading between rounds costs.
+    pg = simulated_instruments.K2461()
+    dmm = simulated_instruments.K2000()
+    tec = simulated_instruments.TEC1089SV()
+    for instrument in (pg, dmm, tec):
+        instrument.connect()
+    sweep = RampSweep(None, pg, dmm, tec, ({"I+": "A", "I-": "C", "V1+": "G", "V1-": "E"},), 200e-6,
+                      points_per_visit=points_per_round)
+    start = time.time()
+    sweep.run(tec.get_object_temperature() + 5, ramp_rate=0.02, hold_time=np.inf,
+              stop=lambda: len(sweep.points) >= points, progress=None)
+    elapsed = time.time() - start
+    t = sweep.points['time']
+    results = block_stats(np.array_split(t, max(len(t) // points_per_round, 1)), len(t), elapsed)
+    results['tec_readings'] = len(sweep.temperatures)
+    results['points_per_kelvin'] = float(sweep.points_per_kelvin())
+    return results
+
+
+def bench_custom_sweep(n_assignments, sweep_points, repeats):
+    # The call sequence of deltapulse_switching_customsweep.py, with its fixed sleeps scaled like the latencies.
+    source = simulated_instruments.K6221()
+    sb = simulated_instruments.SwitchBox()
+    source.connect_ethernet()
+    sb.connect()
+    scale = simulated_instruments.latency_scale
+    curr_list = np.linspace(-15e-3, 15e-3, sweep_points)
+    n_points = sweep_points * repeats
+    source.set_compliance(40)
+    source.set_sense_chan_and_range(1, 100e-3)
+    source.configure_custom_sweep(curr_list, 1e-3, 40, repeats, 0.0, 'best')
+    source.configure_pulse(500e-6, 1, 1)
+    trace_reader = TraceReader(source)
+    trace_reader.configure()
+    arm_settle = Settle('Arm', minimum=50e-3, timeout=3)
+    blocks = []
+    start = time.time()
+    for i in range(n_assignments):
+        sb.switch({"I+": "ABCDEFGH"[i % 8], "I-": "EFGHABCD"[i % 8]})
+        time.sleep(1 * scale)
+        source.arm_pulse_sweep()
+        arm_settle.wait(pulse_armed(source))
+        source.trigger()
+        trigger_t = time.time()
+        data = trace_reader.read(n_points, sweep_duration(n_points, 1e-3, 500e-6))
+        blocks.append(trigger_t + data[1::2])
+    elapsed = time.time() - start
+    results = block_stats(blocks, sum(len(block) for block in blocks), elapsed)
+    results['sweep_duration_s'] = source.duration()
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark acquisition loops against simulated instruments.')
+    parser.add_argument('--loops', type=int, default=3, help='switching loops (two pulses each)')
+    parser.add_argument('--points', type=int, default=100, help='measurements per pulse')
+    parser.add_argument('--latency-scale', type=float, default=1.0, help='multiplier on modelled bus latencies')
+    parser.add_argument('--output', default='bench_results.json', help='json file to write the results to')
+    args = parser.parse_args()
+
+    simulated_instruments.latency_scale = args.latency_scale
+    benchmarks = {
+        'pulse_and_measure': lambda: bench_pulse_and_measure(args.loops, args.points, buffered=False, scope=True),
+        'pulse_and_measure_concurrent': lambda: bench_pulse_and_measure(args.loops, args.points, buffered=False,
+                                                                        scope=True, concurrent=True),
+        'pulse_and_measure_concurrent_tec': lambda: bench_pulse_and_measure(args.loops, args.points, buffered=False,
+                                                                            scope=True, concurrent=True, tec=True),
+        'pulse_and_measure_pipelined': lambda: bench_pulse_and_measure(args.loops, args.points, buffered=False,
+                                                                       scope=True, concurrent=True, pipelined=True),
+        'pulse_and_measure_buffered': lambda: bench_pulse_and_measure(args.loops, args.points, buffered=True,
+                                                                      scope=True),
+        'temperature_sweep': lambda: bench_temperature_sweep(args.points),
+        'k6221_custom_sweep': lambda: bench_custom_sweep(2, 61, 2),
+    }
+    results = {'version': git_version(),
+               'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+               'python': platform.python_version(),
+               'parameters': vars(args),
+               'benchmarks': {}}
+    for name, benchmark in benchmarks.items():
+        print(f'Running {name}...')
+        results['benchmarks'][name] = benchmark()
+        for key, value in results['benchmarks'][name].items():
+            print(f'    {key}: {value}')
+
+    with open(args.output, 'w') as file:
+        json.dump(results, file, indent=2)
+    print(f'Results saved as {args.output}')
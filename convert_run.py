@@ -0,0 +1,48 @@
+import os
+import sys
+
+import numpy as np
+
+from data_store import RunReader, pad_stack
+
+# Writes the tab separated .txt files the scripts used to save from a RunFile, so analysis written for the old files
+# keeps working:
+#     python convert_run.py run.npz [output_name.txt]
+# Runs from Switching_GUI get the same layout as its old saves: pos and neg data side by side in <name>.txt and the
+# scope and tec data in <name>_scope.txt and <name>_tec.txt, with the shorter columns padded with nan. Any other run
+# gets one file with every dataset side by side and the column names in the header.
+
+gui_layout = {'': ('pos', 'neg'), '_scope': ('pos_scope', 'neg_scope'), '_tec': ('pos_tec', 'neg_tec')}
+
+
+def convert(run, name):
+    # Returns the names of the files written.
+    base, extension = os.path.splitext(name)
+    extension = extension or '.txt'
+    written = []
+    if 'pos' in run:
+        for suffix, datasets in gui_layout.items():
+            if all(dataset in run for dataset in datasets):
+                out_name = f'{base}{suffix}{extension}'
+                write_txt(out_name, [run.data(dataset) for dataset in datasets])
+                written.append(out_name)
+    else:
+        out_name = f'{base}{extension}'
+        header = ', '.join(f'{dataset}:{column}' for dataset in run.datasets for column in run.columns[dataset])
+        write_txt(out_name, [run.data(dataset) for dataset in run.datasets], header)
+        written.append(out_name)
+    return written
+
+
+def write_txt(name, arrays, header='', newline='\n'):
+    np.savetxt(name, pad_stack(*arrays), header=header, newline=newline, delimiter='\t')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print('Usage: python convert_run.py run.npz [output_name.txt]')
+        sys.exit(1)
+    run = RunReader(sys.argv[1])
+    name = sys.argv[2] if len(sys.argv) > 2 else os.path.splitext(sys.argv[1])[0] + '.txt'
+    for out_name in convert(run, name):
+        print(f'Saved {out_name}')
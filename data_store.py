@@ -0,0 +1,274 @@
+import io
+import json
+import os
+import struct
+import zipfile
+
+import numpy as np
+
+
+class ColumnStore:
+    # A growable set of equal length columns (e.g. time, rxx, rxy) held in one preallocated block.
+    # When it fills up the capacity is doubled, so appending a block costs the same however much data has already
+    # been taken rather than copying the whole history like np.append does. Columns are returned as views onto the
+    # block so plotting and saving do not copy anything either.
+    def __init__(self, names, capacity=1024, dtype=float):
+        self.names = tuple(names)
+        self._data = np.empty((len(self.names), max(int(capacity), 1)), dtype=dtype)
+        self._length = 0
+
+    def __len__(self):
+        return self._length
+
+    def __getitem__(self, name):
+        return self._data[self.names.index(name), :self._length]
+
+    @property
+    def capacity(self):
+        return self._data.shape[1]
+
+    def append(self, *columns):
+        # Appends one block, given as one array (or scalar) per column in the order of self.names.
+        if len(columns) != len(self.names):
+            raise ValueError(f'Expected {len(self.names)} columns ({", ".join(self.names)}), got {len(columns)}')
+        columns = [np.atleast_1d(np.asarray(column)) for column in columns]
+        n = len(columns[0])
+        if any(len(column) != n for column in columns):
+            raise ValueError('All columns in a block must be the same length')
+        self._reserve(self._length + n)
+        for row, column in enumerate(columns):
+            self._data[row, self._length:self._length + n] = column
+        self._length += n
+
+    def as_array(self):
+        # Same layout as np.column_stack of the columns but as a view rather than a copy.
+        return self._data[:, :self._length].T
+
+    def clear(self):
+        self._length = 0
+
+    def _reserve(self, size):
+        capacity = self.capacity
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        data = np.empty((len(self.names), capacity), dtype=self._data.dtype)
+        data[:, :self._length] = self._data[:, :self._length]
+        self._data = data
+
+
+def pad_stack(*arrays):
+    # np.column_stack for 2D arrays with different numbers of rows, the shorter ones are padded with nan.
+    length = max(len(array) for array in arrays)
+    padded = []
+    for array in arrays:
+        block = np.full((length, array.shape[1]), np.nan)
+        block[:len(array)] = array
+        padded.append(block)
+    return np.column_stack(padded)
+
+
+def json_value(value):
+    # For json.dumps(..., default=json_value): numpy numbers and arrays as plain values, anything else as text.
+    if isinstance(value, (np.generic, np.ndarray)):
+        return value.tolist()
+    return str(value)
+
+
+class RunFile:
+    # Everything from one run in one binary file: the run parameters and any number of datasets (pos/neg blocks,
+    # scope traces, tec logs...), each made of segments of any length, e.g. one per half-loop, so nothing ever has to
+    # be stacked to the same length. The finished file is a zip (stored, not compressed) of .npy members, like np.savez
+    # writes:
+    #     params.json                run parameters (pulse magnitude, width, probe current, assignments...)
+    #     <dataset>/columns.json     column names of the dataset
+    #     <dataset>/000000.npy       first segment as an (n, n_columns) float64 array
+    #     <dataset>/000000.json      optional attributes of the segment (loop number, assignment...)
+    # While the run goes the segments are only appended: each one is written to <path>.bin as raw little endian float64
+    # rows and flushed to disk, and only then is a line describing it added to <path>.idx. An append costs the same
+    # however many segments came before it, and if the program dies the index never points past the data that made it
+    # to disk. close() builds the zip at `path` from the two and deletes them. After a crash
+    # finish_run(path) does the same with everything up to the last whole segment (RunReader calls it if it finds
+    # the parts of a run instead of the run file). It refuses to start where there already is a run or the parts of one.
+    #     run = RunFile('run.npz', {'pulse_mag': 20e-3, 'pulse_width': 1e-3})
+    #     run.declare('pos', ('time', 'rxx', 'rxy'))
+    #     run.append('pos', t, rxx, rxy, loop=0)
+    #     run.close()
+    # Read it back with RunReader, or np.load() which sees the segments as 'pos/000000' and so on. convert_run.py
+    # writes the tab separated .txt files the scripts used to save.
+    dtype = np.dtype('<f8')
+
+    def __init__(self, path, params=None):
+        self.path = path
+        self.columns = {}
+        self.segments = {}
+        self._offset = 0
+        for name in (path, f'{path}.bin', f'{path}.idx'):
+            if os.path.exists(name):  # never overwrites an earlier run, see set_aside_run to keep it under a new name
+                raise FileExistsError(f'{name} already exists')
+        self._data_file = open(f'{path}.bin', 'xb')
+        self._index_file = open(f'{path}.idx', 'x')
+        self._write_index({'params': params or {}})
+
+    def declare(self, dataset, columns):
+        if dataset in self.columns:
+            raise ValueError(f'Dataset {dataset} already declared')
+        self.columns[dataset] = tuple(columns)
+        self.segments[dataset] = 0
+        self._write_index({'dataset': dataset, 'columns': self.columns[dataset]})
+
+    def append(self, dataset, *columns, **attributes):
+        # Adds one segment, given as one array per column in the order they were declared.
+        names = self.columns[dataset]
+        if len(columns) != len(names):
+            raise ValueError(f'Expected {len(names)} columns ({", ".join(names)}), got {len(columns)}')
+        block = np.ascontiguousarray(np.column_stack(columns), dtype=self.dtype)
+        self._data_file.write(block.tobytes())
+        self._data_file.flush()
+        os.fsync(self._data_file.fileno())
+        entry = {'dataset': dataset, 'offset': self._offset, 'rows': len(block)}
+        if attributes:
+            entry['attributes'] = attributes
+        self._write_index(entry)
+        self._offset += block.nbytes
+        self.segments[dataset] += 1
+
+    def close(self):
+        if self._data_file.closed:
+            return
+        self._data_file.close()
+        self._index_file.close()
+        finish_run(self.path)
+
+    def _write_index(self, entry):
+        self._index_file.write(json.dumps(entry, default=json_value) + '\n')
+        self._index_file.flush()
+        os.fsync(self._index_file.fileno())
+
+
+def finish_run(path):
+    # Builds the run file at `path` from the <path>.bin and <path>.idx a RunFile appends to, and deletes them. A half
+    # written last index line or segment (the program died mid-write) is left out.
+    with open(f'{path}.idx') as index_file:
+        lines = index_file.read().splitlines()
+    size = os.path.getsize(f'{path}.bin')
+    with zipfile.ZipFile(f'{path}.tmp', 'w', zipfile.ZIP_STORED) as archive, open(f'{path}.bin', 'rb') as data_file:
+        archive.writestr('params.json', json.dumps(json.loads(lines[0])['params']))
+        columns = {}
+        segments = {}
+        for line in lines[1:]:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                break
+            dataset = entry['dataset']
+            if 'columns' in entry:
+                columns[dataset] = entry['columns']
+                segments[dataset] = 0
+                archive.writestr(f'{dataset}/columns.json', json.dumps(columns[dataset]))
+                continue
+            count = entry['rows'] * len(columns[dataset])
+            if entry['offset'] + count * RunFile.dtype.itemsize > size:
+                break
+            data_file.seek(entry['offset'])
+            block = np.fromfile(data_file, dtype=RunFile.dtype, count=count).reshape(-1, len(columns[dataset]))
+            buffer = io.BytesIO()
+            np.lib.format.write_array(buffer, block, allow_pickle=False)
+            member = f'{dataset}/{segments[dataset]:06d}'
+            segments[dataset] += 1
+            archive.writestr(f'{member}.npy', buffer.getvalue())
+            if 'attributes' in entry:
+                archive.writestr(f'{member}.json', json.dumps(entry['attributes']))
+    os.replace(f'{path}.tmp', path)
+    os.remove(f'{path}.bin')
+    os.remove(f'{path}.idx')
+
+
+def set_aside_run(path):
+    # Moves an earlier run at `path` out of the way of a new one, keeping its data: the parts of a run that was never
+    # closed (the program died) are finished first, then the run file is renamed to <name>_1.npz, <name>_2.npz...
+    # whichever is free. Returns the new names, so the caller can say where the old data went.
+    kept = []
+    while os.path.exists(path) or os.path.exists(f'{path}.idx'):
+        if os.path.exists(f'{path}.idx') and not os.path.exists(path):
+            finish_run(path)
+        base, extension = os.path.splitext(path)
+        number = 1
+        while any(os.path.exists(f'{base}_{number}{extension}{part}') for part in ('', '.bin', '.idx')):
+            number += 1
+        kept.append(f'{base}_{number}{extension}')
+        os.rename(path, kept[-1])
+    return kept
+
+
+class RunReader:
+    # Reads a RunFile:
+    #     run = RunReader('run.npz')
+    #     run.params['pulse_width'], run.datasets  # -> ('pos', 'neg', ...)
+    #     t, rxx, rxy = run.data('pos').T          # all segments one after the other
+    #     first_loop = run.segment('pos', 0)
+    # Segments are memory mapped straight out of the zip (the members are stored uncompressed), so opening a run and
+    # looking at one loop is quick however big the file is and only what is used gets read from disk. If there is no
+    # run file but the parts of one that was never closed (the program died), the run file is built from them first.
+    def __init__(self, path):
+        self.path = path
+        if not os.path.exists(path) and os.path.exists(f'{path}.idx'):
+            finish_run(path)
+        with zipfile.ZipFile(path) as archive:
+            names = archive.namelist()
+            self._offsets = {info.filename: info.header_offset for info in archive.infolist()
+                             if info.compress_type == zipfile.ZIP_STORED}
+            self.params = json.loads(archive.read('params.json'))
+            self.columns = {}
+            for name in names:
+                if name.endswith('/columns.json'):
+                    self.columns[name[:-len('/columns.json')]] = tuple(json.loads(archive.read(name)))
+            self._members = {dataset: sorted(name for name in names if name.startswith(f'{dataset}/')
+                                             and name.endswith('.npy')) for dataset in self.columns}
+            self._attributes = {name[:-len('.json')]: json.loads(archive.read(name)) for name in names
+                                if name.endswith('.json') and name[:-len('.json')] + '.npy' in names}
+        self.datasets = tuple(self.columns)
+
+    def __contains__(self, dataset):
+        return dataset in self.columns
+
+    def n_segments(self, dataset):
+        return len(self._members[dataset])
+
+    def segment(self, dataset, index):
+        # A read only memory map of the segment, or a copy read from the zip if the member is compressed.
+        member = self._members[dataset][index]
+        if member not in self._offsets:
+            with zipfile.ZipFile(self.path) as archive:
+                with archive.open(member) as data:
+                    return np.lib.format.read_array(data, allow_pickle=False)
+        with open(self.path, 'rb') as data:
+            # Skip the member's local header (30 bytes plus its name and extra field) and then the .npy header.
+            data.seek(self._offsets[member])
+            name_length, extra_length = struct.unpack('<HH', data.read(30)[26:30])
+            data.seek(name_length + extra_length, os.SEEK_CUR)
+            version = np.lib.format.read_magic(data)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(data)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(data)
+            offset = data.tell()
+        if not np.prod(shape):
+            return np.empty(shape, dtype=dtype)
+        return np.memmap(self.path, dtype=dtype, mode='r', offset=offset, shape=shape,
+                         order='F' if fortran_order else 'C')
+
+    def segments(self, dataset):
+        return [self.segment(dataset, index) for index in range(self.n_segments(dataset))]
+
+    def attributes(self, dataset, index):
+        return self._attributes.get(self._members[dataset][index][:-len('.npy')], {})
+
+    def data(self, dataset):
+        # All segments of a dataset concatenated into one (n, n_columns) array. This reads the whole dataset into
+        # memory, use segment() or analysis.SwitchingRun to work through a big run a piece at a time.
+        segments = self.segments(dataset)
+        if not segments:
+            return np.empty((0, len(self.columns[dataset])))
+        return np.concatenate(segments)
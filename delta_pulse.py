@@ -1,8 +1,14 @@
-import instruments
+import os
+if os.environ.get('SIMULATED_INSTRUMENTS'):  # run without hardware, see simulated_instruments.py
+    import simulated_instruments as instruments
+else:
+    import instruments
 
 import numpy as np
 import matplotlib.pyplot as plt
 import time
+from k6221_tools import TraceReader, pulse_armed, sweep_duration
+from settle import Settle
 
 import tkinter as tk
 import tkinter.messagebox as mb
@@ -25,13 +31,14 @@ source.set_compliance(40)
 source.set_sense_chan_and_range(channel, volt_range)
 source.configure_linear_sweep(start, stop, step, delay, repeats)
 source.configure_pulse(width, 1, 1)
+trace_reader = TraceReader(source)
+trace_reader.configure()
 
 source.arm_pulse_sweep()
-time.sleep(2)
+Settle('Arm', minimum=50e-3, timeout=3).wait(pulse_armed(source))
 source.trigger()
 start_time = time.time()
-time.sleep(5)
-data = source.get_trace()
+data = trace_reader.read(len(current), sweep_duration(len(current), delay, width))
 print('time taken: ', time.time()-start_time)
 voltage = data[0::2]
 
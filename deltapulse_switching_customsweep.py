@@ -1,23 +1,41 @@
-import instruments
+import os
+if os.environ.get('SIMULATED_INSTRUMENTS'):  # run without hardware, see simulated_instruments.py
+    import simulated_instruments as instruments
+else:
+    import instruments
 
 import numpy as np
 import matplotlib.pyplot as plt
+import shutil
 import time
+from convert_run import convert
+from data_store import RunFile, RunReader, set_aside_run
+from k6221_tools import TraceReader, pulse_armed, sweep_duration
+from settle import Settle
+from switchbox_tools import plan_order, print_plan
 
 import tkinter as tk
 import tkinter.messagebox as mb
 from tkinter import filedialog as dialog
 
 
-def save(name, save_data, header):
-    print(save_data.shape)
-    if name:  # if a name was entered, don't save otherwise
+def save(name):
+    # Keeps the run file if the name ends in .npz, otherwise writes the old tab separated text file.
+    if not name:  # if a name was entered, don't save otherwise
+        print('Data not saved, it is still in temp_run.npz')
+    elif name.endswith('.npz'):
+        shutil.move('temp_run.npz', name)
+        print(f'Data saved as {name}')
+    else:
         if name[-4:] != '.txt':  # add .txt if not already there
             name = f'{name}.txt'
-        np.savetxt(name, save_data, header=header, newline='\r\n', delimiter='\t')  # save
+        convert(RunReader('temp_run.npz'), name)
         print(f'Data saved as {name}')
-    else:
-        print('Data not saved')
+
+
+def ass_to_str(assignment):
+    ass_string = str(assignment.values()).strip()
+    return ''.join(x for x in ass_string if x.isalpha())[-4:]
 
 
 frequency = 1
@@ -47,8 +65,14 @@ assignments = [{"I+": "A", "I-": "E", "V2+": "C", "V2-": "G"},
                {"I+": "H", "I-": "D", "V2+": "F", "V2-": "B"}]
 
 plot_styles = ['k.', 'k.', 'b+', 'b+', 'ro', 'ro', 'g*', 'g*']
-datasets = []
-header = ""
+# Each assignment is a dataset of its own in the run file so sweeps cut short don't have to match the others' length.
+for old_name in set_aside_run('temp_run.npz'):  # an earlier run that was never saved or died
+    print(f'Run file from an earlier run kept as {old_name}')
+run = RunFile('temp_run.npz', {'I_max': I_max, 'step': step, 'delay': delay, 'repeats': repeats, 'channel': channel,
+                               'volt_range': volt_range, 'width': width, 'compliance': compliance, 'bias': bias,
+                               'assignments': assignments})
+for assignment in assignments:
+    run.declare(ass_to_str(assignment), ('current', 'voltage'))
 
 source = instruments.K6221()
 sb = instruments.SwitchBox()
@@ -59,41 +83,49 @@ source.set_compliance(compliance)
 source.set_sense_chan_and_range(channel, volt_range)
 source.configure_custom_sweep(curr_list[1::], delay, compliance, repeats, bias, 'best')
 source.configure_pulse(width, 1, 1)
-
-for i, assignment in enumerate(assignments):
+n_points = len(curr_list[1::]) * repeats
+trace_reader = TraceReader(source)
+trace_reader.configure()
+arm_settle = Settle('Arm', minimum=50e-3, timeout=3)
+plt.ticklabel_format(useOffset=False)
+plt.xlabel('Current (mA)')
+plt.ylabel('Voltage (V)')
+
+
+def show_progress(data):
+    # Redraws the line of the assignment being measured with the readings so far while its sweep runs.
+    line.set_data(curr_vals[0:len(data) // 2], data[0::2])
+    plt.gca().relim()
+    plt.gca().autoscale_view()
+    plt.pause(0.01)
+
+
+# Measure the assignments in the order that changes the fewest relays, each sweep is saved under its own name anyway.
+order = plan_order(assignments)
+print_plan(assignments, order, switch_time=1)
+for i in order:
+    assignment = assignments[i]
     print(f'Switching to {assignment}')
     sb.switch(assignment)
     time.sleep(1)
     print('Arming pulse')
     source.arm_pulse_sweep()
-    time.sleep(2)
+    arm_settle.wait(pulse_armed(source))
     print('Starting measurement')
     source.trigger()
     start_time = time.time()
-    time.sleep(5)
-    # get_trace() loops until data is ready or it crashes.
-    data = source.get_trace()
+    line, = plt.plot([], [], plot_styles[i])
+    data = trace_reader.read(n_points, sweep_duration(n_points, delay, width), on_data=show_progress)
     print('Data retrieved')
 
     print('Time taken: ', time.time() - start_time)
     voltage = data[0::2]
-    plt.plot(curr_vals[0:len(voltage)], voltage, plot_styles[i])
-
-    plt.ticklabel_format(useOffset=False)
-    plt.xlabel('Current (mA)')
-    plt.ylabel('Voltage (V)')
-
-    datasets.append(np.column_stack((curr_vals[0:len(voltage)], voltage)))
-
-    ass_string = str(assignment.values()).strip()
-    header += ''.join(x for x in ass_string if x.isalpha())[-4:] + ", "
-
-    temp_data = np.column_stack(datasets)
 
-    save("temp_data.txt", temp_data, header)
+    run.append(ass_to_str(assignment), curr_vals[0:len(voltage)], voltage)
+run.close()
 
-file_name = dialog.asksaveasfilename(title='Save')
-save(file_name, np.column_stack(datasets), header)
+file_name = dialog.asksaveasfilename(title='Save', filetypes=(('run files', '*.npz'), ('text files', '*.txt')))
+save(file_name)
 plt.show()
 
 time.sleep(2)
@@ -1,9 +1,17 @@
-import instruments
+import os
+if os.environ.get('SIMULATED_INSTRUMENTS'):  # run without hardware, see simulated_instruments.py
+    import simulated_instruments as instruments
+else:
+    import instruments
 
 import numpy as np
 import matplotlib.pyplot as plt
+import shutil
 import time
 import pandas as pd
+from data_store import ColumnStore
+from k6221_tools import PulseSequencer, Segment, TraceReader, sweep_duration
+from table_writer import TableWriter
 
 import tkinter as tk
 import tkinter.messagebox as mb
@@ -45,12 +53,16 @@ curr_list = np.array([I_probe, -I_probe])
 curr_vals_pre_probe = np.tile(curr_list, pre_repeats)
 curr_vals_post_probe = np.tile(curr_list, post_repeats)
 
-pulse_current_data = []
-pulse_voltage_data = []
-pulse_time_data = []
-pulse_assignment_data = []
-probe_assignment_data = []
-final_dataframe = pd.DataFrame()
+# Every block of rows is appended to the table on disk as it is measured (see TableWriter), pump and probe names and
+# the row type are stored as categoricals.
+writer = TableWriter('temp_dataframe.hdf',
+                     {'I+': float, 'V+': float, 't+': float, 'I-': float, 'V-': float, 't-': float, 'loop': float,
+                      'pump': 'category', 'probe': 'category', 'type': 'category'},
+                     categories={'pump': [ass_to_str(assignment) for assignment in pulse_assignments],
+                                 'probe': [ass_to_str(assignment) for assignment in probe_assignments],
+                                 'type': ['pre', 'measurement', 'pulse']})
+print('Saving temp data as: temp_dataframe.hdf')
+probe_data = ColumnStore(('t', 'v', 'i'))  # all probe readings in the order they were taken, for the plots
 
 source = instruments.K6221()
 sb = instruments.SwitchBox()
@@ -62,21 +74,29 @@ absolute_reference_time = time.time()
 
 source.set_compliance(compliance)
 source.set_sense_chan_and_range(channel, volt_range)
-source.configure_custom_sweep(curr_list, delay, compliance, pre_repeats, bias, 'best')
-source.configure_pulse(width, 1, 1)
-sb.switch(probe_assignments[0])
-print('Arming pre_pulse  probing')
-source.arm_pulse_sweep()
-time.sleep(1)
-
-pre_start_time = time.time()
-print('Starting probing')
-source.trigger()
-time.sleep(5)
-pulse_data = source.get_trace(delay=5)
-print('Data retrieved')
-pre_voltage_data = pulse_data[0::2]
-pre_time_data = pulse_data[1::2]
+
+# The whole experiment as a list of sweeps: the pre-pulse probing and then for every loop, probe assignment and pump
+# assignment a single pump pulse followed by a probe block. Pump and probe lists alternate so every segment uploads its
+# list, the sequencer saves the sleeps before arming and switches to an assignment that is already switched in.
+sequence = [Segment('pre', probe_assignments[0], curr_list, pre_repeats, {'probe': ass_to_str(probe_assignments[0])})]
+for loop_count in range(loop_number):
+    for probe_assignment in probe_assignments:
+        for pulse_assignment in pulse_assignments:
+            info = {'loop': loop_count, 'pump': ass_to_str(pulse_assignment), 'probe': ass_to_str(probe_assignment)}
+            sequence.append(Segment('pump', pulse_assignment, [I_pulse], 1, info))
+            sequence.append(Segment('probe', probe_assignment, curr_list, post_repeats, info))
+sequencer = PulseSequencer(source, sb, delay, compliance, bias, width)
+sequencer.plan(sequence)
+trace_reader = TraceReader(source)
+trace_reader.configure()
+
+
+def read_segment(segment, on_data=None):
+    # Waits for the segment's sweep to finish, passing the readings so far to on_data as they come in.
+    n_points = len(segment.currents) * segment.repeats
+    return trace_reader.read(n_points, sweep_duration(n_points, delay, width), on_data=on_data)
+
+
 fig = plt.figure()
 delta_ax = fig.add_subplot(211)
 # plt.xlabel('Time(s)')
@@ -84,90 +104,84 @@ plt.ylabel('Delta Voltage (Volts)')
 res_ax = fig.add_subplot(212)
 plt.xlabel('Time(s)')
 plt.ylabel('Rxy (Ohms)')
-pre_delta_line, = delta_ax.plot((pre_start_time - absolute_reference_time + pre_time_data)[0::2],
-                                pre_voltage_data[0::2] + pre_voltage_data[1::2], 'g+')
-pre_res_line, = res_ax.plot(pre_start_time - absolute_reference_time + pre_time_data,
-                            np.abs(pre_voltage_data / curr_vals_pre_probe), 'g+')
+pre_delta_line, = delta_ax.plot([], [], 'g+')
+pre_res_line, = res_ax.plot([], [], 'g+')
 # pulse_line, = ax.plot([], [], 'r+')
 probe_delta_line, = delta_ax.plot([], [], 'k+')
 probe_res_line, = res_ax.plot([], [], 'k+')
-
-pre_dataframe = pd.DataFrame({'I+': curr_vals_pre_probe[0::2], 'V+': pre_voltage_data[0::2], 't+': pre_time_data[0::2],
-                              'I-': curr_vals_pre_probe[1::2], 'V-': pre_voltage_data[1::2], 't-': pre_time_data[1::2],
-                              'type': 'pre', 'probe': ass_to_str(probe_assignments[0])})
-
-final_dataframe = final_dataframe.append(pre_dataframe)
-
-for loop_count in range(loop_number):
-    for probe_assignment_count, probe_assignment in enumerate(probe_assignments):
-        for pulse_assignment_count, pulse_assignment in enumerate(pulse_assignments):
-            print(f'Switching to {ass_to_str(pulse_assignment)}')
-            sb.switch(pulse_assignment)
-            source.configure_custom_sweep([I_pulse], delay, compliance, 1, bias, 'best')
-            source.configure_pulse(width, 1, 1)
-            time.sleep(1)
-            print('Arming switching pulse')
-            source.arm_pulse_sweep()
-            print('Sending pulse')
-            pulse_time = time.time() - absolute_reference_time
-            source.trigger()
-            time.sleep(0.5)
-            data = source.get_trace(delay=0.1)
-            print('Data retrieved')
-            pulse_voltage = data[0::2][0]
-            pulse_voltage_data.append(pulse_voltage)
-            pulse_time_data.append(pulse_time)
-            pulse_current_data.append(I_pulse)
-            pulse_assignment_data.append(ass_to_str(pulse_assignment))
-            probe_assignment_data.append(ass_to_str(probe_assignment))
-
-            sb.switch(probe_assignment)
-            source.configure_custom_sweep(curr_list, delay, compliance, post_repeats, bias, 'best')
-            source.configure_pulse(width, 1, 1)
-            time.sleep(0.5)
-            print('Arming probe pulses')
-            source.arm_pulse_sweep()
-            print('Starting probing')
-            probe_time = time.time() - absolute_reference_time
-            source.trigger()
-            data = source.get_trace(delay=1)
-            print('Data retrieved')
-            print('Time taken: ', time.time() - absolute_reference_time - probe_time)
-            voltage = data[0::2]
-            time_data = data[1::2] + probe_time
-
-            final_dataframe = final_dataframe.append(pd.DataFrame(
-                {'I+': curr_vals_post_probe[0::2], 'I-': curr_vals_post_probe[1::2], 'V+': voltage[0::2],
-                 'V-': voltage[1::2], 't+': time_data[0::2], 't-': time_data[1::2],
-                 'pump': ass_to_str(pulse_assignment), 'probe': ass_to_str(probe_assignment), 'type': 'measurement',
-                 'loop': loop_count}))
-            full_data = final_dataframe.loc[final_dataframe['type'] == 'measurement']
-            tdata = full_data['t+'].append(full_data['t-']).to_numpy()
-            vdata = full_data['V+'].append(full_data['V-']).to_numpy()
-            idata = full_data['I+'].append(full_data['I-']).to_numpy()
-            probe_delta_line.set_xdata(tdata[0::2])
-            probe_delta_line.set_ydata(vdata[0::2] + vdata[1::2])
-
-            probe_res_line.set_xdata(tdata)
-            probe_res_line.set_ydata(np.abs(vdata / idata))
-
-            delta_ax.relim()
-            delta_ax.autoscale_view()
-
-            res_ax.relim()
-            res_ax.autoscale_view()
-
-            fig.canvas.draw()
-            fig.canvas.flush_events()
-
-            plt.pause(0.1)
-    pulse_df = pd.DataFrame(
-        {'I+': pulse_current_data, 'V+': pulse_voltage_data, 't+': pulse_time_data, 'pump': pulse_assignment_data,
-         'type': 'pulse', 'loop': loop_count})
-    final_dataframe = final_dataframe.append(pulse_df)
-    final_dataframe.to_hdf('temp_dataframe.hdf', key='data', mode='w')
-    print('Saving temp data as: temp_dataframe.hdf')
-
+live_res_line, = res_ax.plot([], [], 'b+')  # the probe block being measured
+
+
+def show_progress(data):
+    voltage = data[0::2]
+    live_res_line.set_data(data[1::2] + probe_time, np.abs(voltage / curr_vals_post_probe[:len(voltage)]))
+    res_ax.relim()
+    res_ax.autoscale_view()
+    plt.pause(0.01)
+
+
+for index, segment in enumerate(sequence):
+    if segment.name == 'pre':
+        print('Starting pre-pulse probing')
+        pre_start_time = sequencer.start(segment)
+        pulse_data = read_segment(segment)
+        print('Data retrieved')
+        pre_voltage_data = pulse_data[0::2]
+        pre_time_data = pulse_data[1::2]
+        # A sweep that timed out returns fewer readings, keep the whole V+/V- pairs so every column is the same length.
+        n = min(len(pre_voltage_data), len(pre_time_data), len(curr_vals_pre_probe)) // 2 * 2
+        pre_voltage_data, pre_time_data, pre_currents = pre_voltage_data[:n], pre_time_data[:n], curr_vals_pre_probe[:n]
+        pre_delta_line.set_data((pre_start_time - absolute_reference_time + pre_time_data)[0::2],
+                                pre_voltage_data[0::2] + pre_voltage_data[1::2])
+        pre_res_line.set_data(pre_start_time - absolute_reference_time + pre_time_data,
+                              np.abs(pre_voltage_data / pre_currents))
+        writer.append(**{'I+': pre_currents[0::2], 'V+': pre_voltage_data[0::2], 't+': pre_time_data[0::2],
+                         'I-': pre_currents[1::2], 'V-': pre_voltage_data[1::2], 't-': pre_time_data[1::2],
+                         'type': 'pre', 'probe': segment.info['probe']})
+
+    elif segment.name == 'pump':
+        print(f'Sending pulse on {segment.info["pump"]}')
+        pulse_time = sequencer.start(segment) - absolute_reference_time
+        data = read_segment(segment)
+        print('Data retrieved')
+        writer.append(**{'I+': I_pulse, 'V+': data[0] if len(data) else np.nan, 't+': pulse_time,
+                         'pump': segment.info['pump'], 'probe': segment.info['probe'], 'type': 'pulse',
+                         'loop': segment.info['loop']})
+
+    else:
+        print(f'Probing on {segment.info["probe"]}')
+        probe_time = sequencer.start(segment) - absolute_reference_time
+        data = read_segment(segment, on_data=show_progress)
+        live_res_line.set_data([], [])
+        print('Data retrieved')
+        print('Time taken: ', time.time() - absolute_reference_time - probe_time)
+        voltage = data[0::2]
+        time_data = data[1::2] + probe_time
+        # Only whole V+/V- pairs, as for the pre-pulse probing.
+        n = min(len(voltage), len(time_data), len(curr_vals_post_probe)) // 2 * 2
+        voltage, time_data, currents = voltage[:n], time_data[:n], curr_vals_post_probe[:n]
+        writer.append(**{'I+': currents[0::2], 'I-': currents[1::2], 'V+': voltage[0::2], 'V-': voltage[1::2],
+                         't+': time_data[0::2], 't-': time_data[1::2], 'pump': segment.info['pump'],
+                         'probe': segment.info['probe'], 'type': 'measurement', 'loop': segment.info['loop']})
+        probe_data.append(time_data, voltage, currents)
+        # Readings stay in +, - order so neighbouring pairs give the delta voltage.
+        tdata, vdata, idata = probe_data['t'], probe_data['v'], probe_data['i']
+        pairs = len(vdata) // 2
+        probe_delta_line.set_data(tdata[0:2 * pairs:2], vdata[0:2 * pairs:2] + vdata[1:2 * pairs:2])
+        probe_res_line.set_data(tdata, np.abs(vdata / idata))
+
+    delta_ax.relim()
+    delta_ax.autoscale_view()
+
+    res_ax.relim()
+    res_ax.autoscale_view()
+
+    fig.canvas.draw()
+    fig.canvas.flush_events()
+
+    plt.pause(0.1)
+
+sequencer.report()
 source.close()
 sb.close()
 meta_df = pd.DataFrame(
@@ -180,12 +194,12 @@ name = dialog.asksaveasfilename(title='Save')
 name = name.replace('.txt', '')
 name = name.replace('.hdf', '')
 name = name.replace('.h5', '')
-name += '.h5'
+if name:
+    name += '.h5'
+writer.put('meta_data', meta_df)
+writer.close()
 if name:  # if a name was entered, don't save otherwise
-    store = pd.HDFStore(name)
-    store['meta_data'] = meta_df
-    store['data'] = final_dataframe
+    shutil.move('temp_dataframe.hdf', name)
     print(f'Data saved as {name}')
-    store.close()
 else:
-    print('Data not saved')
+    print('Data not saved, it is still in temp_dataframe.hdf')
@@ -1,8 +1,13 @@
-import instruments
+import os
+if os.environ.get('SIMULATED_INSTRUMENTS'):  # run without hardware, see simulated_instruments.py
+    import simulated_instruments as instruments
+else:
+    import instruments
 
 import numpy as np
 import matplotlib.pyplot as plt
 import time
+from k6221_tools import TraceReader, sweep_duration
 
 import tkinter as tk
 import tkinter.messagebox as mb
@@ -26,6 +31,9 @@ source.connect_ethernet()
 source.set_compliance(40)
 source.set_sense_chan_and_range(channel, volt_range)
 source.configure_diff_conductance(start, stop, step, delta, delay)
+trace_reader = TraceReader(source)
+trace_reader.configure()
+n_points = len(current) // repeats  # readings per sweep
 
 time.sleep(2)
 
@@ -38,8 +46,7 @@ for i in range(repeats):
     time.sleep(loop_delay)
     source.trigger()
 
-    time.sleep(1)
-    data = source.get_trace(12)
+    data = trace_reader.read(n_points, sweep_duration(n_points, delay))
     dv_temp = data[0::2]
     t_temp = data[1::2]
     t = np.append(t, t_temp)
@@ -5,8 +5,10 @@ import time
 # from tkinter import filedialog as dialog
 import matplotlib
 import instruments
+from switchbox_tools import StatefulSwitchBox
 
-switchbox = instruments.SwitchBox()
+# Repeating a switch to the assignment already made is skipped.
+switchbox = StatefulSwitchBox(instruments.SwitchBox())
 #dual arm pulsing
 pulse1_assignments = {"I+": "BD", "I-": "FH"}
 # single arm pulsing
@@ -26,3 +28,4 @@ time.sleep(1)
 switchbox.switch(pulse2_assignments)
 time.sleep(1)
 switchbox.reset_all()
+switchbox.report()
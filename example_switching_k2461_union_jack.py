@@ -1,22 +1,21 @@
-import numpy as np
-import time
+import os
+if os.environ.get('SIMULATED_INSTRUMENTS'):  # run without hardware, see simulated_instruments.py
+    import simulated_instruments as instruments
+else:
+    import instruments
+
+import shutil
 import matplotlib
-import instruments
-import winsound
 from tkinter import filedialog as dialog
+from convert_run import convert
+from data_store import ColumnStore, RunFile, RunReader, set_aside_run
+from experiment import Experiment, ExperimentRunner, HeadlessRig
 
 matplotlib.use('Qt5Agg')
 import matplotlib.pyplot as plt
 
-def error_sound():
-    winsound.Beep(880, 200)
-    winsound.Beep(440, 200)
-
-
-def alert_sound():
-    winsound.Beep(440, 200)
-    winsound.Beep(660, 200)
-    winsound.Beep(880, 200)
+error_sound = instruments.error_sound
+alert_sound = instruments.alert_sound
 
 pulse1_assignments = {"I+": "B", "I-": "F"}  # configuration for a pulse from B to F
 pulse2_assignments = {"I+": "D", "I-": "H"}  # configuration for a pulse from D to H
@@ -30,109 +29,79 @@ pulse_width = 1e-3  # set pulse duration
 measure_current = 5e-4  # measurement current
 measure_number = 200  # number of measurements to store in buffer when calling measure_n and read_buffer. 375 is ~1min
 num_loops = 2
-measure_delay = measure_number * 0.15  # Not strictly necessary.
-
 
-
-pos_time = np.array([])
-neg_time = np.array([])
-pos_rxx = np.array([])
-neg_rxx = np.array([])
-pos_rxy = np.array([])
-neg_rxy = np.array([])
-
-switch_box = instruments.SwitchBox()  # make a sb object
-pulse_generator = instruments.K2461()  # make a k2461 object
-keithley = instruments.K2000()  # make a k2000 object
-balance_box = instruments.BalanceBox()
-start_time = time.time()  # use this for the graphing only
+# Pulse one way and measure, pulse the other way and measure. The measurements after the second pulse have always
+# integrated for 2 power line cycles, the first ones use the instruments' setting.
+experiment = Experiment(
+    [{'repeat': num_loops, 'steps': [
+        {'pulse': 'pulse1'},
+        {'measure': 'pos', 'assignment': 'measure'},
+        {'pulse': 'pulse2'},
+        {'measure': 'neg', 'assignment': 'measure', 'nplc': 2}]}],
+    {'pulse1': pulse1_assignments, 'pulse2': pulse2_assignments, 'measure': measure_assignments},
+    pulse={'magnitude': pulse_voltage, 'width': pulse_width, 'volts': True},
+    measure={'current': measure_current, 'n': measure_number})
+
+rig = HeadlessRig()
+rig.buffered_enabled = True  # the k2461 and k2000 fill their buffers from one trigger, see Rig.measure_points
 
 # actually connect to the instruments
-pulse_generator.connect()
-switch_box.connect(4)
-keithley.connect(3)
-balance_box.connect(5)
-balance_box.enable_all()
-balance_box.set_resistances(resistance_assignments)
+rig.pg.connect()
+rig.sb.connect(4)
+rig.dmm.connect(3)
+rig.connect_balance_box(5, resistance_assignments)
+
+for old_name in set_aside_run('temp_run.npz'):  # an earlier run that was never saved or died
+    print(f'Run file from an earlier run kept as {old_name}')
+run = RunFile('temp_run.npz', {**experiment.to_dict(), 'balance_box': resistance_assignments})
+stores = {}
+for dataset in ('pos', 'neg'):
+    run.declare(dataset, ('time', 'rxx', 'rxy'))
+    stores[dataset] = ColumnStore(('time', 'rxx', 'rxy'))
 
 plt.figure(1)
 plt.xlabel('Time (s)')
 plt.ylabel('R_xx (Ohms)')
 plt.ticklabel_format(useOffset=False)
+rxx_lines = {'pos': plt.plot([], [], 'k+')[0], 'neg': plt.plot([], [], 'r+')[0]}
 plt.figure(2)
 plt.xlabel('Time (s)')
 plt.ylabel('R_xy (Ohms)')
 plt.ticklabel_format(useOffset=False)
-for i in range(num_loops):
-    # pulse in one direction
-    switch_box.switch(pulse1_assignments)
-    plt.pause(200e-3)  # pauses to allow changes to apply before telling them to do something else.
-    pulse1_time = time.time()
-    pulse_generator.send_pulse(pulse_voltage, pulse_width)  # sends a pulse with given params
-    # print('Pulse current: ', pulse_current)  # just to show the set value.
-    plt.pause(200e-3)
-    switch_box.switch(measure_assignments)  # tells the switchbox to switch to a measurement assignment
-    pulse_generator.prepare_measure_n(measure_current, measure_number)  # tells the k2461 to prepare a vxx measurement
-    keithley.prepare_measure_n(measure_number)  # tells the k2000 to prepare a vxy measurement
-    plt.pause(200e-3)
-    keithley.trigger()  # actually starts measuring
-    pulse_generator.trigger()  # actually starts the measuring
-    # the instruments will wait for their "timeout" duration anyway but for large N manually waiting is necesasry
-    plt.pause(measure_delay)
-    # reads the values
-    t, vxx, curr = pulse_generator.read_buffer(measure_number)
-    vxy = keithley.read_buffer()
-    pos_time = np.append(pos_time, t + pulse1_time - start_time)
-    pos_rxx = np.append(pos_rxx, vxx/curr)
-    pos_rxy = np.append(pos_rxy, vxy/curr)
-
-    plt.figure(1)
-    plt.plot(pos_time, pos_rxx, 'k+')
-    plt.draw()
-    plt.figure(2)
-    plt.plot(pos_time, pos_rxy, 'k+')
-    plt.draw()
-
-    # repeat of above with other pulse direction.
-    switch_box.switch(pulse2_assignments)
-    plt.pause(200e-3)
-    pulse2_time = time.time()
-    pulse_generator.send_pulse(pulse_voltage, pulse_width)
-    plt.pause(200e-3)
-    switch_box.switch(measure_assignments)
-    pulse_generator.prepare_measure_n(measure_current, measure_number, 2)
-    keithley.prepare_measure_n(measure_number, 0, 2)
-    plt.pause(200e-3)
-    keithley.trigger()
-    pulse_generator.trigger()
-    plt.pause(measure_delay)
-    t, vxx, curr = pulse_generator.read_buffer(measure_number)
-    vxy = keithley.read_buffer()
-    neg_time = np.append(neg_time, t + pulse2_time - start_time)
-    neg_rxx = np.append(neg_rxx, vxx/curr)
-    neg_rxy = np.append(neg_rxy, vxy/curr)
-
-    plt.figure(1)
-    plt.plot(neg_time, neg_rxx, 'r+')
-    plt.draw()
-    plt.figure(2)
-    plt.plot(neg_time, neg_rxy, 'r+')
-    plt.draw()
-
-switch_box.reset_all()
+rxy_lines = {'pos': plt.plot([], [], 'k+')[0], 'neg': plt.plot([], [], 'r+')[0]}
+
+
+def on_data(dataset, t, rxx, rxy):
+    run.append(dataset, t, rxx, rxy)
+    store = stores[dataset]
+    store.append(t, rxx, rxy)
+    rxx_lines[dataset].set_data(store['time'], store['rxx'])
+    rxy_lines[dataset].set_data(store['time'], store['rxy'])
+    for line in (rxx_lines[dataset], rxy_lines[dataset]):
+        line.axes.relim()
+        line.axes.autoscale_view()
+    plt.pause(0.01)
+
+
+runner = ExperimentRunner(rig, experiment, on_data=on_data)
+runner.run()
+run.close()
+
+rig.sb.reset_all()
 alert_sound()
+runner.report()
 
-data = np.column_stack((pos_time, pos_rxx, pos_rxy, neg_time, neg_rxx, neg_rxy))
-name = dialog.asksaveasfilename(title='Save')
-if name:  # if a name was entered, don't save otherwise
-    if name[-4:] != '.txt':  # add .txt if not already there
-        name = f'{name}.txt'
-    np.savetxt(name, data, newline='\r\n', delimiter='\t')  # save
+name = dialog.asksaveasfilename(title='Save', filetypes=(('text files', '*.txt'), ('run files', '*.npz')))
+if not name:  # if a name was entered, don't save otherwise
+    print('Data not saved, it is still in temp_run.npz')
+elif name.endswith('.npz'):
+    shutil.move('temp_run.npz', name)
     print(f'Data saved as {name}')
 else:
-    print('Data not saved')
+    if name[-4:] != '.txt':  # add .txt if not already there
+        name = f'{name}.txt'
+    # pos and neg side by side, as before
+    for out_name in convert(RunReader('temp_run.npz'), name):
+        print(f'Data saved as {out_name}')
 
 plt.show()
-
-
-#  todo: add code to show how to loop through N measurements using trigger
\ No newline at end of file
@@ -1,5 +1,6 @@
 import instruments
 import time
+from switchbox_tools import plan_order, print_plan
 
 sb = instruments.SwitchBox()
 pg = instruments.K2461()
@@ -19,77 +20,23 @@ hor2_ass = {"I+": "F", "I-": "D", "V2+": "B", "V2-": "H"}
 hor3_ass = {"I+": "H", "I-": "B", "V2+": "D", "V2-": "F"}
 hor4_ass = {"I+": "D", "I-": "F", "V2+": "H", "V2-": "B"}
 
-sb.switch(vert1_ass)
-time.sleep(1)
-pg.enable_4_wire_probe(1e-3)
-time.sleep(1)
-c, v = pg.read_one()
-Rver1 = v / c
-pg.disable_probe_current()
-print(f'Vert1: {Rver1}')
-
-sb.switch(vert2_ass)
-time.sleep(1)
-pg.enable_4_wire_probe(1e-3)
-time.sleep(1)
-c, v = pg.read_one()
-Rver2 = v / c
-pg.disable_probe_current()
-print(f'Vert2: {Rver2}')
-
-sb.switch(vert3_ass)
-time.sleep(1)
-pg.enable_4_wire_probe(1e-3)
-time.sleep(1)
-c, v = pg.read_one()
-Rver3 = v / c
-pg.disable_probe_current()
-print(f'Vert3: {Rver3}')
-
-sb.switch(vert4_ass)
-time.sleep(1)
-pg.enable_4_wire_probe(1e-3)
-time.sleep(1)
-c, v = pg.read_one()
-Rver4 = v / c
-pg.disable_probe_current()
-print(f'Vert4: {Rver4}')
-
-sb.switch(hor1_ass)
-time.sleep(1)
-pg.enable_4_wire_probe(1e-3)
-time.sleep(1)
-c, v = pg.read_one()
-Rhor1 = v / c
-print(f'Vhor1: {Rhor1}')
-pg.disable_probe_current()
-
-sb.switch(hor2_ass)
-time.sleep(1)
-pg.enable_4_wire_probe(1e-3)
-time.sleep(1)
-c, v = pg.read_one()
-Rhor2 = v / c
-print(f'Vhor2: {Rhor2}')
-pg.disable_probe_current()
-
-sb.switch(hor3_ass)
-time.sleep(1)
-pg.enable_4_wire_probe(1e-3)
-time.sleep(1)
-c, v = pg.read_one()
-Rhor3 = v / c
-print(f'Vhor3: {Rhor3}')
-pg.disable_probe_current()
-
-sb.switch(hor4_ass)
-time.sleep(1)
-pg.enable_4_wire_probe(1e-3)
-time.sleep(1)
-c, v = pg.read_one()
-Rhor4 = v / c
-print(f'Vhor4: {Rhor4}')
-pg.disable_probe_current()
+# The eight configurations measured in the order that changes the fewest relays, ~2 s per switch with the pauses.
+names = ('Vert1', 'Vert2', 'Vert3', 'Vert4', 'Vhor1', 'Vhor2', 'Vhor3', 'Vhor4')
+assignments = (vert1_ass, vert2_ass, vert3_ass, vert4_ass, hor1_ass, hor2_ass, hor3_ass, hor4_ass)
+order = plan_order(assignments)
+print_plan(assignments, order, switch_time=2)
+resistances = {}
+for i in order:
+    sb.switch(assignments[i])
+    time.sleep(1)
+    pg.enable_4_wire_probe(1e-3)
+    time.sleep(1)
+    c, v = pg.read_one()
+    resistances[names[i]] = v / c
+    pg.disable_probe_current()
+    print(f'{names[i]}: {resistances[names[i]]}')
+Rver1, Rver2, Rver3, Rver4 = (resistances[name] for name in names[:4])
+Rhor1, Rhor2, Rhor3, Rhor4 = (resistances[name] for name in names[4:])
 
 Rvertical = (Rver1 + Rver2 + Rver3 + Rver4) / 4
 Rhorizontal = (Rhor1 + Rhor2 + Rhor3 + Rhor4) / 4
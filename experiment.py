@@ -0,0 +1,391 @@
+import json
+import os
+import time
+if os.environ.get('SIMULATED_INSTRUMENTS'):  # run without hardware, see simulated_instruments.py
+    import simulated_instruments as instruments
+else:
+    import instruments
+
+import numpy as np
+from tqdm import tqdm
+
+from acquisition import ParallelReader, in_sequence
+from instrument_trace import trace
+from scope_acquisition import ScopeReader
+from settle import Settle, all_ready, operation_complete, scope_armed
+from switchbox_tools import StatefulSwitchBox
+from tec_tools import TecSampler
+
+try:
+    import yaml
+except ImportError:  # yaml experiment files are optional, json always works
+    yaml = None
+
+# Switching experiments described as a list of steps and run by one scheduler, instead of a copy of the pulse and
+# measure code for every half-loop in every script. A description is a dict (or a json/yaml file of one):
+#     {"assignments": {"pulse1": {"I+": "B", "I-": "F"}, "pulse2": {"I+": "D", "I-": "H"},
+#                      "measure": {"I+": "A", "I-": "E", "V1+": "B", "V1-": "D", "V2+": "C", "V2-": "G"}},
+#      "pulse": {"magnitude": 15e-3, "width": 1e-3, "volts": false},   "vlim" too to limit current pulses' voltage
+#      "measure": {"current": 100e-6, "n": 100},   "nplc" too to set the integration time in buffered mode
+#      "steps": [{"repeat": 3, "steps": [{"pulse": "pulse1"}, {"measure": "pos", "assignment": "measure"},
+#                                        {"scope": "pos_scope"},
+#                                        {"pulse": "pulse2"}, {"measure": "neg", "assignment": "measure"},
+#                                        {"scope": "neg_scope"}]}]}
+# Steps are
+#     {"switch": name}                         switch to a named assignment
+#     {"pulse": name}                          switch to a named assignment and send one pulse
+#     {"measure": dataset, "assignment": name} probe and take n points (the tec too if it is logging), "n" and "nplc"
+#                                              in the step override the experiment's measure settings
+#     {"scope": dataset}                       download the scope trace of the last pulse (skipped if the scope is off)
+#     {"wait": seconds}                        a plain pause, e.g. between pulses, checking stop() every 0.1 s
+#     {"repeat": n, "steps": [...]}
+# The waits before and after pulses and before measuring end as soon as the instruments are ready (see settle.py). The
+# runner looks ahead so the next pulse is armed while a scope trace downloads, and it times every kind of step so slow
+# ones show up in its report.
+#     runner = ExperimentRunner(rig, load_experiment('switching.json'), on_data=print)
+#     runner.run()
+# on_data(dataset, t, ...) gets each block as it is measured: (t, rxx, rxy) for measure steps, (t, temperature) as
+# '<dataset>_tec' when the tec is logging and (t, current) for scope steps, followed by the volts of any other
+# channels in the rig's scope_channels, times from the start of the run.
+
+
+def read_description(path):
+    # The dict in a json or yaml file.
+    with open(path) as file:
+        if path.endswith(('.yaml', '.yml')):
+            if yaml is None:
+                raise ImportError('Reading yaml files needs PyYAML (pip install pyyaml), or use json')
+            return yaml.safe_load(file)
+        return json.load(file)
+
+
+def load_experiment(path):
+    return Experiment.from_dict(read_description(path))
+
+
+def switching_steps(loops):
+    # The standard protocol: pulse one way and measure, pulse the other way and measure, loops times.
+    return [{'repeat': loops, 'steps': [{'pulse': 'pulse1'}, {'measure': 'pos', 'assignment': 'measure'},
+                                        {'scope': 'pos_scope'},
+                                        {'pulse': 'pulse2'}, {'measure': 'neg', 'assignment': 'measure'},
+                                        {'scope': 'neg_scope'}]}]
+
+
+class Experiment:
+    step_kinds = ('switch', 'pulse', 'measure', 'scope', 'wait', 'repeat')
+
+    def __init__(self, steps, assignments, pulse=None, measure=None):
+        self.steps = list(steps)
+        self.assignments = dict(assignments)
+        self.pulse = {'magnitude': 0.0, 'width': 1e-3, 'volts': False, **(pulse or {})}
+        self.measure = {'current': 100e-6, 'n': 100, **(measure or {})}
+        self.check(self.steps)
+
+    @classmethod
+    def from_dict(cls, description):
+        return cls(description['steps'], description['assignments'], description.get('pulse'),
+                   description.get('measure'))
+
+    def to_dict(self):
+        return {'assignments': self.assignments, 'pulse': self.pulse, 'measure': self.measure, 'steps': self.steps}
+
+    def check(self, steps):
+        # Fails before anything is switched rather than halfway through a run.
+        for step in steps:
+            kinds = [kind for kind in self.step_kinds if kind in step]
+            if len(kinds) != 1:
+                raise ValueError(f'Each step needs exactly one of {", ".join(self.step_kinds)}: {step}')
+            for key in ('switch', 'pulse', 'assignment'):
+                if key in step and step[key] not in self.assignments:
+                    raise ValueError(f'Unknown assignment {step[key]} in {step}')
+            if 'repeat' in step:
+                self.check(step['steps'])
+
+    def flatten(self):
+        # Every step in the order it runs as (step, loop, loops), loop counting the outermost repeat from 0.
+        flat = []
+
+        def expand(steps, loop, loops):
+            for step in steps:
+                if 'repeat' in step:
+                    for i in range(step['repeat']):
+                        expand(step['steps'], i if loops == 1 else loop, step['repeat'] if loops == 1 else loops)
+                else:
+                    flat.append((step, loop, loops))
+        expand(self.steps, 0, 1)
+        return flat
+
+
+class Rig:
+    # The measurement primitives a switching experiment runs on. Mixed into Switching_GUI.DataCollector and HeadlessRig
+    # below, which provide the instruments: sb, pg (k2461), dmm (k2000), scope, scope_reader, tec_sampler,
+    # reference_resistance and, optionally, trace_log.
+    scope_enabled = False
+    scope_channels = (1,)  # shunt resistor channel, then any others to download after each pulse
+    tec_enabled = False
+    buffered_enabled = False
+    # Read the k2461 and k2000 at the same time rather than one after the other (see acquisition.py).
+    concurrent_fetch = True
+    reader = ParallelReader()
+    # Set up the next pulse while the scope trace of the last one downloads (see ExperimentRunner.scope).
+    pipelined_arming = True
+    trace_log = None
+
+    # Waits before and after each pulse and after switching to measure. Each one returns as soon as the instruments
+    # report they are ready (see settle.py) and the times actually waited are printed at the end of a run.
+    pre_pulse_settle = Settle('Pre pulse', minimum=50e-3, timeout=1)
+    post_pulse_settle = Settle('Post pulse', minimum=50e-3, timeout=1)
+    measure_settle = Settle('Measure', minimum=100e-3, timeout=1)
+
+    def trace_mark(self, text):
+        if self.trace_log is not None:
+            self.trace_log.mark(text)
+
+    def pulse_ready(self):
+        # The pulse can go once the k2461 has taken its settings and, if used, the scope is waiting for its trigger.
+        if self.scope_enabled:
+            return all_ready(operation_complete(self.pg), scope_armed(self.scope))
+        return operation_complete(self.pg)
+
+    def prepare_measurement(self, meas_curr, meas_n, nplc=None):
+        # Turns on the probe current. In buffered mode both instruments are also armed for meas_n triggered readings,
+        # integrating for nplc mains cycles each if given (the instruments' own setting otherwise).
+        if self.buffered_enabled:
+            if nplc is None:
+                self.pg.prepare_measure_n(meas_curr, meas_n)
+                self.dmm.prepare_measure_n(meas_n)
+            else:
+                self.pg.prepare_measure_n(meas_curr, meas_n, nplc=nplc)
+                self.dmm.prepare_measure_n(meas_n, nplc=nplc)
+        else:
+            self.pg.enable_4_wire_probe(meas_curr)
+
+    def measure_block(self, meas_n, desc):
+        # Returns absolute times, vxx, vxy, current and tec temperature (None if tec disabled) for meas_n points.
+        t, vxx, vxy, curr = self.measure_points(meas_n, desc)
+        tec_data = None
+        if self.tec_enabled:
+            # The tec is read by tec_sampler on its own thread and its log interpolated onto the measurement times,
+            # so logging the temperature does not slow the resistance measurements down.
+            tec_data = self.tec_sampler.interpolate(t)
+        return t, vxx, vxy, curr, tec_data
+
+    def measure_points(self, meas_n, desc):
+        if self.buffered_enabled:
+            # Both instruments fill their own buffers from one trigger and each buffer comes back in a single
+            # transfer, so the sample rate is set by the nplc rather than by the bus round trips.
+            trigger_t = time.time()
+            self.dmm.trigger()
+            self.pg.trigger()
+            if self.concurrent_fetch:
+                (t, vxx, curr), vxy = self.reader.read(lambda: self.pg.read_buffer(meas_n), self.dmm.read_buffer)
+            else:
+                t, vxx, curr = self.pg.read_buffer(meas_n)
+                vxy = self.dmm.read_buffer()
+            return np.asarray(t) + trigger_t, np.asarray(vxx), np.asarray(vxy), np.asarray(curr)
+
+        t = np.zeros(meas_n)
+        vxx = np.zeros(meas_n)
+        vxy = np.zeros(meas_n)
+        curr = np.zeros(meas_n)
+        if self.concurrent_fetch:
+            # Each instrument is triggered and read on its own thread. The point is timestamped just before the
+            # triggers go out, as in the sequential loop below.
+            reads = [in_sequence(self.pg.trigger_before_fetch, self.pg.fetch_one),
+                     in_sequence(self.dmm.trigger, self.dmm.fetch_one)]
+            for meas_count in tqdm(range(meas_n), desc=desc):
+                t[meas_count] = time.time()
+                (vxx[meas_count], curr[meas_count]), vxy[meas_count] = self.reader.read(*reads)
+            return t, vxx, vxy, curr
+        for meas_count in tqdm(range(meas_n), desc=desc):
+            t[meas_count] = time.time()
+            self.pg.trigger_before_fetch()
+            self.dmm.trigger()
+            vxx[meas_count], curr[meas_count] = self.pg.fetch_one()
+            vxy[meas_count] = self.dmm.fetch_one()
+        return t, vxx, vxy, curr
+
+
+class HeadlessRig(Rig):
+    # The same instruments and measurement methods as Switching_GUI.DataCollector, without Qt, for switching_cli.py
+    # and scripts. connect() takes a switching_cli config, scripts can connect the instruments themselves.
+    reference_resistance = 50.036  # shunt resistor the scope measures the pulse across
+    two_wire = 150
+
+    def __init__(self, trace_log=None):
+        self.trace_log = trace_log
+        self.sb = StatefulSwitchBox(trace(instruments.SwitchBox(), 'sb', trace_log))
+        self.bb = trace(instruments.BalanceBox(), 'bb', trace_log)
+        self.dmm = trace(instruments.K2000(), 'dmm', trace_log)
+        self.pg = trace(instruments.K2461(), 'pg', trace_log)
+        self.scope = trace(instruments.DS1104(), 'scope', trace_log)
+        self.scope_reader = ScopeReader(self.scope)
+        self.tec = trace(instruments.TEC1089SV(), 'tec', trace_log)
+        self.tec_sampler = TecSampler(self.tec, interval=0.25)
+        self.connected = []
+
+    def connect(self, config, experiment):
+        # Connects everything the config asks for, as Switching_GUI's handle_inputs does. Returns False if anything
+        # failed to connect.
+        ports = config.get('ports', {})
+        steps = [
+            ('switch box', self.sb, lambda: self.sb.connect(ports['sb'])),
+            ('Keithley 2000', self.dmm, lambda: self.dmm.connect(ports['dmm'])),
+            ('Keithley 2461', self.pg, self.pg.connect),
+        ]
+        if 'balance_box' in config:
+            steps.append(('balance box', self.bb, lambda: self.connect_balance_box(ports['bb'],
+                                                                                  config['balance_box'])))
+        # As in the gui the scope is only used for voltage pulses, its range is set from the pulse voltage.
+        self.scope_enabled = bool(config.get('scope')) and experiment.pulse['volts']
+        if self.scope_enabled:
+            steps.append(('RIGOL DS1104Z', self.scope, lambda: self.connect_scope(experiment.pulse)))
+        if 'tec' in config:
+            steps.append(('TEC', self.tec, lambda: self.tec.connect(ports['tec'])))
+        for name, instrument, connect in steps:
+            try:
+                connect()
+            except Exception as error:
+                print(f'Could not connect to {name}: {error}')
+                return False
+            self.connected.append(instrument)
+        self.buffered_enabled = bool(config.get('buffered'))
+        return True
+
+    def connect_balance_box(self, port, resistances):
+        self.bb.connect(port)
+        self.bb.enable_all()
+        self.bb.set_resistances(resistances)
+
+    def connect_scope(self, pulse):
+        self.scope.connect()
+        self.scope.prepare_for_pulse(pulse['magnitude'], self.reference_resistance, self.two_wire, pulse['width'])
+        self.scope.set_trig_chan()
+        self.scope_reader.invalidate()  # vertical scales have changed
+        time.sleep(12)
+
+    def close(self):
+        self.tec_sampler.stop()
+        if self.pg in self.connected:
+            try:
+                self.pg.disable_probe_current()
+            except Exception as error:
+                print(f'Could not turn off the probe current: {error}')
+        for instrument in self.connected:
+            try:
+                instrument.close()
+            except Exception as error:
+                print(f'Could not close {instrument}: {error}')
+        self.connected = []
+
+
+class ExperimentRunner:
+    # Runs an Experiment on a Rig. stop() is checked before every step, run() returns False if it stopped early.
+    def __init__(self, rig, experiment, on_data=None, stop=None):
+        self.rig = rig
+        self.experiment = experiment
+        self.on_data = on_data or (lambda dataset, *columns: None)
+        self.stop = stop or (lambda: False)
+        self.timings = {}
+        self.start_time = None
+        self._steps = []
+        self._armed = None  # index of the pulse step that is already armed
+        self._pulse_t = None
+
+    def run(self):
+        rig = self.rig
+        if not rig.buffered_enabled:
+            rig.dmm.prepare_measure_one()
+        self._steps = self.experiment.flatten()
+        self._armed = None
+        self.start_time = time.time()
+        for index, (step, loop, loops) in enumerate(self._steps):
+            if self.stop():
+                return False
+            kind = next(kind for kind in Experiment.step_kinds if kind in step)
+            start = time.time()
+            getattr(self, kind)(index, step, loop, loops)
+            self.timings.setdefault(kind, []).append(time.time() - start)
+        return True
+
+    def report(self):
+        for kind, times in self.timings.items():
+            print(f'{kind} steps: {len(times)}, mean {np.mean(times) * 1e3:.1f} ms, total {np.sum(times):.1f} s')
+
+    def switch(self, index, step, loop, loops):
+        self.rig.sb.switch(self.experiment.assignments[step['switch']])
+
+    def wait(self, index, step, loop, loops):
+        end = time.time() + step['wait']
+        while time.time() < end and not self.stop():
+            time.sleep(min(0.1, max(end - time.time(), 0)))
+
+    def pulse(self, index, step, loop, loops):
+        rig = self.rig
+        rig.trace_mark(f'loop {loop + 1} {step["pulse"]}')
+        if self._armed != index:
+            self.arm(step['pulse'])
+            if rig.scope_enabled:
+                rig.scope.single_trig()
+        self._armed = None
+        rig.pre_pulse_settle.wait(rig.pulse_ready())
+        self._pulse_t = time.time()
+        rig.pg.send_pulse()
+        rig.post_pulse_settle.wait(operation_complete(rig.pg))
+
+    def arm(self, name):
+        # Switches to the pulse contacts and gets the k2461 ready to pulse on a trigger. The settings are sent every
+        # time because setting up the probe current replaces them.
+        pulse = self.experiment.pulse
+        self.rig.sb.switch(self.experiment.assignments[name])
+        if pulse['volts']:
+            self.rig.pg.prepare_pulsing_voltage(pulse['magnitude'], pulse['width'])
+        else:
+            limit = {'vlim': pulse['vlim']} if 'vlim' in pulse else {}
+            self.rig.pg.prepare_pulsing_current(pulse['magnitude'], pulse['width'], **limit)
+        self.rig.pg.set_ext_trig()
+
+    def measure(self, index, step, loop, loops):
+        rig = self.rig
+        measure = {**self.experiment.measure, **{key: step[key] for key in ('n', 'nplc') if key in step}}
+        if 'assignment' in step:
+            rig.sb.switch(self.experiment.assignments[step['assignment']])
+        rig.prepare_measurement(measure['current'], measure['n'], measure.get('nplc'))
+        rig.measure_settle.wait(operation_complete(rig.pg))
+        t, vxx, vxy, curr, tec_data = rig.measure_block(measure['n'], f'Loop {loop + 1}/{loops}, {step["measure"]}')
+        rig.pg.disable_probe_current()
+        self.on_data(step['measure'], t - self.start_time, vxx / curr, vxy / curr)
+        if tec_data is not None:
+            self.on_data(f'{step["measure"]}_tec', t - self.start_time, tec_data)
+
+    def next_pulse(self, index):
+        # Index of the next pulse step if only scope downloads and waits come before it, otherwise None.
+        for following in range(index + 1, len(self._steps)):
+            step = self._steps[following][0]
+            if 'pulse' in step:
+                return following
+            if 'scope' not in step and 'wait' not in step:
+                return None
+        return None
+
+    def scope(self, index, step, loop, loops):
+        # Downloads the trace of the last pulse. With pipelined_arming the next pulse is armed on one thread while
+        # the scope downloads on another, so the gap between measuring and the next pulse is the slower of the two
+        # rather than both one after the other. The scope itself is only armed once both are done: switching the
+        # relays to the pulse contacts can trigger it.
+        rig = self.rig
+        if not rig.scope_enabled or self._pulse_t is None:
+            return
+        following = self.next_pulse(index) if rig.pipelined_arming else None
+
+        def download():
+            return rig.scope_reader.fetch(rig.scope_channels, 30001, 60000)
+
+        if following is None:
+            time_step, scope_data = download()
+        else:
+            (time_step, scope_data), _ = rig.reader.read(download, lambda: self.arm(self._steps[following][0]['pulse']))
+            rig.scope.single_trig()
+            self._armed = following
+        scope_time = np.arange(scope_data.shape[1]) * time_step + self._pulse_t - self.start_time
+        self.on_data(step['scope'], scope_time, scope_data[0] / rig.reference_resistance, *scope_data[1:])
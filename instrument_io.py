@@ -0,0 +1,59 @@
+import numpy as np
+
+# Helpers for talking to an instrument directly when the instruments package does not have a method for what we need
+# (status polling, binary transfers and so on). The instruments package keeps the open pyvisa resource or pyserial
+# port as an attribute of each instrument object so we look for it there rather than opening a second connection.
+# Instruments wrapped by instrument_trace.trace() are unwrapped to find the connection and the raw calls made here are
+# recorded in their trace log too.
+
+
+def get_resource(instrument):
+    instrument = getattr(instrument, 'wrapped', instrument)
+    for value in vars(instrument).values():
+        if hasattr(value, 'query') or (hasattr(value, 'write') and hasattr(value, 'readline')):
+            return value
+    raise AttributeError(f'Could not find an open connection on {type(instrument).__name__}. Is it connected?')
+
+
+def traced(function):
+    def wrapper(instrument, *args, **kwargs):
+        trace_call = getattr(instrument, 'trace_call', None)
+        if trace_call is None:
+            return function(instrument, *args, **kwargs)
+        return trace_call(function.__name__, args, lambda *a, **k: function(instrument.wrapped, *a, **k), kwargs)
+    wrapper.__name__ = function.__name__
+    return wrapper
+
+
+@traced
+def write(instrument, command):
+    resource = get_resource(instrument)
+    if hasattr(resource, 'query'):
+        resource.write(command)
+    else:
+        resource.write(f'{command}\r'.encode())
+
+
+@traced
+def query(instrument, command):
+    resource = get_resource(instrument)
+    if hasattr(resource, 'query'):
+        return resource.query(command).strip()
+    resource.write(f'{command}\r'.encode())
+    # Serial instruments end their replies with \r (sometimes followed by \n, which strip() removes from the next one).
+    return resource.read_until(b'\r').decode().strip()
+
+
+@traced
+def query_binary(instrument, command, datatype='f', is_big_endian=False, n_bytes=None):
+    # pyvisa resources parse the IEEE 488.2 block header themselves. Plain serial ports have no block header so the
+    # number of bytes to read has to be given.
+    resource = get_resource(instrument)
+    if hasattr(resource, 'query_binary_values'):
+        return resource.query_binary_values(command, datatype=datatype, is_big_endian=is_big_endian,
+                                            container=np.array)
+    resource.write(f'{command}\r'.encode())
+    raw = resource.read(n_bytes)
+    if len(raw) < n_bytes:
+        raise TimeoutError(f'Only received {len(raw)} of {n_bytes} bytes in reply to {command}')
+    return np.frombuffer(raw, dtype=np.dtype(datatype).newbyteorder('>' if is_big_endian else '<'))
@@ -0,0 +1,197 @@
+import argparse
+import os
+import struct
+import threading
+import time
+
+import numpy as np
+
+# Opt-in tracing of every instrument call. Wrap an instrument with trace() and each method call is recorded with its
+# arguments, duration and (approximately) the number of bytes sent and received into a compact binary log, e.g.
+#     log = TraceLog('trace.bin')
+#     pg = trace(instruments.K2461(), 'pg', log)
+# DataCollector does this for all of its instruments when the INSTRUMENT_TRACE environment variable is set to a file
+# name. Then
+#     python instrument_trace.py trace.bin --loop 2
+# prints per-call latency percentiles and a timeline of the second loop.
+#
+# Log format: a sequence of records, each starting with a one byte type.
+#     0 string:  uint32 id, uint16 length, utf-8 bytes (call names, arguments and marks are stored once each)
+#     1 call:    float64 start (unix time), float64 duration (s), uint32 bytes, uint32 name id, uint32 arguments id
+#     2 mark:    float64 time, uint32 text id
+
+STRING = 0
+CALL = 1
+MARK = 2
+string_header = struct.Struct('<BIH')
+call_record = struct.Struct('<BddIII')
+mark_record = struct.Struct('<BdI')
+max_argument_length = 120
+
+
+def n_bytes(value):
+    # Rough size of a value on the bus: its length for strings and arrays and 8 bytes per number.
+    if value is None:
+        return 0
+    if isinstance(value, (bytes, str)):
+        return len(value)
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (list, tuple)):
+        return sum(n_bytes(item) for item in value)
+    if isinstance(value, dict):
+        return sum(n_bytes(key) + n_bytes(item) for key, item in value.items())
+    return 8
+
+
+class TraceLog:
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'wb', buffering=1 << 16)
+        self._strings = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_environment(cls, variable='INSTRUMENT_TRACE'):
+        path = os.environ.get(variable)
+        return cls(path) if path else None
+
+    def _string_id(self, text):
+        # Must be called with the lock held.
+        string_id = self._strings.get(text)
+        if string_id is None:
+            string_id = len(self._strings)
+            self._strings[text] = string_id
+            encoded = text.encode()[:0xffff]
+            self._file.write(string_header.pack(STRING, string_id, len(encoded)) + encoded)
+        return string_id
+
+    def call(self, name, arguments, start, duration, size):
+        with self._lock:
+            record = call_record.pack(CALL, start, duration, size, self._string_id(name), self._string_id(arguments))
+            self._file.write(record)
+
+    def mark(self, text):
+        with self._lock:
+            self._file.write(mark_record.pack(MARK, time.time(), self._string_id(text)))
+
+    def flush(self):
+        with self._lock:
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+class TracedInstrument:
+    # Passes everything through to the wrapped instrument, timing each method call into the log.
+    def __init__(self, instrument, name, log):
+        self.wrapped = instrument
+        self.name = name
+        self.log = log
+
+    def trace_call(self, method, args, function, kwargs=None):
+        kwargs = kwargs or {}
+        start = time.time()
+        begin = time.perf_counter()
+        result = function(*args, **kwargs)
+        duration = time.perf_counter() - begin
+        arguments = ', '.join([repr(arg) for arg in args] + [f'{key}={value!r}' for key, value in kwargs.items()])
+        self.log.call(f'{self.name}.{method}', arguments[:max_argument_length], start, duration,
+                      n_bytes(args) + n_bytes(kwargs) + n_bytes(result))
+        return result
+
+    def __getattr__(self, attribute):
+        value = getattr(self.wrapped, attribute)
+        if not callable(value):
+            return value
+
+        def traced(*args, **kwargs):
+            return self.trace_call(attribute, args, value, kwargs)
+        return traced
+
+
+def trace(instrument, name, log):
+    # Returns the instrument unchanged when there is no log so tracing costs nothing when it is off.
+    if log is None:
+        return instrument
+    return TracedInstrument(instrument, name, log)
+
+
+def read_log(path):
+    # Returns the calls as a structured array (start, duration, bytes, name, arguments) and the marks as a list of
+    # (time, text). A record cut short at the end of the file (e.g. a crash) is ignored.
+    with open(path, 'rb') as file:
+        data = file.read()
+    strings = {}
+    calls = []
+    marks = []
+    position = 0
+    while position < len(data):
+        record_type = data[position]
+        try:
+            if record_type == STRING:
+                _, string_id, length = string_header.unpack_from(data, position)
+                position += string_header.size
+                if position + length > len(data):
+                    break
+                strings[string_id] = data[position:position + length].decode(errors='replace')
+                position += length
+            elif record_type == CALL:
+                _, start, duration, size, name_id, arguments_id = call_record.unpack_from(data, position)
+                position += call_record.size
+                calls.append((start, duration, size, strings[name_id], strings[arguments_id]))
+            elif record_type == MARK:
+                _, mark_time, text_id = mark_record.unpack_from(data, position)
+                position += mark_record.size
+                marks.append((mark_time, strings[text_id]))
+            else:
+                raise ValueError(f'Unknown record type {record_type} at byte {position} of {path}')
+        except struct.error:
+            break
+    dtype = [('start', float), ('duration', float), ('bytes', int), ('name', object), ('arguments', object)]
+    return np.array(calls, dtype=dtype), marks
+
+
+def print_summary(calls):
+    print(f'{"call":<34}{"count":>7}{"mean":>9}{"p50":>9}{"p90":>9}{"p99":>9}{"max":>9}{"total":>10}{"bytes":>11}')
+    print(f'{"":<34}{"":>7}{"(ms)":>9}{"(ms)":>9}{"(ms)":>9}{"(ms)":>9}{"(ms)":>9}{"(s)":>10}{"":>11}')
+    names = sorted(set(calls['name']), key=lambda name: -calls['duration'][calls['name'] == name].sum())
+    for name in names:
+        selected = calls[calls['name'] == name]
+        durations = selected['duration'] * 1e3
+        p50, p90, p99 = np.percentile(durations, [50, 90, 99])
+        print(f'{name:<34}{len(selected):>7}{durations.mean():>9.2f}{p50:>9.2f}{p90:>9.2f}{p99:>9.2f}'
+              f'{durations.max():>9.2f}{durations.sum() / 1e3:>10.2f}{selected["bytes"].sum():>11}')
+
+
+def print_timeline(calls, marks, loop):
+    # Marks are made at the start of every half-loop ("loop 1 pulse 1", "loop 1 pulse 2", ...).
+    starts = [mark_time for mark_time, text in marks if text.startswith(f'loop {loop} ')]
+    if not starts:
+        print(f'No marks for loop {loop} in this log.')
+        return
+    later = [mark_time for mark_time, text in marks if mark_time > starts[-1] and not text.startswith(f'loop {loop} ')]
+    end = later[0] if later else np.inf
+    selected = calls[(calls['start'] >= starts[0]) & (calls['start'] < end)]
+    events = sorted([(mark_time, None, text) for mark_time, text in marks if starts[0] <= mark_time < end] +
+                    [(call['start'], call, None) for call in selected], key=lambda event: event[0])
+    print(f'\nTimeline of loop {loop}:')
+    for event_time, call, text in events:
+        offset = (event_time - starts[0]) * 1e3
+        if call is None:
+            print(f'{offset:>10.1f} ms  --- {text} ---')
+        else:
+            print(f'{offset:>10.1f} ms  {call["duration"] * 1e3:>8.2f} ms  {call["name"]}({call["arguments"]})')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Summarise an instrument trace log.')
+    parser.add_argument('log', help='trace file written with INSTRUMENT_TRACE / TraceLog')
+    parser.add_argument('--loop', type=int, default=1, help='loop to print the timeline of (0 for none)')
+    args = parser.parse_args()
+    trace_calls, trace_marks = read_log(args.log)
+    print_summary(trace_calls)
+    if args.loop:
+        print_timeline(trace_calls, trace_marks, args.loop)
@@ -0,0 +1,169 @@
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from instrument_io import get_resource, query, query_binary, write
+from settle import Settle
+
+# One pulse delta sweep of an experiment: the switch box assignment to use, the list of currents and how many times
+# it is repeated. `info` is anything the script wants back with the data (loop number, pump/probe names...).
+Segment = namedtuple('Segment', ('name', 'assignment', 'currents', 'repeats', 'info'))
+
+
+def sweep_duration(n_points, delay, width=0.0):
+    # Rough time a pulse delta sweep of n points takes: one delay period plus the pulse itself per point.
+    return n_points * (delay + width)
+
+
+def pulse_armed(source):
+    # Ready once the 6221 reports the pulse delta sweep as armed.
+    def ready():
+        try:
+            return query(source, 'SOUR:PDEL:ARM?') == '1'
+        except Exception:
+            return False
+    return ready
+
+
+class PulseSequencer:
+    # Runs a list of Segments on the K6221 with the least reconfiguration. The 6221 only holds one sweep list at a
+    # time, so a segment that needs a different list from the one before has to upload it. What it does save is
+    #   - the fixed sleeps before arming and triggering, replaced by settles that end when the source reports armed,
+    #   - a sweep list (and repeat count) upload, with the pulse settings that every script sends straight after it,
+    #     when the list is the same as the one already loaded,
+    #   - a switch when the assignment is the one already switched in.
+    # Segments run in the order given, as the experiment needs, so uploads are only skipped when segments with the
+    # same list follow each other. In a pump-probe sequence the pump and probe lists alternate and every segment still
+    # uploads its list, there the time saved is in arming (and the odd switch). plan() prints what a sequence saves.
+    #     sequencer = PulseSequencer(source, sb, delay, compliance, width=500e-6)
+    #     segments = [Segment('probe', probe_assignment, curr_list, repeats, {}), ...]
+    #     sequencer.plan(segments)
+    #     for segment in segments:
+    #         trigger_time = sequencer.start(segment)
+    #         data = source.get_trace()
+    def __init__(self, source, sb, delay, compliance, bias=0.0, width=500e-6, sweep_range='best', switch_settle=None,
+                 arm_settle=None):
+        self.source = source
+        self.sb = sb
+        self.delay = delay
+        self.compliance = compliance
+        self.bias = bias
+        self.width = width
+        self.sweep_range = sweep_range
+        self.switch_settle = switch_settle or Settle('Switch', minimum=100e-3)
+        self.arm_settle = arm_settle or Settle('Arm', minimum=50e-3, timeout=3)
+        self._assignment = None
+        self._sweep = None
+        self.uploads = 0
+        self.skipped_uploads = 0
+
+    @staticmethod
+    def sweep_key(segment):
+        return tuple(np.asarray(segment.currents, dtype=float)), segment.repeats
+
+    def plan(self, segments):
+        # Prints how many switches and sweep uploads the segments need compared with reconfiguring every time.
+        assignment, sweep = self._assignment, self._sweep
+        switches = uploads = 0
+        for segment in segments:
+            switches += segment.assignment != assignment
+            uploads += self.sweep_key(segment) != sweep
+            assignment, sweep = segment.assignment, self.sweep_key(segment)
+        print(f'{len(segments)} segments: {switches} switches and {uploads} sweep uploads '
+              f'(instead of {len(segments)} of each)')
+        return switches, uploads
+
+    def configure(self, segment):
+        if segment.assignment != self._assignment:
+            self.sb.switch(segment.assignment)
+            self._assignment = segment.assignment
+            self.switch_settle.wait()
+        if self.sweep_key(segment) != self._sweep:
+            self.source.configure_custom_sweep(segment.currents, self.delay, self.compliance, segment.repeats,
+                                               self.bias, self.sweep_range)
+            self.source.configure_pulse(self.width, 1, 1)
+            self._sweep = self.sweep_key(segment)
+            self.uploads += 1
+        else:
+            self.skipped_uploads += 1
+
+    def start(self, segment):
+        # Configures what has changed, arms, triggers and returns the time of the trigger.
+        self.configure(segment)
+        self.source.arm_pulse_sweep()
+        self.arm_settle.wait(pulse_armed(self.source))
+        trigger_time = time.time()
+        self.source.trigger()
+        return trigger_time
+
+    def invalidate(self):
+        # Call if anything else has reconfigured the source or switch box.
+        self._assignment = None
+        self._sweep = None
+
+    def report(self):
+        print(f'Sweep lists uploaded {self.uploads} times, {self.skipped_uploads} uploads skipped')
+        self.switch_settle.report()
+        self.arm_settle.report()
+
+
+class TraceReader:
+    # Fetches the readings of a 6221 sweep as they are taken instead of sleeping and then sitting in get_trace().
+    # It polls TRAC:POIN:ACT? (how many readings are in the buffer) at most every poll_interval seconds, pulls just the
+    # new readings with TRAC:DATA:SEL? each time (as 4 byte floats over ethernet/GPIB, ascii over RS232) and returns
+    # the same [v0, t0, v1, t1, ...] array as get_trace():
+    #     reader = TraceReader(source)
+    #     reader.configure()  # once after connecting
+    #     ...arm and trigger...
+    #     data = reader.read(n_points, sweep_duration(n_points, delay, width), on_data=update_plot)
+    # on_data(data) is called with everything read so far each time new readings arrive, so plots can fill in while a
+    # long sweep runs. read() gives up and returns what it has if the sweep takes more than `timeout` (by default
+    # twice the expected duration plus 10 s). configure() changes the data format so don't mix this with get_trace().
+    def __init__(self, source, binary=True, poll_interval=0.5):
+        self.source = source
+        self.binary = binary
+        self.poll_interval = poll_interval
+
+    def configure(self):
+        # Plain serial ports don't parse the binary block header so RS232 connections stay in ascii.
+        self.binary = self.binary and hasattr(get_resource(self.source), 'query_binary_values')
+        write(self.source, 'FORM:ELEM READ,TST')
+        if self.binary:
+            write(self.source, 'FORM:DATA SRE')
+            write(self.source, 'FORM:BORD SWAP')
+        else:
+            write(self.source, 'FORM:DATA ASC')
+
+    def points(self):
+        return int(float(query(self.source, 'TRAC:POIN:ACT?')))
+
+    def fetch(self, start, count):
+        # Readings start to start + count - 1 (counting from 0), interleaved with their timestamps.
+        command = f'TRAC:DATA:SEL? {start},{count}'
+        if self.binary:
+            return np.asarray(query_binary(self.source, command, datatype='f'), dtype=float)
+        return np.array(query(self.source, command).split(','), dtype=float)
+
+    def read(self, n_points, duration=None, timeout=None, on_data=None):
+        start_time = time.time()
+        duration = n_points * self.poll_interval if duration is None else duration
+        timeout = 2 * duration + 10 if timeout is None else timeout
+        data = np.empty(2 * n_points)
+        fetched = 0
+        while fetched < n_points:
+            available = min(self.points(), n_points)
+            if available > fetched:
+                data[2 * fetched:2 * available] = self.fetch(fetched, available - fetched)
+                fetched = available
+                if on_data is not None:
+                    on_data(data[:2 * fetched])
+                if fetched == n_points:
+                    break
+            elapsed = time.time() - start_time
+            if elapsed > timeout:
+                print(f'Sweep not finished after {timeout:.0f} s, only {fetched} of {n_points} readings taken')
+                break
+            # Don't poll faster than poll_interval but don't oversleep the end of the sweep either.
+            time.sleep(min(self.poll_interval, max(duration - elapsed, 0.02)))
+        return data[:2 * fetched]
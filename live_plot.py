@@ -0,0 +1,113 @@
+import numpy as np
+from PyQt5 import QtCore
+
+
+def decimate_minmax(x, y, n_columns):
+    # Reduces a series to at most two points (the min and the max) per pixel column of the axes it is drawn on.
+    # Drawn as a connected line this looks the same as the full series, spikes included, but costs next to nothing to
+    # draw. It drops every point between the min and max of a column, so it is no good for markers (see decimated()).
+    x = np.asarray(x)
+    y = np.asarray(y)
+    if len(x) <= 2 * n_columns:
+        return x, y
+    finite = np.isfinite(x) & np.isfinite(y)
+    x = x[finite]
+    y = y[finite]
+    if len(x) <= 2 * n_columns:
+        return x, y
+    x_min = x.min()
+    x_span = x.max() - x_min
+    if x_span == 0:
+        columns = np.zeros(len(x), dtype=int)
+    else:
+        columns = np.minimum(((x - x_min) / x_span * n_columns).astype(int), n_columns - 1)
+    # Sort by column then y so the first and last entry of each column are its min and max.
+    order = np.lexsort((y, columns))
+    sorted_columns = columns[order]
+    starts = np.flatnonzero(np.r_[True, sorted_columns[1:] != sorted_columns[:-1]])
+    ends = np.r_[starts[1:], len(order)] - 1
+    keep = np.unique(np.concatenate((order[starts], order[ends])))
+    return x[keep], y[keep]
+
+
+def decimated(line):
+    # Only plain lines are decimated. A marker only plot ('k.') would show two dots per pixel column instead of the
+    # data, and a line with markers would lose the markers in between, so those are drawn in full.
+    return line.get_linestyle() not in ('None', '') and line.get_marker() in ('None', '', None)
+
+
+class LivePlotter(QtCore.QObject):
+    # Frame rate capped plotting for data that arrives faster than it can be drawn.
+    # set_data() just records the newest data for a line and returns straight away. A timer then draws whatever is
+    # pending at most max_fps times a second, so any number of updates between frames cost one draw. Plain lines are
+    # decimated to the pixel width of their axes (see decimated()) and, unless the axis limits have changed, only the
+    # lines are redrawn (blitted) over a cached background instead of redrawing the whole figure.
+    def __init__(self, max_fps=10, parent=None):
+        super(LivePlotter, self).__init__(parent)
+        self._pending = {}
+        self._lines = {}
+        self._connections = {}
+        self._backgrounds = {}
+        self.timer = QtCore.QTimer(self)
+        self.timer.timeout.connect(self.on_timer)
+        self.timer.start(int(1000 / max_fps))
+
+    def add_line(self, line):
+        # Lines are animated so that full draws leave them out of the cached background.
+        line.set_animated(True)
+        figure = line.axes.figure
+        if figure not in self._lines:
+            self._lines[figure] = []
+            self._connections[figure] = figure.canvas.mpl_connect('draw_event',
+                                                                  lambda event, fig=figure: self.on_draw(fig))
+        self._lines[figure].append(line)
+
+    def clear(self):
+        # Forget all lines, e.g. before the figures are cleared and replotted for a new measurement.
+        for figure, connection in self._connections.items():
+            figure.canvas.mpl_disconnect(connection)
+        self._pending = {}
+        self._lines = {}
+        self._connections = {}
+        self._backgrounds = {}
+
+    def set_data(self, line, x, y):
+        self._pending[line] = (x, y)
+
+    def on_draw(self, figure):
+        # Called after every full draw (including resizes) to refresh the background and put the lines back on top.
+        self._backgrounds[figure] = figure.canvas.copy_from_bbox(figure.bbox)
+        for line in self._lines.get(figure, []):
+            line.axes.draw_artist(line)
+
+    def on_timer(self):
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, {}
+        figures = {}
+        for line, (x, y) in pending.items():
+            axes = line.axes
+            if decimated(line):
+                x, y = decimate_minmax(x, y, max(int(axes.bbox.width), 1))
+            line.set_data(x, y)
+            figures.setdefault(axes.figure, set()).add(axes)
+        for figure, axes_set in figures.items():
+            self.redraw(figure, axes_set)
+
+    def redraw(self, figure, axes_set):
+        limits_changed = False
+        for axes in axes_set:
+            limits = (axes.get_xlim(), axes.get_ylim())
+            axes.relim()
+            axes.autoscale_view()
+            if (axes.get_xlim(), axes.get_ylim()) != limits:
+                limits_changed = True
+        background = self._backgrounds.get(figure)
+        if limits_changed or background is None:
+            # Ticks and labels have to change so everything is drawn. on_draw() then caches the new background.
+            figure.canvas.draw()
+        else:
+            figure.canvas.restore_region(background)
+            for line in self._lines[figure]:
+                line.axes.draw_artist(line)
+            figure.canvas.blit(figure.bbox)
@@ -0,0 +1,115 @@
+import time
+
+import numpy as np
+
+from acquisition import ParallelReader
+from instrument_io import query, query_binary, write
+
+# Faster reads for the SR830 over RS232. get_radius() and get_angle() are a query each, so reading R and theta from
+# two lock-ins is four round trips at 9600 baud and R and theta are not even from the same instant. SNAP? returns up
+# to six parameters sampled at the same time in one reply, and LockinPair reads both lock-ins at once. For faster
+# sampling than the serial link allows, LockinBuffer records into the lock-in's own memory and downloads it after.
+
+snap_codes = {'x': 1, 'y': 2, 'r': 3, 'theta': 4}
+
+
+def snap(lockin, parameters=('r', 'theta', 'x', 'y')):
+    # Returns the requested parameters, all taken at the same instant, as a tuple of floats in the order asked for.
+    codes = ','.join(str(snap_codes[parameter]) for parameter in parameters)
+    return tuple(float(value) for value in query(lockin, f'SNAP? {codes}').split(','))
+
+
+class LockinPair:
+    # Snapshots two (or more) lock-ins concurrently, one thread per serial port:
+    #     lockins = LockinPair(top_lockin, bot_lockin)
+    #     (rxx_r, rxx_theta), (rxy_r, rxy_theta) = lockins.read(('r', 'theta'))
+    # or records a block of points into their internal buffers (see LockinBuffer):
+    #     lockins.configure_buffers(rate=512)
+    #     (t, rxx_r, rxx_theta), (_, rxy_r, rxy_theta) = lockins.record(5000)
+    def __init__(self, *lockins):
+        self.lockins = lockins
+        self.reader = ParallelReader(max_workers=len(lockins))
+        self.buffers = []
+
+    def read(self, parameters=('r', 'theta', 'x', 'y')):
+        return self.reader.read(*[lambda lockin=lockin: snap(lockin, parameters) for lockin in self.lockins])
+
+    def configure_buffers(self, rate=512):
+        self.buffers = [LockinBuffer(lockin, rate) for lockin in self.lockins]
+        self.reader.read(*[buffer.configure for buffer in self.buffers])
+
+    def record(self, n):
+        # Starts all the buffers, waits until each has n points, stops them and downloads them together. Returns a
+        # (t, r, theta) tuple per lock-in.
+        if n > buffer_size:
+            raise ValueError(f'The SR830 buffer only holds {buffer_size} points, {n} were asked for')
+        for buffer in self.buffers:
+            buffer.start()
+        time.sleep(n / min(buffer.rate for buffer in self.buffers))
+        for buffer in self.buffers:
+            while buffer.points() < n:
+                time.sleep(0.1)
+        for buffer in self.buffers:
+            buffer.pause()
+        return self.reader.read(*[lambda buffer=buffer: buffer.read(n) for buffer in self.buffers])
+
+    def close(self):
+        self.reader.close()
+
+
+# Sample rates of the internal buffer, index i is SRAT i: 62.5 mHz to 512 Hz in factors of two.
+buffer_rates = 2.0 ** np.arange(-4, 10)
+buffer_size = 16383  # points per channel
+
+
+class LockinBuffer:
+    # Records R and theta in the SR830's internal data buffer at up to 512 Hz and downloads them afterwards as binary
+    # floats, so fast dynamics (e.g. the relaxation after a pulse) are not limited by polling over 9600 baud.
+    #     buffer = LockinBuffer(top_lockin, rate=512)
+    #     buffer.configure()
+    #     buffer.start()
+    #     ...wait...
+    #     buffer.pause()
+    #     t, r, theta = buffer.read()
+    # Channel 1 is set to display R and channel 2 theta because the buffers store whatever the displays show.
+    def __init__(self, lockin, rate=512):
+        self.lockin = lockin
+        self.rate_index = int(np.argmin(abs(np.log2(buffer_rates / rate))))
+        self.rate = buffer_rates[self.rate_index]
+        self.start_time = None
+
+    def configure(self):
+        write(self.lockin, 'DDEF 1,1,0')
+        write(self.lockin, 'DDEF 2,1,0')
+        write(self.lockin, f'SRAT {self.rate_index}')
+        write(self.lockin, 'SEND 0')  # stop when the buffer is full rather than loop over old data
+        write(self.lockin, 'TSTR 0')
+        write(self.lockin, 'REST')
+
+    def start(self):
+        write(self.lockin, 'REST')
+        write(self.lockin, 'STRT')
+        self.start_time = time.time()
+
+    def pause(self):
+        write(self.lockin, 'PAUS')
+
+    def points(self):
+        return int(query(self.lockin, 'SPTS?'))
+
+    def duration(self):
+        # Longest recording that fits in the buffer, in seconds.
+        return buffer_size / self.rate
+
+    def read(self, n=None, chunk=4096):
+        # Returns times (estimated from when start() was called), R and theta for the first n stored points (all of
+        # them by default). Each channel comes back as 4 byte floats in chunks of up to `chunk` points.
+        n = self.points() if n is None else n
+        channels = np.empty((2, n))
+        for row, channel in enumerate((1, 2)):
+            for start in range(0, n, chunk):
+                count = min(chunk, n - start)
+                channels[row, start:start + count] = query_binary(self.lockin, f'TRCB? {channel},{start},{count}',
+                                                                  datatype='f', n_bytes=4 * count)
+        t = self.start_time + np.arange(n) / self.rate
+        return t, channels[0], channels[1]
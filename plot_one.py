@@ -43,33 +43,51 @@
 # plt.show()
 
 
+import sys
 import tkinter as tk
 from tkinter import filedialog
 import numpy as np
 import matplotlib.pyplot as plt
-from scipy import signal
+from analysis import SwitchingRun, chunked, load_table, savgol
 
-import os
+# Text files are parsed once and cached as <file>.npy so opening them again is quick. Run files (.npz) from
+# Switching_GUI are memory mapped and only the loop asked for is read: python plot_one.py [loop]
 
 root = tk.Tk()
 root.withdraw()
 filename = filedialog.askopenfilename(initialdir='../DATA/',
                                       title='Select a switching file',
-                                      filetypes=(('data files', '*.txt *.dat'), ('all files', '*.*')))
+                                      filetypes=(('data files', '*.txt *.dat *.npz'), ('all files', '*.*')))
 
-data = np.loadtxt(filename, delimiter='\t', skiprows=1)
+if filename.endswith('.npz'):
+    run = SwitchingRun(filename)
+    loops = [int(sys.argv[1])] if len(sys.argv) > 1 else range(len(run))
+    fig, (rxx_ax, rxy_ax) = plt.subplots(2, 1, sharex=True)
+    for loop in loops:
+        for data, style in zip(run.loop(loop), ('k.', 'r.')):
+            rxx_ax.plot(data[:, 0], data[:, 1], style)
+            rxy_ax.plot(data[:, 0], data[:, 2], style)
+    rxx_ax.set_ylabel('R_xx (Ohms)')
+    rxy_ax.set_ylabel('R_xy (Ohms)')
+    rxy_ax.set_xlabel('Time (s)')
+    rxx_ax.ticklabel_format(useOffset=False)
+    rxy_ax.ticklabel_format(useOffset=False)
+    plt.show()
+    sys.exit()
+
+data = load_table(filename, delimiter='\t', skiprows=1)
 
 # x = data[:, 0]
 # y = data[:,3]
 x = data[:, 6] / 15e-3
-rxy_sum = data[:, 4] + data[:, 5]
-rxy_diff = -data[:, 4] + data[:, 5]
+rxy_sum = chunked(np.add, data[:, 4], data[:, 5])
+rxy_diff = chunked(np.subtract, data[:, 5], data[:, 4])
 
-rxx_diff = -data[:, 2] + data[:, 3]
+rxx_diff = chunked(np.subtract, data[:, 3], data[:, 2])
 rxx_part = np.mean(data[:, 2]) + np.mean(data[:, 3])
-y = signal.savgol_filter(200*rxy_sum/rxx_part, 31, 3)
+y = savgol(200*rxy_sum/rxx_part, 31, 3)
 y = data[:, 2]
-y2 = signal.savgol_filter(200*(rxx_diff- np.mean(rxy_diff[0:20]))/rxx_part, 11, 3)
+y2 = savgol(200*(rxx_diff- np.mean(rxy_diff[0:20]))/rxx_part, 11, 3)
 y2 -= np.min(y2)
 line, = plt.plot(x, y, 'k.')
 # # plt.plot([min(current), max(current)], [min(voltage), max(voltage)])
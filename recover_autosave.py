@@ -0,0 +1,21 @@
+import os
+import sys
+
+from convert_run import convert
+from data_store import RunReader
+
+# Rebuilds the data files Switching_GUI would have saved from what it writes while running, e.g. after the GUI has
+# crashed or been closed mid-run. Run from the directory the GUI was started in:
+#     python recover_autosave.py [output_name.txt]
+# The run file the GUI appends to (temp_run.npz) is finished from its parts and converted, with pos and neg data side
+# by side in the same layout as a normal save. If the run died between the two halves of a loop the shorter columns
+# are padded with nan.
+
+
+if __name__ == '__main__':
+    name = sys.argv[1] if len(sys.argv) > 1 else 'recovered_data.txt'
+    if not os.path.exists('temp_run.npz.idx'):
+        print('No unfinished run (temp_run.npz.idx) found in this directory.')
+        sys.exit(1)
+    for out_name in convert(RunReader('temp_run.npz'), name):
+        print(f'Recovered temp_run.npz into {out_name}')
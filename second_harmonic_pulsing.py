@@ -1,4 +1,9 @@
-import instruments
+import os
+if os.environ.get('SIMULATED_INSTRUMENTS'):  # run without hardware, see simulated_instruments.py
+    import simulated_instruments as instruments
+else:
+    import instruments
+from lockin_tools import LockinPair
 
 import numpy as np
 import matplotlib.pyplot as plt
@@ -15,6 +20,9 @@ num_points = 5000
 num_loops = 2
 frequency = 357
 tc = 0.1
+# Set to a rate in Hz (up to 512) to record each pulse in the lock-ins' internal buffers instead of polling them over
+# RS232. num_points are then taken at that rate, i.e. over num_points / rate seconds.
+lockin_buffer_rate = None
 
 pulse1_assignments = {"I+": "B", "I-": "F"}
 pulse2_assignments = {"I+": "D", "I-": "H"}
@@ -41,6 +49,9 @@ source.connect_RS232(16)
 top_lockin.connect(6)
 bot_lockin.connect(10)
 pg.connect()
+lockins = LockinPair(top_lockin, bot_lockin)  # snapshot R and theta from both lock-ins at once
+if lockin_buffer_rate:
+    lockins.configure_buffers(lockin_buffer_rate)
 root = tk.Tk()
 base_name = dialog.asksaveasfilename(title='Define base name for files')
 root.withdraw()
@@ -124,13 +135,18 @@ if not base_name == '':
             source.wave_output_on()
             # time.sleep(500e-3)
             time.sleep(1)
-            for i in range(0, num_points):
-                t_pos[i + j * num_points] = time.time() - start_time
-                rxx_pos_r[i + j * num_points] = top_lockin.get_radius()
-                # rxx_pos_r[i + j*num_points] = dmm.measure_one()*k2000_scaling
-                rxx_pos_theta[i + j * num_points] = top_lockin.get_angle()
-                rxy_pos_r[i + j * num_points] = bot_lockin.get_radius()
-                rxy_pos_theta[i + j * num_points] = bot_lockin.get_angle()
+            block = slice(j * num_points, (j + 1) * num_points)
+            if lockin_buffer_rate:
+                (t, rxx_pos_r[block], rxx_pos_theta[block]), (_, rxy_pos_r[block], rxy_pos_theta[block]) = \
+                    lockins.record(num_points)
+                t_pos[block] = t - start_time
+            else:
+                for i in range(0, num_points):
+                    t_pos[i + j * num_points] = time.time() - start_time
+                    # rxx_pos_r[i + j*num_points] = dmm.measure_one()*k2000_scaling
+                    (rxx_pos_r[i + j * num_points], rxx_pos_theta[i + j * num_points]), \
+                        (rxy_pos_r[i + j * num_points], rxy_pos_theta[i + j * num_points]) = \
+                        lockins.read(('r', 'theta'))
 
             rxx_pos_line.set_data(t_pos, rxx_pos_r / (probe_current * 1e-3))
             rxy_pos_line.set_data(t_pos, rxy_pos_r / (probe_current * 1e-3))
@@ -151,12 +167,17 @@ if not base_name == '':
             source.wave_output_on()
             # time.sleep(500e-3)
             time.sleep(1)
-            for i in range(0, num_points):
-                t_neg[i + j * num_points] = time.time() - start_time
-                rxx_neg_r[i + j * num_points] = top_lockin.get_radius()
-                rxx_neg_theta[i + j * num_points] = top_lockin.get_angle()
-                rxy_neg_r[i + j * num_points] = bot_lockin.get_radius()
-                rxy_neg_theta[i + j * num_points] = bot_lockin.get_angle()
+            block = slice(j * num_points, (j + 1) * num_points)
+            if lockin_buffer_rate:
+                (t, rxx_neg_r[block], rxx_neg_theta[block]), (_, rxy_neg_r[block], rxy_neg_theta[block]) = \
+                    lockins.record(num_points)
+                t_neg[block] = t - start_time
+            else:
+                for i in range(0, num_points):
+                    t_neg[i + j * num_points] = time.time() - start_time
+                    (rxx_neg_r[i + j * num_points], rxx_neg_theta[i + j * num_points]), \
+                        (rxy_neg_r[i + j * num_points], rxy_neg_theta[i + j * num_points]) = \
+                        lockins.read(('r', 'theta'))
 
             rxx_neg_line.set_data(t_neg, rxx_neg_r / (probe_current * 1e-3))
             rxy_neg_line.set_data(t_neg, rxy_neg_r / (probe_current * 1e-3))
@@ -1,4 +1,9 @@
-import instruments
+import os
+if os.environ.get('SIMULATED_INSTRUMENTS'):  # run without hardware, see simulated_instruments.py
+    import simulated_instruments as instruments
+else:
+    import instruments
+from lockin_tools import LockinPair
 
 import numpy as np
 import matplotlib.pyplot as plt
@@ -28,6 +33,7 @@ source.connect_RS232(16)
 top_lockin.connect(6)
 bot_lockin.connect(10)
 # pg.connect()
+lockins = LockinPair(top_lockin, bot_lockin)  # snapshot R and theta from both lock-ins at once
 sb.switch(measure_assignments)
 
 
@@ -79,10 +85,7 @@ time.sleep(10)
 start_time = time.time()
 for i in range(0, num):
     t[i] = time.time() - start_time
-    rxx_r[i] = top_lockin.get_radius()
-    rxx_theta[i] = top_lockin.get_angle()
-    rxy_r[i] = bot_lockin.get_radius()
-    rxy_theta[i] = bot_lockin.get_angle()
+    (rxx_r[i], rxx_theta[i]), (rxy_r[i], rxy_theta[i]) = lockins.read(('r', 'theta'))
     rxx_pos_line.set_data(t, rxx_r/(current*1e-3))
     rxy_pos_line.set_data(t, rxy_r/(current*1e-3))
     rxx_ax.relim()
@@ -0,0 +1,74 @@
+import time
+
+import numpy as np
+
+from instrument_io import query
+
+
+class Settle:
+    # A settle delay that ends as soon as the hardware is ready rather than after a fixed sleep.
+    # wait() always sleeps for at least `minimum` (e.g. for relays to stop bouncing), then polls `ready` until it
+    # returns True or `timeout` seconds have passed since the wait began. Every wait is recorded in `history` and
+    # report() prints them so the minimums and timeouts can be tuned from real runs.
+    def __init__(self, name, minimum=0.0, timeout=1.0, poll_interval=5e-3, verbose=False):
+        self.name = name
+        self.minimum = minimum
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.verbose = verbose
+        self.history = []
+        self.timeouts = 0
+
+    def wait(self, ready=None):
+        start = time.perf_counter()
+        time.sleep(self.minimum)
+        if ready is not None:
+            while not ready():
+                if time.perf_counter() - start > self.timeout:
+                    self.timeouts += 1
+                    print(f'{self.name}: not ready after {self.timeout} s, carrying on anyway')
+                    break
+                time.sleep(self.poll_interval)
+        waited = time.perf_counter() - start
+        self.history.append(waited)
+        if self.verbose:
+            print(f'{self.name}: waited {waited * 1e3:.1f} ms')
+        return waited
+
+    def report(self):
+        if not self.history:
+            return
+        history = np.array(self.history) * 1e3
+        print(f'{self.name} settle: {len(history)} waits, mean {history.mean():.1f} ms, '
+              f'min {history.min():.1f} ms, max {history.max():.1f} ms, {self.timeouts} timeouts '
+              f'(minimum {self.minimum * 1e3:.0f} ms, timeout {self.timeout * 1e3:.0f} ms)')
+
+
+def operation_complete(*instruments):
+    # Returns a ready() check that is True once every instrument answers *OPC? with 1, i.e. has finished everything it
+    # has been sent. A failed query (e.g. a visa timeout while a long pulse is still running) just counts as not ready.
+    def ready():
+        for instrument in instruments:
+            try:
+                if query(instrument, '*OPC?') != '1':
+                    return False
+            except Exception:
+                return False
+        return True
+    return ready
+
+
+def scope_armed(scope):
+    # Ready once the DS1104Z is waiting for its trigger after single_trig().
+    def ready():
+        try:
+            return query(scope, ':TRIG:STAT?') == 'WAIT'
+        except Exception:
+            return False
+    return ready
+
+
+def all_ready(*checks):
+    def ready():
+        return all(check() for check in checks)
+    return ready
@@ -0,0 +1,671 @@
+import time
+import threading
+
+import numpy as np
+
+# Drop in stand-ins for the instruments package so the scripts can be run, benchmarked and profiled without any lab
+# hardware. Use them with
+#     import simulated_instruments as instruments
+# or run one of the scripts that checks the SIMULATED_INSTRUMENTS environment variable, e.g.
+#     SIMULATED_INSTRUMENTS=1 python Switching_GUI.py
+# Every call sleeps for a latency modelled on the real bus (fixed turnaround plus time per byte transferred) and the
+# readings come from one shared simulated sample: pulses along an arm switch its state and Rxx/Rxy step then relax,
+# there is some joule heating after each pulse and the resistance drifts with the TEC temperature.
+# The instruments also keep a fake pyvisa style resource in `.device` that answers the few SCPI queries used through
+# instrument_io (*OPC?, scope waveform downloads and so on).
+
+latency_scale = 1.0  # multiply every modelled latency, e.g. 0 to run as fast as the python allows
+rng = np.random.default_rng()
+
+
+class Latency:
+    def __init__(self, turnaround, per_byte=0.0, jitter=0.1):
+        self.turnaround = turnaround
+        self.per_byte = per_byte
+        self.jitter = jitter
+
+    def wait(self, n_bytes=0, extra=0.0):
+        delay = self.turnaround * (1 + self.jitter * rng.standard_normal())
+        delay = (max(delay, 0) + self.per_byte * n_bytes + extra) * latency_scale
+        if delay > 0:
+            time.sleep(delay)
+
+
+def error_sound():
+    print('\a', end='')
+
+
+def alert_sound():
+    print('\a', end='')
+
+
+def arm_index(letters):
+    # A to H are the arms of the star, 45 degrees apart.
+    return 'ABCDEFGH'.index(letters[0].upper())
+
+
+class Sample:
+    # Rxx and Rxy of an antiferromagnetic switching device. A pulse from arm k pushes the state towards sin(k pi/2),
+    # so pulses B->F and D->H switch in opposite directions, by an amount that saturates with the pulse current.
+    # The state then relaxes to its new value with time constant tau_switch and the joule heating decays with tau_heat.
+    def __init__(self, rxx=50.0, rxy=0.5, d_rxx=0.05, d_rxy=0.02, alpha=2e-3, threshold=15e-3, tau_switch=0.5,
+                 tau_heat=2.0, noise=2e-4):
+        self.rxx0 = rxx
+        self.rxy0 = rxy
+        self.d_rxx = d_rxx
+        self.d_rxy = d_rxy
+        self.alpha = alpha
+        self.threshold = threshold
+        self.tau_switch = tau_switch
+        self.tau_heat = tau_heat
+        self.noise = noise
+        self.temperature = 21.0
+        self.assignments = {}
+        self._state = 0.0
+        self._start_state = 0.0
+        self._heat = 0.0
+        self._pulse_t = -np.inf
+        self._lock = threading.Lock()
+
+    def state(self, t):
+        t = np.asarray(t, dtype=float)
+        return self._state + (self._start_state - self._state) * np.exp(-np.maximum(t - self._pulse_t, 0)
+                                                                          / self.tau_switch)
+
+    def heating(self, t):
+        t = np.asarray(t, dtype=float)
+        return self._heat * np.exp(-np.maximum(t - self._pulse_t, 0) / self.tau_heat)
+
+    def pulse(self, current):
+        with self._lock:
+            now = time.time()
+            start = float(self.state(now))
+            plus = self.assignments.get('I+', 'A')
+            direction = np.sin(arm_index(plus) * np.pi / 2)
+            efficiency = np.tanh(abs(current) / self.threshold) ** 4
+            self._start_state = start
+            self._state = float(np.clip(start + (direction - start) * efficiency, -1, 1))
+            self._heat = 0.01 * self.rxx0 * (current / self.threshold) ** 2
+            self._pulse_t = now
+
+    def rxx(self, t):
+        base = self.rxx0 * (1 + self.alpha * (self.temperature - 21))
+        return base + self.d_rxx * self.state(t) + self.heating(t) + self.noise * rng.standard_normal(np.shape(t))
+
+    def rxy(self, t):
+        return self.rxy0 + self.d_rxy * self.state(t) + self.noise * rng.standard_normal(np.shape(t))
+
+
+sample = Sample()
+
+
+class SimulatedResource:
+    # Enough of a pyvisa resource for instrument_io. Commands are passed to the owning instrument's scpi() method.
+    def __init__(self, owner, latency):
+        self.owner = owner
+        self.latency = latency
+
+    def write(self, command):
+        self.latency.wait(len(command))
+        self.owner.scpi(command.strip())
+
+    def query(self, command):
+        reply = self.owner.scpi(command.strip())
+        self.latency.wait(len(command) + len(str(reply)))
+        return f'{reply}\n'
+
+    def query_binary_values(self, command, datatype='f', is_big_endian=False, container=list):
+        values = np.asarray(self.owner.scpi(command.strip()))
+        self.latency.wait(len(command) + values.size * np.dtype(datatype).itemsize)
+        return container(values.astype(np.dtype(datatype)))
+
+    def close(self):
+        pass
+
+
+class SimulatedInstrument:
+    latency = Latency(5e-3)
+
+    def __init__(self):
+        self.device = None
+
+    def connect(self, *args, **kwargs):
+        self.device = SimulatedResource(self, self.latency)
+
+    def close(self):
+        self.device = None
+
+    def scpi(self, command):
+        if command == '*OPC?':
+            return 1
+        return ''
+
+
+class SwitchBox(SimulatedInstrument):
+    latency = Latency(20e-3, per_byte=1e-3)  # 9600 baud serial, roughly 1 ms per character
+
+    def switch(self, assignments):
+        self.latency.wait(sum(len(key) + len(value) + 2 for key, value in assignments.items()), extra=10e-3)
+        sample.assignments = dict(assignments)
+
+    def reset_all(self):
+        self.latency.wait(4, extra=10e-3)
+        sample.assignments = {}
+
+
+class BalanceBox(SimulatedInstrument):
+    latency = Latency(20e-3, per_byte=1e-3)
+
+    def enable_all(self):
+        self.latency.wait(4)
+
+    def disable_all(self):
+        self.latency.wait(4)
+
+    def reset_resistances(self):
+        self.latency.wait(8)
+
+    def set_resistances(self, resistances):
+        self.latency.wait(8 * len(resistances))
+
+
+class K2461(SimulatedInstrument):
+    latency = Latency(2e-3, per_byte=1e-6)  # usb
+    current_source = None
+
+    def __init__(self):
+        super(K2461, self).__init__()
+        K2461.current_source = self
+        self.probe_current = 0.0
+        self.pulse = None
+        self.nplc = 1
+        self._n = 0
+        self._trigger_t = None
+
+    def enable_4_wire_probe(self, current, *args, **kwargs):
+        self.latency.wait(40)
+        self.probe_current = current
+
+    def enable_2_wire_probe(self, current, *args, **kwargs):
+        self.latency.wait(40)
+        self.probe_current = current
+
+    def disable_probe_current(self):
+        self.latency.wait(20)
+        self.probe_current = 0.0
+
+    def enable_output_current(self):
+        self.latency.wait(20)
+
+    def disable_output_current(self):
+        self.latency.wait(20)
+
+    def prepare_pulsing_voltage(self, voltage, width, *args, **kwargs):
+        self.latency.wait(200, extra=10e-3)
+        self.pulse = (voltage / 150, width)  # roughly a 150 ohm two wire resistance
+
+    def prepare_pulsing_current(self, current, width, *args, **kwargs):
+        self.latency.wait(200, extra=10e-3)
+        self.pulse = (current, width)
+
+    def set_ext_trig(self):
+        self.latency.wait(40)
+
+    def send_pulse(self, *args):
+        if args:
+            self.prepare_pulsing_voltage(*args)
+        current, width = self.pulse
+        self.latency.wait(20, extra=width)
+        sample.pulse(current)
+        for scope in DS1104.instances:
+            scope.capture(current, width)
+
+    def pulse_current(self, current, width, *args, **kwargs):
+        self.prepare_pulsing_current(current, width)
+        self.send_pulse()
+
+    def trigger_before_fetch(self):
+        self.latency.wait(20)
+        self._trigger_t = time.time()
+
+    def fetch_one(self):
+        self.latency.wait(40, extra=self.nplc / 50)
+        t = self._trigger_t or time.time()
+        return float(sample.rxx(t) * self.probe_current), self.probe_current
+
+    def read_one(self):
+        self.latency.wait(60, extra=self.nplc / 50)
+        return self.probe_current, float(sample.rxx(time.time()) * self.probe_current)
+
+    def prepare_measure_one(self, *args, **kwargs):
+        self.latency.wait(100)
+
+    def prepare_measure_n(self, current, n, nplc=1, *args, **kwargs):
+        self.latency.wait(200, extra=10e-3)
+        self.probe_current = current
+        self.nplc = nplc
+        self._n = n
+
+    measure_n = prepare_measure_n
+
+    def trigger(self):
+        self.latency.wait(20)
+        self._trigger_t = time.time()
+
+    def read_buffer(self, n):
+        # Readings are taken every nplc mains cycles from the trigger. Wait for the last one then send them all.
+        # latency_scale scales the reading interval, so the timestamps match the time that actually passed.
+        t = np.arange(n) * (self.nplc / 50 + 1e-3) * latency_scale
+        remaining = self._trigger_t + t[-1] - time.time()
+        if remaining > 0:
+            time.sleep(remaining)
+        self.latency.wait(n * 45)
+        current = np.full(n, self.probe_current)
+        return t, sample.rxx(self._trigger_t + t) * current, current
+
+
+class K2000(SimulatedInstrument):
+    latency = Latency(15e-3, per_byte=1e-3)  # visa over rs232
+
+    def __init__(self):
+        super(K2000, self).__init__()
+        self.nplc = 1
+        self._n = 0
+        self._trigger_t = None
+
+    def prepare_measure_one(self, *args, **kwargs):
+        self.latency.wait(60)
+
+    def trigger(self):
+        self.latency.wait(8)
+        self._trigger_t = time.time()
+
+    def fetch_one(self):
+        self.latency.wait(20, extra=self.nplc / 50)
+        return float(sample.rxy(self._trigger_t or time.time()) * probe_current())
+
+    def read_one(self):
+        self.latency.wait(28, extra=self.nplc / 50)
+        return float(sample.rxy(time.time()) * probe_current())
+
+    measure_one = read_one
+
+    def prepare_measure_n(self, n, *args, nplc=1, **kwargs):
+        self.latency.wait(120)
+        self.nplc = nplc
+        self._n = n
+
+    def read_buffer(self, *args):
+        t = self._trigger_t + np.arange(self._n) * (self.nplc / 50 + 1e-3) * latency_scale  # as for the K2461
+        remaining = t[-1] - time.time()
+        if remaining > 0:
+            time.sleep(remaining)
+        self.latency.wait(self._n * 16)
+        return sample.rxy(t) * probe_current()
+
+
+def probe_current():
+    # The K2000 only measures a voltage so it borrows the current from the sourcing K2461.
+    return K2461.current_source.probe_current if K2461.current_source is not None else 1.0
+
+
+class DS1104(SimulatedInstrument):
+    latency = Latency(3e-3, per_byte=1e-6)  # usb, ascii readback is around 13 bytes per point
+    instances = []
+    memory_depth = 60000
+    trigger_index = 30000
+
+    def __init__(self):
+        super(DS1104, self).__init__()
+        DS1104.instances.append(self)
+        self.time_inc = 1e-7
+        self.ranges = {1: 1.0, 2: 1.0, 3: 1.0, 4: 1.0}
+        self.armed = False
+        self.captured = None
+        self.source = 1
+        self.start = 1
+        self.stop = 1200
+
+    def prepare_for_pulse(self, pulse_magnitude, reference_resistance, two_wire, width, *args, **kwargs):
+        self.latency.wait(400)
+        # Put the pulse across the second half of the screen with room either side.
+        self.time_inc = 3 * width / (self.memory_depth - self.trigger_index)
+        self.ranges[1] = 1.5 * pulse_magnitude * reference_resistance / (reference_resistance + two_wire)
+
+    def prepare_for_4channel_pulse(self, *args, **kwargs):
+        self.latency.wait(800)
+
+    def set_trig_chan(self, channel=1):
+        self.latency.wait(20)
+
+    def single_trig(self):
+        self.latency.wait(20)
+        self.armed = True
+
+    def capture(self, current, width):
+        if not self.armed:
+            return
+        self.armed = False
+        self.captured = (current, width, float(sample.rxx(time.time())), float(sample.rxy(time.time())))
+
+    def trace(self, channel):
+        t = (np.arange(self.memory_depth) - self.trigger_index) * self.time_inc
+        noise = 1e-3 * self.ranges[channel] * rng.standard_normal(self.memory_depth)
+        if self.captured is None:
+            return noise
+        current, width, rxx, rxy = self.captured
+        # A square pulse with a small rc rise and fall.
+        shape = (1 - np.exp(-np.clip(t, 0, None) / (width / 50))) - \
+            (1 - np.exp(-np.clip(t - width, 0, None) / (width / 50)))
+        scale = {1: 50.0, 2: rxx, 3: rxy, 4: 0.0}[channel]
+        return current * scale * shape + noise
+
+    def get_data(self, start, stop, channel=1):
+        data = self.trace(channel)[start - 1:stop]
+        self.latency.wait(13 * len(data))
+        return data
+
+    def get_time_inc(self):
+        self.latency.wait(12)
+        return str(self.time_inc)
+
+    def scpi(self, command):
+        if command == '*OPC?':
+            return 1
+        if command == ':TRIG:STAT?':
+            return 'WAIT' if self.armed else 'STOP'
+        if command == ':TIM:MAIN:SCAL?':
+            return f'{self.time_inc * self.memory_depth / 12:.6e}'
+        if command.startswith(':WAV:SOUR'):
+            self.source = int(command[-1])
+        elif command.startswith(':WAV:STAR'):
+            self.start = int(command.split()[-1])
+        elif command.startswith(':WAV:STOP'):
+            self.stop = int(command.split()[-1])
+        elif command == ':WAV:PRE?':
+            y_inc = 2 * self.ranges[self.source] / 250
+            return f'0,2,{self.stop - self.start + 1},1,{self.time_inc},0,0,{y_inc},0,127'
+        elif command == ':WAV:DATA?':
+            y_inc = 2 * self.ranges[self.source] / 250
+            volts = self.trace(self.source)[self.start - 1:self.stop]
+            return np.clip(np.round(volts / y_inc) + 127, 0, 255)
+        return ''
+
+
+class TEC1089SV(SimulatedInstrument):
+    latency = Latency(25e-3, per_byte=1e-4)  # 57600 baud serial
+    acceleration = 1.0  # speeds up the thermal model as well as the bus, e.g. for quick temperature sweeps
+    gain = 0.2  # 1/s, how quickly the controller pulls in towards the target
+    stable_window = 0.05  # K
+    stable_time = 5  # s within the window before the controller reports stable
+
+    def __init__(self):
+        super(TEC1089SV, self).__init__()
+        self.temperature = 21.0
+        self.target = 21.0
+        self.ramp_rate = None
+        self.enabled = False
+        self._last = time.time()
+        self._stable_since = None
+        self._lock = threading.Lock()
+
+    def update(self):
+        with self._lock:
+            now = time.time()
+            dt = (now - self._last) * self.acceleration
+            self._last = now
+            goal = self.target if self.enabled else 21.0
+            gain = self.gain if self.enabled else 0.01
+            error = goal - self.temperature
+            rate = gain * abs(error)
+            if self.enabled and self.ramp_rate:
+                rate = min(rate, self.ramp_rate)
+            self.temperature += np.sign(error) * min(abs(error), rate * dt)
+            sample.temperature = self.temperature
+            if self.enabled and abs(self.target - self.temperature) < self.stable_window:
+                if self._stable_since is None:
+                    self._stable_since = now
+            else:
+                self._stable_since = None
+
+    def set_target_temperature(self, target):
+        self.latency.wait(20)
+        self.update()
+        self.target = target
+
+    def get_target_temperature(self):
+        self.latency.wait(20)
+        return self.target
+
+    def set_ramp_rate(self, rate):
+        self.latency.wait(20)
+        self.ramp_rate = rate
+
+    def enable_control(self):
+        self.latency.wait(20)
+        self.update()
+        self.enabled = True
+
+    def disable_control(self):
+        self.latency.wait(20)
+        self.update()
+        self.enabled = False
+
+    def get_object_temperature(self):
+        self.latency.wait(20)
+        self.update()
+        return self.temperature + 2e-3 * rng.standard_normal()
+
+    def get_sink_temperature(self):
+        self.latency.wait(20)
+        return 25.0 + 0.01 * rng.standard_normal()
+
+    def get_output_voltage(self):
+        self.latency.wait(20)
+        return 0.5 * (self.target - self.temperature) if self.enabled else 0.0
+
+    def get_temp_stability_state(self):
+        self.latency.wait(20)
+        self.update()
+        if not self.enabled:
+            return 'not active'
+        if self._stable_since is not None and \
+                (time.time() - self._stable_since) * self.acceleration > self.stable_time:
+            return 'stable'
+        return 'not stable'
+
+
+class K6221(SimulatedInstrument):
+    latency = Latency(2e-3, per_byte=1e-6)  # ethernet
+
+    def __init__(self):
+        super(K6221, self).__init__()
+        self.points = np.array([])
+        self.delay = 1e-3
+        self.width = 0.0
+        self.diff_conductance = None
+        self._armed = False
+        self._trigger_t = None
+
+    def connect_ethernet(self, *args, **kwargs):
+        self.connect()
+
+    def connect_RS232(self, *args, **kwargs):
+        self.connect()
+
+    def set_compliance(self, compliance):
+        self.latency.wait(20)
+
+    def set_sense_chan_and_range(self, channel, volt_range):
+        self.latency.wait(40)
+
+    def configure_linear_sweep(self, start, stop, step, delay, repeats, *args, **kwargs):
+        self.latency.wait(200)
+        self.points = np.tile(np.linspace(start, stop, round((stop - start) / step) + 1), repeats)
+        self.delay = delay
+        self.diff_conductance = None
+
+    def configure_custom_sweep(self, currents, delay, compliance, repeats, bias, *args, **kwargs):
+        # The list goes over the bus as ascii, about 12 characters a point.
+        self.latency.wait(12 * len(currents) + 200)
+        self.points = np.tile(np.asarray(currents, dtype=float), repeats)
+        self.delay = delay
+        self.diff_conductance = None
+
+    def configure_pulse(self, width, *args, **kwargs):
+        self.latency.wait(80)
+        self.width = width
+
+    def configure_diff_conductance(self, start, stop, step, delta, delay, *args, **kwargs):
+        self.latency.wait(200)
+        self.points = np.linspace(start, stop, round((stop - start) / step) + 1)
+        self.delay = delay
+        self.diff_conductance = delta
+
+    def arm_pulse_sweep(self):
+        self.latency.wait(40, extra=50e-3)
+        self._armed = True
+
+    arm_diff_cond = arm_pulse_sweep
+
+    def scpi(self, command):
+        if command == 'SOUR:PDEL:ARM?':
+            return int(self._armed)
+        if command == 'TRAC:POIN:ACT?':
+            return self.points_done()
+        if command.startswith('TRAC:DATA:SEL?'):
+            start, count = (int(value) for value in command[14:].split(','))
+            voltage, t = self.readings(start, min(start + count, self.points_done()))
+            data = np.empty(2 * len(voltage))
+            data[0::2] = voltage
+            data[1::2] = t
+            return data
+        return super(K6221, self).scpi(command)
+
+    def trigger(self):
+        self.latency.wait(10)
+        if self._armed:
+            self._armed = False
+            self._trigger_t = time.time()
+
+    def duration(self):
+        return len(self.points) * (self.delay + self.width)
+
+    def points_done(self):
+        if self._trigger_t is None:
+            return 0
+        return int(min(len(self.points), (time.time() - self._trigger_t) / max(self.delay + self.width, 1e-9)))
+
+    def readings(self, start=0, stop=None):
+        t = np.arange(len(self.points)) * (self.delay + self.width)
+        currents = self.points
+        if self.diff_conductance is not None:
+            voltage = self.diff_conductance * (sample.rxx(self._trigger_t + t) + 2e3 * currents ** 2)
+        else:
+            voltage = currents * sample.rxy(self._trigger_t + t) + 5e2 * currents ** 3 * (self.width > 0)
+        return voltage[start:stop], t[start:stop]
+
+    def get_trace(self, delay=1, *args, **kwargs):
+        # Like the real one this just waits until the sweep is done.
+        while self.points_done() < len(self.points):
+            time.sleep(min(delay, 0.1) * latency_scale)
+        voltage, t = self.readings()
+        data = np.empty(2 * len(voltage))
+        data[0::2] = voltage
+        data[1::2] = t
+        self.latency.wait(30 * len(voltage))
+        return data
+
+    def sine_wave(self, frequency, amplitude, *args, **kwargs):
+        self.latency.wait(80)
+
+    def set_phase_marker(self, *args, **kwargs):
+        self.latency.wait(40)
+
+    def wave_output_on(self):
+        self.latency.wait(20)
+
+    def wave_output_off(self):
+        self.latency.wait(20)
+
+
+class SR830_RS232(SimulatedInstrument):
+    latency = Latency(10e-3, per_byte=1.04e-3)  # 9600 baud
+
+    def __init__(self):
+        super(SR830_RS232, self).__init__()
+        self.harmonic = 1
+        self.time_constant = 0.1
+        self.buffer_rate = 512.0
+        self.buffer_start = None  # time the internal buffer was started
+        self.buffer_stop = None  # time it was paused, None while running
+
+    def set_harmonic(self, harmonic):
+        self.latency.wait(8)
+        self.harmonic = harmonic
+
+    def set_time_constant(self, time_constant):
+        self.latency.wait(8)
+        self.time_constant = time_constant
+
+    def set_phase(self, phase):
+        self.latency.wait(10)
+
+    def set_sensitivity(self, sensitivity):
+        self.latency.wait(8)
+
+    def set_filter(self, slope):
+        self.latency.wait(8)
+
+    def auto_phase(self):
+        self.latency.wait(6, extra=1)
+
+    def auto_range(self):
+        self.latency.wait(6, extra=1)
+
+    def radius(self, t):
+        # Second harmonic signal follows the state of the sample through the lock-in time constant.
+        return 1e-6 * (1 + 0.1 * sample.state(t - self.time_constant)) + 1e-9 * rng.standard_normal(np.shape(t))
+
+    def angle(self, t):
+        return -90 + 0.5 * rng.standard_normal(np.shape(t))
+
+    def get_radius(self):
+        self.latency.wait(20)
+        return float(self.radius(time.time()))
+
+    def get_angle(self):
+        self.latency.wait(20)
+        return float(self.angle(time.time()))
+
+    def scpi(self, command):
+        if command.startswith('SNAP?'):
+            now = time.time()
+            r = float(self.radius(now))
+            theta = float(self.angle(now))
+            values = {1: r * np.cos(np.radians(theta)), 2: r * np.sin(np.radians(theta)), 3: r, 4: theta}
+            return ','.join(f'{values[int(code)]:.6e}' for code in command[5:].split(','))
+        # Internal data buffer with channel 1 showing R and channel 2 theta (DDEF 1,1,0 and DDEF 2,1,0).
+        if command.startswith('SRAT'):
+            self.buffer_rate = 2.0 ** (int(command[4:]) - 4)
+        elif command == 'REST':
+            self.buffer_start = None
+            self.buffer_stop = None
+        elif command == 'STRT':
+            self.buffer_start = time.time()
+            self.buffer_stop = None
+        elif command == 'PAUS':
+            self.buffer_stop = time.time()
+        elif command == 'SPTS?':
+            return self.buffer_points()
+        elif command.startswith('TRCB?'):
+            channel, start, count = (int(value) for value in command[5:].split(','))
+            t = self.buffer_start + (start + np.arange(min(count, self.buffer_points() - start))) / self.buffer_rate
+            return self.radius(t) if channel == 1 else self.angle(t)
+        return super(SR830_RS232, self).scpi(command)
+
+    def buffer_points(self):
+        if self.buffer_start is None:
+            return 0
+        end = time.time() if self.buffer_stop is None else self.buffer_stop
+        return min(int((end - self.buffer_start) * self.buffer_rate) + 1, 16383)
@@ -0,0 +1,107 @@
+import time
+
+import numpy as np
+
+from acquisition import ParallelReader, in_sequence
+from data_store import ColumnStore
+from settle import Settle
+from tec_tools import StabilityWaiter, print_progress
+
+
+class RampSweep:
+    # Measures a set of switch box assignments in round robin while the TEC ramps continuously to a target.
+    # Every visit to an assignment switches (unless it is already switched in), waits a short relay settle, turns the
+    # probe current on and takes points_per_visit readings of the k2461 and k2000 together as fast as they go, so the
+    # number of points per kelvin is set by ramp_rate and the measurement rate rather than by fixed pauses. The tec is
+    # read once per round and the temperature of every point is interpolated from those readings.
+    #     sweep = RampSweep(sb, pg, dmm, tec, (meas_ass1, meas_ass2), probe_current=100e-6)
+    #     sweep.run(target=21, ramp_rate=0.005, hold_time=600, on_round=update_plots)
+    #     t, temperature, r1, r2 = sweep.channel(0)
+    # r1 is the k2461 voltage and r2 the k2000 voltage over the probe current. sb can be None with one assignment
+    # that is already switched.
+    def __init__(self, sb, pg, dmm, tec, assignments, probe_current, points_per_visit=1, switch_settle=None,
+                 tolerance=0.05, window=20):
+        self.sb = sb
+        self.pg = pg
+        self.dmm = dmm
+        self.tec = tec
+        self.assignments = tuple(assignments)
+        self.probe_current = probe_current
+        self.points_per_visit = points_per_visit
+        self.switch_settle = switch_settle or Settle('Switch', minimum=50e-3)
+        self.tolerance = tolerance
+        self.window = window
+        self.points = ColumnStore(('time', 'channel', 'r1', 'r2'))
+        self.temperatures = ColumnStore(('time', 'temperature'), capacity=256)
+        self.reader = ParallelReader()
+        self._switched = None
+        self._reads = [in_sequence(pg.trigger_before_fetch, pg.fetch_one), in_sequence(dmm.trigger, dmm.fetch_one)]
+
+    def run(self, target, ramp_rate=None, hold_time=0, on_round=None, stop=None, progress=print_progress,
+            timeout=None):
+        # Ramps to target (at ramp_rate if given) measuring all the way, carries on for hold_time seconds once the
+        # temperature is stable and returns True. Stops early, always at the end of a round, and returns False if
+        # stop() returns True or, like StabilityWaiter.wait(), if it is still not stable `timeout` seconds after the
+        # start. What was measured is kept either way. on_round(sweep) is called after every round, e.g. to update
+        # plots.
+        if ramp_rate is not None:
+            self.tec.set_ramp_rate(ramp_rate)
+        self.tec.set_target_temperature(target)
+        self.tec.enable_control()
+        stability = StabilityWaiter(self.tec, target, tolerance=self.tolerance, window=self.window, progress=progress)
+        self.dmm.prepare_measure_one()
+        start = time.time()
+        stable_since = None
+        finished = False
+        self._switched = None
+        self._read_temperature(stability)
+        while True:
+            for channel, assignment in enumerate(self.assignments):
+                self._visit(channel, assignment)
+            if self._read_temperature(stability) and stable_since is None:
+                stable_since = time.time()
+                print(f'Temperature stable at {target} C. Measuring for {hold_time} s')
+            if on_round is not None:
+                on_round(self)
+            if stable_since is not None and time.time() - stable_since >= hold_time:
+                finished = True
+                break
+            if stable_since is None and timeout is not None and time.time() - start > timeout:
+                print(f'Temperature not stable at {target} C after {timeout} s '
+                      f'(at {stability.temperature:.3f} C, controller says {stability.state})')
+                break
+            if stop is not None and stop():
+                break
+        self.pg.disable_probe_current()
+        self.switch_settle.report()
+        return finished
+
+    def _read_temperature(self, stability):
+        stable = stability.poll()
+        self.temperatures.append(stability.times[-1], stability.temperature)
+        return stable
+
+    def _visit(self, channel, assignment):
+        if channel != self._switched:
+            if self.sb is not None:
+                self.pg.disable_probe_current()
+                self.sb.switch(assignment)
+                self.switch_settle.wait()
+            self.pg.enable_4_wire_probe(self.probe_current)
+            self._switched = channel
+        for _ in range(self.points_per_visit):
+            t = time.time()
+            (v1, curr), v2 = self.reader.read(*self._reads)
+            self.points.append(t, channel, v1 / curr, v2 / curr)
+
+    def channel(self, channel):
+        # Returns time, temperature, r1 and r2 for one assignment (by its index), with temperatures interpolated from
+        # the tec readings taken between rounds.
+        selected = self.points['channel'] == channel
+        t = self.points['time'][selected]
+        temperature = np.interp(t, self.temperatures['time'], self.temperatures['temperature'])
+        return t, temperature, self.points['r1'][selected], self.points['r2'][selected]
+
+    def points_per_kelvin(self):
+        span = np.ptp(self.temperatures['temperature']) if len(self.temperatures) else 0
+        return len(self.points) / len(self.assignments) / span if span else np.nan
@@ -0,0 +1,162 @@
+def relays(assignment):
+    # The connections an assignment makes as a set of (terminal, pin) pairs, one per relay closed,
+    # e.g. {"I+": "BD", "I-": "FH"} -> {('I+', 'B'), ('I+', 'D'), ('I-', 'F'), ('I-', 'H')}.
+    return {(terminal, pin) for terminal, pins in assignment.items() for pin in pins}
+
+
+def relay_changes(assignment, other):
+    # Number of relays that have to open or close to go from one assignment to the other.
+    return len(relays(assignment) ^ relays(other))
+
+
+class StatefulSwitchBox:
+    # Wraps a SwitchBox and remembers what it is switched to so asking for the assignment that is already made does
+    # nothing: no command, no relay clicks and, if a settle is given, no settle wait.
+    #     sb = StatefulSwitchBox(instruments.SwitchBox(), settle=Settle('Switch', minimum=100e-3))
+    #     sb.connect(3)
+    #     if sb.switch(measure_assignments):
+    #         ...only needed after a real switch...
+    # switch() returns True if it switched and False if it was skipped. The SwitchBox only takes whole assignments so
+    # a switch that changes anything still sends the full assignment, but the relays it changes are counted and
+    # report() prints the totals. Everything else is passed on to the switch box. connect() and close() forget the
+    # state, call invalidate() if anything else has switched the box.
+    def __init__(self, sb, settle=None):
+        self.wrapped = sb
+        self.settle = settle
+        self.assignment = None
+        self.switches = 0
+        self.skipped = 0
+        self.relay_changes = 0
+
+    def __getattr__(self, name):
+        return getattr(self.wrapped, name)
+
+    def switch(self, assignment):
+        if self.assignment is not None and relays(assignment) == relays(self.assignment):
+            self.skipped += 1
+            return False
+        self.relay_changes += len(relays(assignment) ^ relays(self.assignment or {}))
+        self.wrapped.switch(assignment)
+        self.assignment = dict(assignment)
+        self.switches += 1
+        if self.settle is not None:
+            self.settle.wait()
+        return True
+
+    def invalidate(self):
+        self.assignment = None
+
+    def connect(self, *args, **kwargs):
+        self.invalidate()
+        return self.wrapped.connect(*args, **kwargs)
+
+    def reset_all(self):
+        result = self.wrapped.reset_all()
+        self.assignment = {}
+        return result
+
+    def close(self):
+        self.invalidate()
+        return self.wrapped.close()
+
+    def report(self):
+        print(f'Switch box: {self.switches} switches changing {self.relay_changes} relays, '
+              f'{self.skipped} switches skipped as already made')
+
+
+def path_changes(assignments, order, start=None):
+    # Relays changed going through assignments in the given order, starting from `start` (nothing connected if None).
+    previous = start or {}
+    changes = 0
+    for index in order:
+        changes += relay_changes(previous, assignments[index])
+        previous = assignments[index]
+    return changes
+
+
+def plan_order(assignments, start=None, exact_limit=10):
+    # Order (a list of indices into assignments) that visits every assignment with the fewest relay changes, starting
+    # from `start`. Up to exact_limit assignments the best order is found exactly (Held-Karp, n^2 2^n steps), for
+    # more a nearest neighbour path is improved with 2-opt moves until none helps.
+    n = len(assignments)
+    if n < 2:
+        return list(range(n))
+    distance = [[relay_changes(a, b) for b in assignments] for a in assignments]
+    first = [relay_changes(start or {}, assignment) for assignment in assignments]
+    if n <= exact_limit:
+        return _held_karp(distance, first)
+    order = _nearest_neighbour(distance, first)
+    return _two_opt(order, distance, first)
+
+
+def _held_karp(distance, first):
+    n = len(first)
+    # best[visited][last] = (changes, previous) for the cheapest path through the set `visited` that ends at `last`
+    best = [dict() for _ in range(1 << n)]
+    for i in range(n):
+        best[1 << i][i] = (first[i], None)
+    for visited in range(1, 1 << n):
+        for last, (changes, _) in best[visited].items():
+            for following in range(n):
+                if visited & (1 << following):
+                    continue
+                key = visited | (1 << following)
+                total = changes + distance[last][following]
+                if following not in best[key] or total < best[key][following][0]:
+                    best[key][following] = (total, last)
+    everything = (1 << n) - 1
+    last = min(best[everything], key=lambda i: best[everything][i][0])
+    order = []
+    visited = everything
+    while last is not None:
+        order.append(last)
+        last, visited = best[visited][last][1], visited & ~(1 << last)
+    return order[::-1]
+
+
+def _nearest_neighbour(distance, first):
+    remaining = set(range(len(first)))
+    current = min(remaining, key=lambda i: first[i])
+    order = [current]
+    remaining.remove(current)
+    while remaining:
+        current = min(remaining, key=lambda i: distance[current][i])
+        order.append(current)
+        remaining.remove(current)
+    return order
+
+
+def _two_opt(order, distance, first):
+    def cost(path):
+        return first[path[0]] + sum(distance[a][b] for a, b in zip(path, path[1:]))
+
+    best = cost(order)
+    improved = True
+    while improved:
+        improved = False
+        for i in range(len(order) - 1):
+            for j in range(i + 1, len(order)):
+                candidate = order[:i] + order[i:j + 1][::-1] + order[j + 1:]
+                changes = cost(candidate)
+                if changes < best:
+                    order, best, improved = candidate, changes, True
+    return order
+
+
+def print_plan(assignments, order, start=None, switch_time=0.0, relay_time=10e-3):
+    # Prints the relay changes and estimated switching time of the planned order against going through the
+    # assignments as listed. switch_time is the fixed cost of a switch (command and settle), skipped when two
+    # assignments in a row are the same, and relay_time the time per relay changed.
+    def estimate(path):
+        changes = path_changes(assignments, path, start)
+        previous, switches = start, 0
+        for index in path:
+            switches += previous is None or relay_changes(previous, assignments[index]) > 0
+            previous = assignments[index]
+        return changes, switches * switch_time + changes * relay_time
+
+    listed_changes, listed_time = estimate(range(len(assignments)))
+    planned_changes, planned_time = estimate(order)
+    print(f'Switching order {list(order)}: {planned_changes} relay changes instead of {listed_changes}, '
+          f'~{planned_time:.2f} s of switching instead of {listed_time:.2f} s '
+          f'(saves {listed_time - planned_time:.2f} s per pass)')
@@ -0,0 +1,134 @@
+import argparse
+import os
+import sys
+import time
+
+from data_store import RunFile
+from experiment import Experiment, ExperimentRunner, HeadlessRig, load_experiment, read_description, switching_steps
+from instrument_trace import TraceLog
+from tec_tools import StabilityWaiter, print_progress
+
+# Runs a switching experiment without the gui: no Qt, no matplotlib and no dialogs, everything comes from a config
+# file and the data goes straight into a run file (see data_store.RunFile) as it is measured, e.g. for overnight runs
+# or several runs from a batch file:
+#     python switching_cli.py run_config.json [--output run.npz] [--overwrite]
+# The config is json (or yaml with PyYAML installed), all values in SI units:
+#     {"experiment": "switching_experiment.json",    a file (relative to the config) or the description itself,
+#                                                    or "loops": n with pulse, measure and assignments for the
+#                                                    standard protocol
+#      "ports": {"sb": 3, "dmm": 6},                 plus "bb" and "tec" if used
+#      "buffered": false, "scope": false,
+#      "balance_box": {"A": 0, "B": 0, ...},         resistances, leave out to not use the balance box
+#      "tec": {"target": 25, "tolerance": 0.05, "timeout": 3600},   leave out to not use the tec
+#      "output": "run.npz"}                          an existing run there is only replaced with --overwrite
+# It exits with one of these status codes so a batch file or scheduler can tell what happened.
+exit_ok = 0
+exit_bad_config = 1
+exit_connection_failed = 2
+exit_not_stable = 3
+exit_interrupted = 4
+exit_run_failed = 5
+
+
+def build_experiment(config, config_dir):
+    if 'experiment' in config:
+        description = config['experiment']
+        if isinstance(description, str):
+            return load_experiment(os.path.join(config_dir, description))
+        return Experiment.from_dict(description)
+    return Experiment(switching_steps(config['loops']), config['assignments'], config.get('pulse'),
+                      config.get('measure'))
+
+
+def dataset_columns(experiment, scope=False, tec=False, scope_channels=(1,)):
+    # Column names of every dataset the experiment will write. Scope channels after the first (the shunt resistor)
+    # are given as ch<n> volts.
+    columns = {}
+    for step, _, _ in experiment.flatten():
+        if 'measure' in step:
+            columns[step['measure']] = ('time', 'rxx', 'rxy')
+            if tec:
+                columns[f'{step["measure"]}_tec'] = ('time', 'temperature')
+        elif 'scope' in step and scope:
+            columns[step['scope']] = ('time', 'current') + tuple(f'ch{channel}' for channel in scope_channels[1:])
+    return columns
+
+
+def wait_for_temperature(rig, tec_config):
+    rig.tec.set_target_temperature(tec_config['target'])
+    rig.tec.enable_control()
+    stability = StabilityWaiter(rig.tec, tec_config['target'], tolerance=tec_config.get('tolerance', 0.05),
+                                interval=1, timeout=tec_config.get('timeout', 3600), progress=print_progress)
+    return stability.wait()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run a switching experiment from a config file without the gui.')
+    parser.add_argument('config', help='json or yaml config file')
+    parser.add_argument('--output', help='run file to write, overrides "output" in the config')
+    parser.add_argument('--overwrite', action='store_true', help='replace the output if it already exists')
+    args = parser.parse_args(argv)
+
+    try:
+        config = read_description(args.config)
+        experiment = build_experiment(config, os.path.dirname(os.path.abspath(args.config)))
+    except (OSError, ValueError, KeyError, TypeError, ImportError) as error:
+        print(f'Bad config {args.config}: {error!r}')
+        return exit_bad_config
+    needed = ['sb', 'dmm'] + ['bb'] * ('balance_box' in config) + ['tec'] * ('tec' in config)
+    missing = [name for name in needed if name not in config.get('ports', {})]
+    if missing:
+        print(f'Bad config {args.config}: no port given for {", ".join(missing)}')
+        return exit_bad_config
+    output = args.output or config.get('output', 'run.npz')
+    existing = [name for name in (output, f'{output}.bin', f'{output}.idx') if os.path.exists(name)]
+    if existing and not args.overwrite:
+        print(f'Bad config {args.config}: {existing[0]} already exists, pass --overwrite to replace it')
+        return exit_bad_config
+
+    rig = HeadlessRig(TraceLog.from_environment())
+    run_file = None
+    try:
+        if not rig.connect(config, experiment):
+            return exit_connection_failed
+        if 'tec' in config:
+            if not wait_for_temperature(rig, config['tec']):
+                return exit_not_stable
+            rig.tec_enabled = True
+            rig.tec_sampler.start()
+
+        for name in existing:
+            os.remove(name)
+        run_file = RunFile(output, {'config': config, 'experiment': experiment.to_dict(), 'start_time': time.time()})
+        columns = dataset_columns(experiment, rig.scope_enabled, rig.tec_enabled, rig.scope_channels)
+        for dataset, names in columns.items():
+            run_file.declare(dataset, names)
+        runner = ExperimentRunner(rig, experiment, on_data=run_file.append)
+        print(f'Writing to {output}')
+        try:
+            runner.run()
+        except KeyboardInterrupt:
+            print(f'Stopped, data so far is in {output}')
+            return exit_interrupted
+        except Exception as error:
+            print(f'Run failed: {error!r}, data so far is in {output}')
+            return exit_run_failed
+        runner.report()
+        for settle in (rig.pre_pulse_settle, rig.post_pulse_settle, rig.measure_settle):
+            settle.report()
+        rig.sb.report()
+        print(f'Data saved as {output}')
+        return exit_ok
+    except KeyboardInterrupt:
+        print('Stopped before the run started')
+        return exit_interrupted
+    finally:
+        if run_file is not None:
+            run_file.close()
+        rig.close()
+        if rig.trace_log is not None:
+            rig.trace_log.flush()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+
+# Kept apart from data_store so only the scripts that write HDF5 tables need pandas and PyTables.
+
+
+class TableWriter:
+    # Appends blocks of rows to a table in an HDF5 file (pandas HDFStore in table format) so a long run costs the same
+    # per block however much has already been taken, instead of rebuilding and rewriting one big DataFrame each time.
+    # `columns` maps each column name to float or 'category'. Category columns (assignment names, row types...) are
+    # stored as small integer codes and their possible values have to be given up front in `categories` so every
+    # block is encoded the same way. Columns missing from a block are filled with NaN, single values are repeated.
+    #     writer = TableWriter('run.h5', {'t': float, 'V': float, 'type': 'category'}, {'type': ['pre', 'probe']})
+    #     writer.append(t=t, V=v, type='probe')
+    #     writer.close()
+    # pd.read_hdf('run.h5', 'data') reads the whole table back, even while it is still being written.
+    def __init__(self, path, columns, categories=None, key='data', mode='w'):
+        self.path = path
+        self.key = key
+        self.columns = dict(columns)
+        self.categories = {name: list(values) for name, values in (categories or {}).items()}
+        for name, dtype in self.columns.items():
+            if dtype == 'category' and name not in self.categories:
+                raise ValueError(f'No categories given for category column {name}')
+        self.rows = 0
+        self._store = pd.HDFStore(path, mode=mode)
+
+    def append(self, **block):
+        unknown = set(block) - set(self.columns)
+        if unknown:
+            raise ValueError(f'Unknown columns {", ".join(sorted(unknown))}')
+        n = max((np.size(value) for value in block.values()), default=0)
+        data = {}
+        for name, dtype in self.columns.items():
+            value = block.get(name)
+            if dtype == 'category':
+                values = np.broadcast_to(np.asarray(value, dtype=object), n)
+                data[name] = pd.Categorical(values, categories=self.categories[name])
+                if data[name].isna().sum() > pd.isna(values).sum():
+                    raise ValueError(f'{name} has values that are not in its categories {self.categories[name]}')
+            else:
+                data[name] = np.broadcast_to(np.asarray(np.nan if value is None else value, dtype=dtype), n)
+        self._store.append(self.key, pd.DataFrame(data), format='table', index=False)
+        self._store.flush()
+        self.rows += n
+
+    def put(self, key, frame):
+        # Stores another (small) DataFrame in the same file, e.g. the run parameters.
+        self._store.put(key, frame)
+
+    def close(self):
+        self._store.close()
@@ -0,0 +1,162 @@
+import threading
+import time
+
+import numpy as np
+
+from data_store import ColumnStore
+
+
+class TecSampler:
+    # Logs the TEC1089SV object temperature on a background thread at its own rate so the measurement loop never waits
+    # on the serial port for it. Temperatures at the measurement times are interpolated from the log afterwards:
+    #     sampler = TecSampler(tec, interval=0.25)
+    #     sampler.start()
+    #     ...measure, recording t...
+    #     temperature = sampler.interpolate(t)
+    #     sampler.stop()
+    # While it is running nothing else should talk to the tec.
+    def __init__(self, tec, interval=0.25):
+        self.tec = tec
+        self.interval = interval
+        self.samples = ColumnStore(('time', 'temperature'))
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        with self._lock:
+            self.samples.clear()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='tec-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            start = time.time()
+            try:
+                temperature = self.tec.get_object_temperature()
+            except Exception as error:
+                print(f'TEC sampler: could not read temperature ({error})')
+            else:
+                # The reading is taken somewhere during the query so stamp it with the middle of the round trip.
+                with self._lock:
+                    self.samples.append((start + time.time()) / 2, temperature)
+            self._stop.wait(max(self.interval - (time.time() - start), 0))
+
+    def latest(self):
+        # Returns (time, temperature) of the newest sample or None if there is none yet.
+        with self._lock:
+            if not len(self.samples):
+                return None
+            return self.samples['time'][-1], self.samples['temperature'][-1]
+
+    def history(self):
+        # Copies of all sample times and temperatures since start().
+        with self._lock:
+            return self.samples['time'].copy(), self.samples['temperature'].copy()
+
+    def interpolate(self, times, timeout=None):
+        # Temperatures at the given (unix) times. Waits up to `timeout` (default two sample intervals) for a sample
+        # later than the last time so the end of a block is interpolated rather than held at the last reading.
+        times = np.asarray(times)
+        if self.running and len(times):
+            deadline = time.time() + (2 * self.interval if timeout is None else timeout)
+            while time.time() < deadline:
+                latest = self.latest()
+                if latest is not None and latest[0] >= times[-1]:
+                    break
+                time.sleep(self.interval / 10)
+        sample_times, temperatures = self.history()
+        if not len(sample_times):
+            return np.full(times.shape, np.nan)
+        return np.interp(times, sample_times, temperatures)
+
+
+class StabilityWaiter:
+    # Decides when the TEC has settled at `target`. Each poll() reads the object temperature and the controller's
+    # stability state together, fits a straight line to the last `window` seconds of temperatures and reports
+    # progress(temperature, rate, eta) with the rate in K/s and the estimated seconds until stable (nan if it is not
+    # converging). The temperature counts as stable once the window is full, the temperature is within `tolerance` of
+    # the target and the fitted drift over the window is smaller than `tolerance`, or as soon as the
+    # controller itself reports 'stable' if trust_controller is set.
+    # poll() can be called from a measurement loop that keeps going until the temperature settles,
+    #     while not stability.poll():
+    #         ...measure...
+    # and wait() just polls every `interval` seconds until stable, returning False on a timeout or if stop() is True.
+    def __init__(self, tec, target, tolerance=0.05, window=20, interval=0.5, timeout=None, progress=None,
+                 trust_controller=True):
+        self.tec = tec
+        self.target = target
+        self.tolerance = tolerance
+        self.window = window
+        self.interval = interval
+        self.timeout = timeout
+        self.progress = progress
+        self.trust_controller = trust_controller
+        self.times = []
+        self.temperatures = []
+        self.temperature = np.nan
+        self.rate = np.nan
+        self.eta = np.nan
+        self.state = None
+
+    def poll(self):
+        now = time.time()
+        self.temperature = self.tec.get_object_temperature()
+        self.state = self.tec.get_temp_stability_state()
+        self.times.append(now)
+        self.temperatures.append(self.temperature)
+        while self.times[0] < now - self.window:
+            del self.times[0]
+            del self.temperatures[0]
+
+        stable = self.trust_controller and self.state == 'stable'
+        if len(self.times) > 2:
+            self.rate = np.polyfit(np.array(self.times) - now, self.temperatures, 1)[0]
+            error = self.temperature - self.target
+            # Rate at which the error is shrinking. Fine for a ramp and pessimistic for the exponential tail.
+            closing = -np.sign(error) * self.rate
+            if abs(error) < self.tolerance:
+                self.eta = max(self.times[0] + self.window - now, 0)
+            elif closing > 0:
+                self.eta = (abs(error) - self.tolerance) / closing
+            else:
+                self.eta = np.nan
+            window_full = now - self.times[0] >= 0.9 * self.window
+            stable = stable or (window_full and abs(error) < self.tolerance and
+                                abs(self.rate) * self.window < self.tolerance)
+        if stable:
+            self.eta = 0.0
+        if self.progress is not None:
+            self.progress(self.temperature, self.rate, self.eta)
+        return stable
+
+    def wait(self, stop=None):
+        start = time.time()
+        while not self.poll():
+            if self.timeout is not None and time.time() - start > self.timeout:
+                print(f'Temperature not stable at {self.target} C after {self.timeout} s '
+                      f'(at {self.temperature:.3f} C, controller says {self.state})')
+                return False
+            if stop is not None and stop():
+                return False
+            time.sleep(self.interval)
+        return True
+
+
+def print_progress(temperature, rate, eta):
+    # A progress callback for StabilityWaiter in scripts without a gui.
+    eta_text = 'not converging' if np.isnan(eta) else f'stable in ~{eta:.0f} s'
+    print(f'T = {temperature:.3f} C, {rate * 60:+.3f} C/min, {eta_text}')